@@ -0,0 +1,146 @@
+# admission.py
+import os
+import math
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Admission configuration
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "1") == "1"
+# Deadline for requests that do not send one; 0 admits them without a check
+ADMISSION_DEFAULT_DEADLINE_S = float(os.getenv("ADMISSION_DEFAULT_DEADLINE_S", "0"))
+ADMISSION_EWMA_ALPHA = float(os.getenv("ADMISSION_EWMA_ALPHA", "0.2"))
+# How often waiters check for a cancelled job or a disconnected client
+CANCEL_POLL_S = 0.25
+
+# Stages on the pipeline's critical path, in order; a tuple of chains runs
+# in parallel and costs as much as its slowest chain
+CRITICAL_PATH = ("story", "story_post_process", (("image", "overlay"), ("mcqs",)), "comic_page", "upload")
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request is not expected to finish within its deadline"""
+
+    def __init__(self, estimate: float, deadline: float, retry_after: int):
+        super().__init__(f"Estimated completion in {estimate:.1f}s exceeds the {deadline:.1f}s deadline")
+        self.estimate = estimate
+        self.deadline = deadline
+        self.retry_after = retry_after
+
+
+class JobCancelled(Exception):
+    """Raised in place of a result when a job was cancelled or ran out of time"""
+
+
+class AdmissionController:
+    """
+    Predicts when a new request would finish from the current load.
+
+    Pipeline stages report when they start and finish; the controller keeps
+    the in-flight count of each stage kind (all image_N stages share
+    "image") and an EWMA of the durations of the ones that succeeded. A
+    request's service time is the sum of the EWMAs along CRITICAL_PATH.
+    When every scheduler worker is busy, the first one frees up once the
+    most advanced running job finishes: the least remaining path time from
+    any stage in flight. Every further wave of queued jobs costs a full
+    service time. Until a request has run there is nothing to estimate
+    from, so all are admitted.
+    """
+
+    def __init__(self, alpha: float = ADMISSION_EWMA_ALPHA):
+        self.alpha = alpha
+        self._inflight = defaultdict(int)
+        self._latency = {}
+        self._lock = threading.Lock()
+        self.counters = {"admitted": 0, "rejected": 0}
+
+    def stage_started(self, stage: str) -> None:
+        with self._lock:
+            self._inflight[stage] += 1
+
+    def stage_finished(self, stage: str, seconds: float, succeeded: bool = True) -> None:
+        with self._lock:
+            self._inflight[stage] -= 1
+            if not succeeded:
+                # Failed and cancelled stages say nothing about normal latency
+                return
+            previous = self._latency.get(stage)
+            self._latency[stage] = seconds if previous is None else previous + self.alpha * (seconds - previous)
+
+    def service_estimate(self) -> Optional[float]:
+        """Expected seconds from a job starting to it finishing; None before any data"""
+        with self._lock:
+            if not self._latency:
+                return None
+            return self._path_time(CRITICAL_PATH)
+
+    def estimate(self, ahead: int, workers: int) -> Optional[float]:
+        """Expected seconds until a job submitted behind `ahead` others finishes"""
+        with self._lock:
+            if not self._latency:
+                return None
+            service = self._path_time(CRITICAL_PATH)
+            remaining = self._remaining_times()
+            soonest = min((remaining.get(stage, service) for stage, count in self._inflight.items() if count),
+                          default=service)
+        waves = math.ceil(max(0, ahead - workers + 1) / max(1, workers))
+        if not waves:
+            return service
+        return min(soonest, service) + (waves - 1) * service + service
+
+    def admit(self, deadline: Optional[float], ahead: int, workers: int) -> Optional[float]:
+        """
+        Return the completion estimate, or raise DeadlineExceeded.
+
+        deadline is in seconds from now; None or 0 always admits.
+        """
+        estimate = self.estimate(ahead, workers)
+        if ADMISSION_ENABLED and deadline and estimate is not None and estimate > deadline:
+            with self._lock:
+                self.counters["rejected"] += 1
+            # Roughly when the jobs ahead will have drained enough
+            retry_after = max(1, int(estimate - deadline))
+            logger.warning(f"Rejecting request: estimated {estimate:.1f}s, deadline {deadline:.1f}s")
+            raise DeadlineExceeded(estimate, deadline, retry_after)
+        with self._lock:
+            self.counters["admitted"] += 1
+        return estimate
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": ADMISSION_ENABLED,
+                **self.counters,
+                "inflight": {stage: count for stage, count in self._inflight.items() if count},
+                "latency_ewma": {stage: round(seconds, 3) for stage, seconds in self._latency.items()},
+                "service_estimate": round(self._path_time(CRITICAL_PATH), 3) if self._latency else None
+            }
+
+    def _remaining_times(self, path=CRITICAL_PATH, after: float = 0.0) -> Dict[str, float]:
+        """Seconds from the start of each stage on the path to the end of the request"""
+        remaining = {}
+        for step in reversed(path):
+            if isinstance(step, tuple):
+                for chain in step:
+                    remaining.update(self._remaining_times(chain, after))
+                after += max(self._path_time(chain) for chain in step)
+            else:
+                after += self._latency.get(step, 0.0)
+                remaining[step] = after
+        return remaining
+
+    def _path_time(self, path) -> float:
+        total = 0.0
+        for step in path:
+            if isinstance(step, tuple):
+                total += max(self._path_time(chain) for chain in step)
+            else:
+                total += self._latency.get(step, 0.0)
+        return total
+
+
+admission_controller = AdmissionController()
@@ -0,0 +1,379 @@
+# batching.py
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Iterator, List
+from uuid import uuid4
+
+from vllm import SamplingParams
+
+from load_model import llm_engine_lock
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# LLM batching configuration
+LLM_BATCH_WINDOW_MS = float(os.getenv("LLM_BATCH_WINDOW_MS", "10"))
+LLM_BATCH_TOKEN_BUDGET = int(os.getenv("LLM_BATCH_TOKEN_BUDGET", "16384"))
+CHARS_PER_TOKEN = 4
+
+
+class MicroBatcher:
+    """
+    Collect work items from many threads and process them in batches.
+
+    A batch is flushed once `max_wait_ms` has passed since its first item
+    arrived, or as soon as the summed `cost_fn` of the pending items reaches
+    `max_batch_cost`. `process_batch` receives the list of items and must
+    return one result per item, in order. A result may be a Future, which
+    resolves that item later; the batching thread then moves straight on
+    to the next batch instead of waiting for this one to finish.
+    """
+
+    def __init__(self, process_batch: Callable[[List], List],
+                 max_wait_ms: float,
+                 max_batch_cost: float,
+                 cost_fn: Callable = lambda item: 1,
+                 name: str = "batcher"):
+        self.process_batch = process_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_cost = max_batch_cost
+        self.cost_fn = cost_fn
+        self.name = name
+        self._pending = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item) -> Future:
+        """Queue an item and return a future for its result"""
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"{self.name} is closed")
+            self._pending.append((item, future, self.cost_fn(item), time.monotonic()))
+            self._cond.notify()
+        return future
+
+    @property
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def close(self) -> None:
+        """Stop the batching thread, failing anything still queued"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout=5)
+
+    def _take_batch(self) -> List:
+        with self._cond:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                for _, future, _, _ in self._pending:
+                    if future.set_running_or_notify_cancel():
+                        future.set_exception(RuntimeError(f"{self.name} is closed"))
+                self._pending = []
+                return []
+
+            # Wait out the window unless the budget fills up first
+            deadline = self._pending[0][3] + self.max_wait
+            while not self._closed:
+                pending_cost = sum(entry[2] for entry in self._pending)
+                remaining = deadline - time.monotonic()
+                if pending_cost >= self.max_batch_cost or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            # Take items up to the budget, always at least one; items whose
+            # future was cancelled while queued are dropped
+            batch, cost = [], 0
+            while self._pending:
+                entry_cost = self._pending[0][2]
+                if batch and cost + entry_cost > self.max_batch_cost:
+                    break
+                entry = self._pending.pop(0)
+                if not entry[1].set_running_or_notify_cancel():
+                    continue
+                batch.append(entry)
+                cost += entry_cost
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                if self._closed:
+                    return
+                continue
+
+            items = [entry[0] for entry in batch]
+            try:
+                results = self.process_batch(items)
+                for (_, future, _, _), result in zip(batch, results):
+                    if isinstance(result, Future):
+                        result.add_done_callback(lambda done, future=future: _copy_result(done, future))
+                    else:
+                        future.set_result(result)
+            except Exception as e:
+                logger.error(f"{self.name} batch of {len(items)} failed: {str(e)}")
+                for _, future, _, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+
+def _copy_result(source: Future, target: Future) -> None:
+    if target.done():
+        return
+    error = source.exception()
+    if error is not None:
+        target.set_exception(error)
+    else:
+        target.set_result(source.result())
+
+
+class EngineRequest:
+    """
+    Latest output of one engine request, handed from the loop to its caller.
+
+    `future` resolves with the final output once the request finishes.
+    """
+
+    def __init__(self, request_id: str):
+        self.id = request_id
+        self.output = None
+        self.version = 0
+        self.finished = False
+        self.error = None
+        self.future = Future()
+        self._cond = threading.Condition()
+
+    def update(self, output) -> None:
+        with self._cond:
+            self.output = output
+            self.version += 1
+            self.finished = output.finished
+            self._cond.notify_all()
+        if output.finished:
+            self.future.set_result(output)
+
+    def fail(self, error: Exception) -> None:
+        with self._cond:
+            self.error = error
+            self.finished = True
+            self._cond.notify_all()
+        self.future.set_exception(error)
+
+    def next(self, seen: int):
+        """Wait for an output newer than version `seen`; returns (version, output)"""
+        with self._cond:
+            while self.version <= seen and self.error is None:
+                self._cond.wait()
+            if self.error is not None:
+                raise self.error
+            return self.version, self.output
+
+    def result(self):
+        """Wait for the final output"""
+        return self.future.result()
+
+
+class EngineLoop:
+    """
+    The one thread that steps a vLLM engine.
+
+    generate() and stream() add requests from any thread; the loop steps the
+    engine while any of them is unfinished and hands every output to its
+    caller, so batched calls and token streams share one continuous batch.
+    llm_engine_lock is only held for each add, abort and step() call, never
+    while a caller consumes output: a slow stream reader only sees bigger
+    deltas, it does not hold up the engine.
+    """
+
+    def __init__(self, engine, name: str = "llm-engine-loop"):
+        self.engine = engine
+        self._requests = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def add(self, prompt, sampling_params) -> EngineRequest:
+        request = EngineRequest(f"engine-{uuid4()}")
+        # Registered before the engine can produce output for it
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("LLM engine loop is closed")
+            self._requests[request.id] = request
+        try:
+            with llm_engine_lock:
+                self.engine.add_request(request.id, prompt, sampling_params)
+        except Exception:
+            with self._cond:
+                self._requests.pop(request.id, None)
+            raise
+        with self._cond:
+            self._cond.notify()
+        return request
+
+    def abort(self, request: EngineRequest) -> None:
+        with self._cond:
+            self._requests.pop(request.id, None)
+        with llm_engine_lock:
+            self.engine.abort_request(request.id)
+
+    def submit(self, prompt, sampling_params) -> Future:
+        """Add a request and return a future for its final output"""
+        return self.add(prompt, sampling_params).future
+
+    def generate(self, prompts: List, params_list: List) -> List:
+        """Final outputs for several prompts, in prompt order"""
+        futures = [self.submit(prompt, params) for prompt, params in zip(prompts, params_list)]
+        return [future.result() for future in futures]
+
+    def stream(self, prompt, sampling_params) -> Iterator:
+        """
+        Yield the request's cumulative output each time it grows.
+
+        Closing the generator early aborts the request.
+        """
+        request = self.add(prompt, sampling_params)
+        try:
+            version = 0
+            while True:
+                version, output = request.next(version)
+                yield output
+                if output.finished:
+                    return
+        finally:
+            if not request.finished:
+                self.abort(request)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout=5)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._requests and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    for request in self._requests.values():
+                        request.fail(RuntimeError("LLM engine loop is closed"))
+                    self._requests = {}
+                    return
+
+            try:
+                with llm_engine_lock:
+                    outputs = self.engine.step()
+            except Exception as e:
+                logger.error(f"LLM engine step failed: {str(e)}")
+                with self._cond:
+                    failed, self._requests = self._requests, {}
+                for request in failed.values():
+                    request.fail(e)
+                    with llm_engine_lock:
+                        self.engine.abort_request(request.id)
+                continue
+
+            with self._cond:
+                for output in outputs:
+                    request = self._requests.get(output.request_id)
+                    if request is None:
+                        continue
+                    if output.finished:
+                        del self._requests[output.request_id]
+                    request.update(output)
+
+
+_engine_loops = {}
+_engine_loops_lock = threading.Lock()
+
+
+def engine_loop(engine) -> EngineLoop:
+    """The shared step loop of a vLLM engine, started on first use"""
+    with _engine_loops_lock:
+        loop = _engine_loops.get(id(engine))
+        if loop is None:
+            loop = _engine_loops[id(engine)] = EngineLoop(engine)
+        return loop
+
+
+def close_engine_loop(engine) -> None:
+    with _engine_loops_lock:
+        loop = _engine_loops.pop(id(engine), None)
+    if loop is not None:
+        loop.close()
+
+
+def estimate_llm_tokens(item) -> int:
+    """Rough prompt + completion token count for budgeting a batch"""
+    prompt, sampling_params = item
+    return len(prompt) // CHARS_PER_TOKEN + (getattr(sampling_params, "max_tokens", None) or 0)
+
+
+class LLMBatcher:
+    """
+    Batching front-end for a shared vLLM engine.
+
+    Exposes the same `generate(prompts, sampling_params)` call as `vllm.LLM`,
+    so story and MCQ generation can use it unchanged. Prompts from concurrent
+    callers are merged into one batch, each keeping its own SamplingParams,
+    and run on the engine's shared EngineLoop alongside any token streams.
+    A batch is only added to the loop, never waited on, so prompts arriving
+    while it decodes form the next batch and join the running engine steps
+    straight away; each caller is answered when its own request finishes.
+    Any other attribute is forwarded to the wrapped engine.
+    """
+
+    def __init__(self, llm,
+                 window_ms: float = LLM_BATCH_WINDOW_MS,
+                 token_budget: int = LLM_BATCH_TOKEN_BUDGET):
+        self.llm = llm
+        self._batcher = MicroBatcher(
+            self._generate_batch,
+            max_wait_ms=window_ms,
+            max_batch_cost=token_budget,
+            cost_fn=estimate_llm_tokens,
+            name="llm-batcher"
+        )
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def generate(self, prompts, sampling_params=None, **kwargs):
+        """Submit prompts to the shared batch and wait for their outputs"""
+        if isinstance(prompts, str):
+            prompts = [prompts]
+        if isinstance(sampling_params, (list, tuple)):
+            params_list = list(sampling_params)
+        else:
+            params_list = [sampling_params] * len(prompts)
+        params_list = [params or SamplingParams() for params in params_list]
+
+        futures = [self._batcher.submit((prompt, params))
+                   for prompt, params in zip(prompts, params_list)]
+        return [future.result() for future in futures]
+
+    def close(self) -> None:
+        self._batcher.close()
+        if hasattr(self.llm, "llm_engine"):
+            close_engine_loop(self.llm.llm_engine)
+
+    def _generate_batch(self, items: List) -> List:
+        prompts = [prompt for prompt, _ in items]
+        params_list = [params for _, params in items]
+        logger.info(f"Running batched LLM generate with {len(prompts)} prompts")
+        if hasattr(self.llm, "llm_engine"):
+            loop = engine_loop(self.llm.llm_engine)
+            return [loop.submit(prompt, params) for prompt, params in zip(prompts, params_list)]
+        with llm_engine_lock:
+            return self.llm.generate(prompts, params_list)
@@ -0,0 +1,99 @@
+# bench_compositor.py
+#
+# Compare the slot-based page compositor with the previous implementation on
+# synthetic panels.
+#
+#   python benchmarks/bench_compositor.py --panels 4 --repeat 20
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+
+import numpy as np
+from PIL import Image, ImageOps
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from comic_creation import compose_page, create_comic_pages, grid_shape
+
+
+def legacy_compose_page(images, image_size=(768, 768), grid_rows=5, grid_cols=2, padding=10):
+    """Page composition as it was before the slot-based compositor"""
+    page_size = (
+        grid_cols * image_size[0] + (grid_cols + 1) * padding,
+        grid_rows * image_size[1] + (grid_rows + 1) * padding
+    )
+    page = Image.new("RGB", page_size, (255, 255, 255))
+    for j, image in enumerate(images[:grid_rows * grid_cols]):
+        x = padding + (j % grid_cols) * (image_size[0] + padding)
+        y = padding + (j // grid_cols) * (image_size[1] + padding)
+        page.paste(ImageOps.expand(image.resize(image_size), border=1, fill='black'), (x, y))
+    return page
+
+
+def legacy_create_comic_pages(image_folder, output_folder, image_size=(768, 768),
+                              grid_rows=5, grid_cols=2, padding=10):
+    """create_comic_pages as it was: every image opened, every page built"""
+    image_paths = [os.path.join(image_folder, f) for f in sorted(os.listdir(image_folder))]
+    images = [Image.open(path) for path in image_paths]
+    os.makedirs(output_folder, exist_ok=True)
+    pages = []
+    for i in range(0, len(images), grid_rows * grid_cols):
+        pages.append(legacy_compose_page(images[i:i + grid_rows * grid_cols],
+                                         image_size, grid_rows, grid_cols, padding))
+    pages[0].save(os.path.join(output_folder, f"{os.path.basename(output_folder)}.png"))
+
+
+def synthetic_panels(count, size):
+    rng = np.random.default_rng(0)
+    return [Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8)) for _ in range(count)]
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000, min(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--panels", type=int, default=4)
+    parser.add_argument("--panel-size", type=int, default=512, help="side of the rendered panels")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    panels = synthetic_panels(args.panels, args.panel_size)
+    rows, cols = grid_shape(args.panels)
+    cases = [
+        ("compose 5x2 grid (old default)", lambda: legacy_compose_page(panels),
+         lambda: compose_page(panels)),
+        (f"compose {rows}x{cols} grid", lambda: legacy_compose_page(panels, grid_rows=rows, grid_cols=cols),
+         lambda: compose_page(panels, grid_rows=rows, grid_cols=cols)),
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "panels")
+        os.makedirs(source)
+        # Twelve files so the old version builds a second, unsaved page
+        for j, panel in enumerate(synthetic_panels(12, args.panel_size)):
+            panel.save(os.path.join(source, f"scene_{j:02d}.png"))
+        cases.append((
+            "create_comic_pages (12 files on disk)",
+            lambda: legacy_create_comic_pages(source, os.path.join(tmp, "old")),
+            lambda: create_comic_pages(source, os.path.join(tmp, "new"))
+        ))
+
+        print(f"{'case':40s} {'old ms':>10s} {'new ms':>10s} {'speedup':>8s}")
+        for name, old, new in cases:
+            old_median, _ = timed(old, args.repeat)
+            new_median, _ = timed(new, args.repeat)
+            print(f"{name:40s} {old_median:10.1f} {new_median:10.1f} {old_median / new_median:7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# bench_encoding.py
+#
+# Encode time and output size of a synthetic comic page in each supported
+# output format and quality setting.
+#
+#   python benchmarks/bench_encoding.py --panels 4 --repeat 5
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from comic_creation import compose_page, grid_shape
+from encoding import encode_image, encode_renditions
+
+SETTINGS = [
+    ("png", {"compress_level": 1}),
+    ("png", {"compress_level": 6}),
+    ("png", {"compress_level": 9}),
+    ("jpeg", {"quality": 75}),
+    ("jpeg", {"quality": 85}),
+    ("jpeg", {"quality": 95}),
+    ("webp", {"quality": 75}),
+    ("webp", {"quality": 85}),
+]
+
+
+def synthetic_panel(seed, size=512):
+    """Smooth gradients, shapes and mild grain, closer to a render than pure noise"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / size
+    base = np.stack([x * 255, y * 255, (1 - x) * 200 + 30], axis=2)
+    base += rng.normal(0, 6, base.shape)
+    panel = Image.fromarray(np.clip(base, 0, 255).astype(np.uint8))
+    draw = ImageDraw.Draw(panel)
+    for _ in range(12):
+        x0, y0 = rng.integers(0, size, 2)
+        r = int(rng.integers(20, 120))
+        draw.ellipse((x0 - r, y0 - r, x0 + r, y0 + r), fill=tuple(int(c) for c in rng.integers(0, 256, 3)))
+    return panel.filter(ImageFilter.GaussianBlur(1.5))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark output encodings")
+    parser.add_argument("--panels", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--thumb-width", type=int, default=480)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    rows, cols = grid_shape(args.panels)
+    page = compose_page([synthetic_panel(i) for i in range(args.panels)], grid_rows=rows, grid_cols=cols)
+
+    results = []
+    for fmt, options in SETTINGS:
+        samples = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            data = encode_image(page, fmt, **options)
+            samples.append((time.perf_counter() - start) * 1000)
+        thumb = encode_renditions(page, {"thumb": args.thumb_width}, fmt, options.get("quality"))["thumb"]
+        results.append({
+            "format": fmt,
+            **options,
+            "page": f"{page.width}x{page.height}",
+            "bytes": len(data),
+            "encode_ms": round(statistics.median(samples), 2),
+            "thumb_bytes": thumb["bytes"],
+            "thumb_ms": thumb["encode_ms"]
+        })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'format':8s} {'setting':18s} {'KiB':>8s} {'ms':>8s} {'thumb KiB':>10s} {'thumb ms':>9s}")
+    for row in results:
+        setting = ", ".join(f"{k}={v}" for k, v in row.items() if k in ("quality", "compress_level"))
+        print(f"{row['format']:8s} {setting:18s} {row['bytes'] / 1024:8.1f} {row['encode_ms']:8.1f} "
+              f"{row['thumb_bytes'] / 1024:10.1f} {row['thumb_ms']:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# bench_load.py
+#
+# End-to-end load test of POST /generate-comic on CPU. The app runs
+# in-process with stub LLM and diffusion engines and a local S3 stand-in;
+# everything between them (job queue, batching, stage graph, captions,
+# page encoding, uploads) is the real code.
+#
+#   python benchmarks/bench_load.py --requests 40 --concurrency 8 --output results/load.json
+#
+# Scheduler and batching settings come from the usual environment variables
+# (JOB_WORKERS, JOB_QUEUE_CAPACITY, SD_MAX_BATCH_SIZE, ...).
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fastapi.testclient import TestClient
+
+import main as service
+from metrics import stage_kind
+from harness import summarize, write_results
+from stub_engines import StubLLM, StubDiffusionPipe, LocalS3Client, stub_startup
+
+# Timing report entries that are not stages, and what to call them
+SKIPPED_TIMINGS = ("serial_time", "overlap_saved")
+RENAMED_TIMINGS = {"wall_time": "pipeline", "queue_wait": "queue_wait"}
+
+
+def request_body(index: int, args) -> dict:
+    # A distinct theme per request keeps the panel and result caches out of the numbers
+    return {
+        "user_theme": f"benchmark theme {index}",
+        "genre": "adventure",
+        "style": "watercolor",
+        "dont_include": "violence",
+        "panel_count": args.panels,
+        "use_cache": False,
+        "include_timings": True,
+        "background_upload": args.background_upload,
+        "deadline_s": args.deadline_s,
+        "render_profile": args.render_profile
+    }
+
+
+def run_request(client: TestClient, index: int, args) -> dict:
+    start = time.perf_counter()
+    response = client.post("/generate-comic", json=request_body(index, args))
+    latency = time.perf_counter() - start
+    body = response.json() if response.headers.get("content-type", "").startswith("application/json") else {}
+    return {"status": response.status_code, "latency": latency, "timings": body.get("timings") or {}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test /generate-comic with stub models")
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=2, help="untimed requests before the run")
+    parser.add_argument("--panels", type=int, default=4)
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0)
+    parser.add_argument("--llm-token-ms", type=float, default=0.5)
+    parser.add_argument("--diffusion-step-ms", type=float, default=20.0)
+    parser.add_argument("--diffusion-batch-cost", type=float, default=0.6)
+    parser.add_argument("--s3-latency-ms", type=float, default=50.0)
+    parser.add_argument("--s3-bandwidth-mbps", type=float, default=200.0)
+    parser.add_argument("--background-upload", action="store_true")
+    parser.add_argument("--deadline-s", type=float, help="per-request deadline for admission control")
+    parser.add_argument("--render-profile", choices=["preview", "standard", "high"])
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    llm = StubLLM(args.llm_latency_ms, args.llm_token_ms)
+    pipe = StubDiffusionPipe(args.diffusion_step_ms, args.diffusion_batch_cost)
+    service.startup = stub_startup(service.global_model_state, llm, pipe)
+
+    with tempfile.TemporaryDirectory() as s3_root, TestClient(service.app) as client:
+        while not service.startup.ready:
+            if service.startup.failed:
+                raise SystemExit(f"Startup failed: {service.startup.error}")
+            time.sleep(0.05)
+        s3 = LocalS3Client(s3_root, args.s3_latency_ms, args.s3_bandwidth_mbps)
+        service.s3_uploader.client = s3
+
+        for index in range(args.warmup):
+            run_request(client, -1 - index, args)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            samples = list(pool.map(lambda i: run_request(client, i, args), range(args.requests)))
+        wall = time.perf_counter() - start
+        uploaded = sum(s3.uploaded.values())
+
+    ok = [sample for sample in samples if sample["status"] == 200]
+    stages = defaultdict(list)
+    for sample in ok:
+        for name, seconds in sample["timings"].items():
+            if name in SKIPPED_TIMINGS:
+                continue
+            key = RENAMED_TIMINGS.get(name) or f"stage.{stage_kind(name)}"
+            stages[key].append(seconds * 1000)
+
+    results = {
+        "request": {
+            **summarize([sample["latency"] * 1000 for sample in ok]),
+            "throughput_rps": round(len(ok) / wall, 3),
+            "ok": len(ok),
+            "rejected": sum(sample["status"] in (429, 503) for sample in samples),
+            "timed_out": sum(sample["status"] == 504 for sample in samples),
+            "failed": sum(sample["status"] not in (200, 429, 503, 504) for sample in samples),
+            "wall_s": round(wall, 3)
+        },
+        **{name: summarize(values) for name, values in sorted(stages.items())},
+        "engines": {
+            "llm_calls": llm.calls,
+            "diffusion_batches": len(pipe.batches),
+            "mean_diffusion_batch": round(sum(pipe.batches) / len(pipe.batches), 2) if pipe.batches else 0,
+            "uploaded_bytes": uploaded
+        }
+    }
+    report = write_results("load", vars(args), results, args.output)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    request = results["request"]
+    print(f"{request['ok']} ok, {request['rejected']} rejected, {request['timed_out']} timed out, "
+          f"{request['failed']} failed "
+          f"in {request['wall_s']}s: {request['throughput_rps']} req/s")
+    print(f"{'(ms)':24s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'mean':>9s} {'n':>5s}")
+    for name, row in results.items():
+        if "p50" in row:
+            print(f"{name:24s} {row['p50']:9.1f} {row['p95']:9.1f} {row['p99']:9.1f} {row['mean']:9.1f} {row['n']:5d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# bench_micro.py
+#
+# Micro-benchmarks of the CPU-side helpers on the request path: caption line
+# breaking, batched caption overlays, story post-processing and page
+# creation. Inputs are synthetic and deterministic.
+#
+#   python benchmarks/bench_micro.py --panels 4 --repeat 20 --output results/micro.json
+import os
+import sys
+import json
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from captions import caption_renderer
+from comic_creation import create_comic_pages, grid_shape
+from story_postprocess import story_post_process
+from harness import summarize, time_call, write_results
+from stub_engines import scene_story, synthetic_panel
+
+
+def legacy_segments(scenes):
+    """The same story as the newline-split text the unguided fallback produces"""
+    return ["\n".join(json.dumps(scene) for scene in scenes[i:i + 2]) for i in range(0, len(scenes), 2)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the post-processing helpers")
+    parser.add_argument("--panels", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    scenes = scene_story(args.panels)
+    story = story_post_process(scenes)
+    narrations = [scene["narration"] for scene in story.values()]
+    rows, cols = grid_shape(args.panels)
+
+    panels = [synthetic_panel(scene_num) for scene_num in story]
+    renderer = caption_renderer()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        captioned = os.path.join(workdir, "comic_pages")
+        pages = os.path.join(workdir, "page")
+        os.makedirs(captioned)
+        for scene_num, image in zip(story, renderer.render_many(list(zip(panels, narrations)))):
+            image.save(os.path.join(captioned, f"scene_{scene_num}_with_text.png"))
+
+        results["caption_wrap"] = summarize(time_call(
+            lambda: [renderer.wrap(text, 472) for text in narrations], args.repeat
+        ))
+        results["caption_render_many"] = summarize(time_call(
+            lambda: renderer.render_many(list(zip(panels, narrations))), args.repeat
+        ))
+        results["story_post_process.parsed"] = summarize(time_call(
+            lambda: story_post_process(scenes), args.repeat
+        ))
+        segments = legacy_segments(scenes)
+        results["story_post_process.text"] = summarize(time_call(
+            lambda: story_post_process(segments), args.repeat
+        ))
+        results["create_comic_pages"] = summarize(time_call(
+            lambda: create_comic_pages(captioned, pages, grid_rows=rows, grid_cols=cols), args.repeat
+        ))
+
+    report = write_results("micro", vars(args), results, args.output)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{'(ms)':28s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'mean':>9s}")
+    for name, row in results.items():
+        print(f"{name:28s} {row['p50']:9.3f} {row['p95']:9.3f} {row['p99']:9.3f} {row['mean']:9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# bench_profiles.py
+#
+# Time per render profile: the panel renders for one comic through the
+# batching queue, then captioning and the page encode at the profile's page
+# size. Uses the stub diffusion pipeline unless --model is given, in which
+# case the real pipeline is loaded (needs a GPU).
+#
+#   python benchmarks/bench_profiles.py --panels 4 --repeat 5 --output results/profiles.json
+import os
+import sys
+import json
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import stable_diffusion
+from stable_diffusion import DiffusionBatcher, RENDER_PROFILES, build_scene_prompt, scene_seed
+from comic_creation import grid_shape
+from postprocess import caption_panel, encode_page
+from harness import summarize, time_call, write_results
+from stub_engines import StubDiffusionPipe, scene_story
+from story_postprocess import story_post_process
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time one comic's renders and page per render profile")
+    parser.add_argument("--panels", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--profiles", default=",".join(RENDER_PROFILES), help="comma-separated profile names")
+    parser.add_argument("--model", action="store_true", help="load the real diffusion pipeline")
+    parser.add_argument("--diffusion-step-ms", type=float, default=20.0)
+    parser.add_argument("--diffusion-batch-cost", type=float, default=0.6)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    # Every repeat renders the same prompts and seeds, which must not hit the cache
+    stable_diffusion.panel_cache = None
+    if args.model:
+        from load_model import load_stablediffusion
+        pipe = load_stablediffusion()
+    else:
+        pipe = StubDiffusionPipe(args.diffusion_step_ms, args.diffusion_batch_cost)
+    renderer = DiffusionBatcher(pipe)
+
+    story = story_post_process(scene_story(args.panels))
+    scenes = list(story.items())[:args.panels]
+    prompts = [build_scene_prompt(content) for _, content in scenes]
+    seeds = [scene_seed(num) for num, _ in scenes]
+    grid = grid_shape(len(scenes))
+
+    results = {}
+    try:
+        for name in args.profiles.split(","):
+            profile = RENDER_PROFILES[name]
+            panels = []
+
+            def render():
+                panels[:] = renderer.render(prompts, seeds, name)
+
+            def page():
+                captioned = [caption_panel(image, content["narration"]) for image, (_, content) in zip(panels, scenes)]
+                return encode_page(captioned, grid, panel_size=profile["panel_size"])
+
+            results[f"{name}.render"] = summarize(time_call(render, args.repeat))
+            results[f"{name}.page"] = summarize(time_call(page, args.repeat))
+            params = profile["render"]
+            results[f"{name}.settings"] = {
+                **params,
+                "panel_size": list(profile["panel_size"]),
+                "transformer_passes": params["num_inference_steps"] * (2 if params["true_cfg_scale"] > 1 else 1)
+            }
+    finally:
+        renderer.close()
+
+    baseline = results.get("standard.render", {}).get("mean")
+    if baseline:
+        for name in args.profiles.split(","):
+            results[f"{name}.settings"]["render_vs_standard"] = round(results[f"{name}.render"]["mean"] / baseline, 3)
+
+    report = write_results("profiles", vars(args), results, args.output)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{'(ms)':20s} {'p50':>10s} {'p95':>10s} {'mean':>10s} {'vs standard':>12s}")
+    for name in args.profiles.split(","):
+        for part in ("render", "page"):
+            row = results[f"{name}.{part}"]
+            ratio = results[f"{name}.settings"].get("render_vs_standard") if part == "render" else None
+            print(f"{name + '.' + part:20s} {row['p50']:10.1f} {row['p95']:10.1f} {row['mean']:10.1f} "
+                  f"{'' if ratio is None else f'{ratio:.2f}x':>12s}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+# harness.py
+#
+# Shared helpers for the benchmark scripts: timing, percentiles and the JSON
+# result files. Run directly to compare two result files:
+#
+#   python benchmarks/harness.py baseline.json current.json --threshold 0.10
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+# Keys of a result entry where lower is better; everything else is ignored
+# by compare() except throughput, where higher is better
+LATENCY_KEYS = ("p50", "p95", "p99", "mean")
+THROUGHPUT_KEYS = ("throughput_rps",)
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """q-th percentile (0-100) with linear interpolation between ranks"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(samples: List[float], digits: int = 3) -> Dict:
+    """p50/p95/p99/mean/min/max and count of a list of samples"""
+    if not samples:
+        return {"n": 0}
+    return {
+        "n": len(samples),
+        "p50": round(percentile(samples, 50), digits),
+        "p95": round(percentile(samples, 95), digits),
+        "p99": round(percentile(samples, 99), digits),
+        "mean": round(sum(samples) / len(samples), digits),
+        "min": round(min(samples), digits),
+        "max": round(max(samples), digits)
+    }
+
+
+def time_call(fn: Callable, repeat: int, warmup: int = 1) -> List[float]:
+    """Milliseconds per call of fn(), after `warmup` untimed calls"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def environment() -> Dict:
+    """Where the numbers came from, so result files can be compared fairly"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count()
+    }
+
+
+def write_results(suite: str, config: Dict, results: Dict, output: Optional[str] = None) -> Dict:
+    """Wrap results with their config and environment; write them to output if given"""
+    report = {
+        "suite": suite,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": environment(),
+        "config": config,
+        "results": results
+    }
+    if output:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "w") as file:
+            json.dump(report, file, indent=2)
+    return report
+
+
+def compare(baseline: Dict, current: Dict, threshold: float = 0.10, min_delta_ms: float = 0.1) -> List[Dict]:
+    """
+    Relative change of every shared latency/throughput figure.
+
+    An entry is a regression when latency grew, or throughput fell, by more
+    than `threshold` (a fraction). Latency changes under min_delta_ms are
+    noise for the sub-millisecond helpers and never count.
+    """
+    rows = []
+    for name, before in baseline.get("results", {}).items():
+        after = current.get("results", {}).get(name)
+        if not isinstance(before, dict) or not isinstance(after, dict):
+            continue
+        for key in LATENCY_KEYS + THROUGHPUT_KEYS:
+            if key not in before or key not in after or not before[key]:
+                continue
+            change = (after[key] - before[key]) / before[key]
+            worse = -change if key in THROUGHPUT_KEYS else change
+            if key in LATENCY_KEYS and abs(after[key] - before[key]) < min_delta_ms:
+                worse = 0.0
+            rows.append({
+                "name": name,
+                "metric": key,
+                "baseline": before[key],
+                "current": after[key],
+                "change": round(change, 4),
+                "regression": worse > threshold
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed relative slowdown")
+    parser.add_argument("--min-delta-ms", type=float, default=0.1, help="ignore smaller latency changes")
+    parser.add_argument("--json", action="store_true", help="print the comparison as JSON")
+    args = parser.parse_args()
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    with open(args.current) as file:
+        current = json.load(file)
+    rows = compare(baseline, current, args.threshold, args.min_delta_ms)
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print(f"{'benchmark':32s} {'metric':15s} {'baseline':>10s} {'current':>10s} {'change':>8s}")
+        for row in rows:
+            flag = "  REGRESSION" if row["regression"] else ""
+            print(f"{row['name']:32s} {row['metric']:15s} {row['baseline']:10.3f} {row['current']:10.3f} "
+                  f"{row['change'] * 100:7.1f}%{flag}")
+    sys.exit(1 if any(row["regression"] for row in rows) else 0)
+
+
+if __name__ == "__main__":
+    main()
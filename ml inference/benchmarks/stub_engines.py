@@ -0,0 +1,201 @@
+# stub_engines.py
+#
+# Deterministic CPU stand-ins for the vLLM engine, the diffusion pipeline and
+# S3, with configurable synthetic latency. They implement just the surface
+# the service uses, so the real batching, stage graph, captioning, encoding
+# and upload code runs unchanged around them.
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+from mcq import MCQ_PROMPT_PREFIX
+
+WORDS = ("hero", "city", "storm", "signal", "mask", "river", "tower", "friend", "secret", "engine",
+         "night", "garden", "robot", "letter", "bridge", "shadow", "market", "comet", "forest", "door")
+# Rough characters per token, used to turn text length into token counts
+CHARS_PER_TOKEN = 4
+
+
+def _rng(text: str) -> random.Random:
+    return random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def synthetic_panel(seed: int, width: int = 512, height: int = 512) -> Image.Image:
+    """Smooth gradients, shapes and mild grain, closer to a render than pure noise"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    x, y = x / width, y / height
+    base = np.stack([x * 255, y * 255, (1 - x) * 200 + 30], axis=2)
+    base += rng.normal(0, 6, base.shape)
+    panel = Image.fromarray(np.clip(base, 0, 255).astype(np.uint8))
+    draw = ImageDraw.Draw(panel)
+    for _ in range(12):
+        x0, y0 = int(rng.integers(0, width)), int(rng.integers(0, height))
+        r = int(rng.integers(20, 120))
+        draw.ellipse((x0 - r, y0 - r, x0 + r, y0 + r), fill=tuple(int(c) for c in rng.integers(0, 256, 3)))
+    return panel.filter(ImageFilter.GaussianBlur(1.5))
+
+
+class StubLLM:
+    """
+    vllm.LLM look-alike.
+
+    Story prompts get a JSON array with the requested number of scenes, MCQ
+    prompts get three questions; both are derived from a hash of the prompt.
+    A generate() call sleeps latency_ms plus token_ms per token of its
+    longest completion, like one batched decode.
+    """
+
+    def __init__(self, latency_ms: float = 200.0, token_ms: float = 0.5):
+        self.latency_ms = latency_ms
+        self.token_ms = token_ms
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate(self, prompts, sampling_params=None, **kwargs):
+        if isinstance(prompts, str):
+            prompts = [prompts]
+        with self._lock:
+            self.calls += 1
+        if not isinstance(sampling_params, (list, tuple)):
+            sampling_params = [sampling_params] * len(prompts)
+        outputs = [self._output(prompt, params) for prompt, params in zip(prompts, sampling_params)]
+        longest = max(len(output.outputs[0].token_ids) for output in outputs)
+        time.sleep((self.latency_ms + self.token_ms * longest) / 1000)
+        return outputs
+
+    def stream_completion(self, prompt: str, sampling_params) -> Iterator[str]:
+        """Yield the completion a few tokens at a time at token_ms per token"""
+        text = self._output(prompt, sampling_params).outputs[0].text
+        time.sleep(self.latency_ms / 1000)
+        chunk = 8 * CHARS_PER_TOKEN
+        for start in range(0, len(text), chunk):
+            time.sleep(self.token_ms * 8 / 1000)
+            yield text[start:start + chunk]
+
+    def completion(self, prompt: str) -> str:
+        rng = _rng(prompt)
+        if prompt.startswith(MCQ_PROMPT_PREFIX):
+            questions = []
+            for number in range(1, 4):
+                options = "\n".join(f"   - {letter}) {_sentence(rng, 4)}" for letter in "ABCD")
+                questions.append(f"{number}. **Question {number}: {_sentence(rng, 8)}**\n{options}\n"
+                                 f"   - Correct Answer: {rng.choice('ABCD')}")
+            return "\n\n".join(questions)
+
+        match = re.search(r"Scenes: (\d+)", prompt)
+        scene_count = int(match.group(1)) if match else 10
+        return json.dumps([
+            {
+                "scene": number,
+                "narration": _sentence(rng, 18),
+                "image_prompt": _sentence(rng, 14),
+                "dialogue": _sentence(rng, 8)
+            }
+            for number in range(1, scene_count + 1)
+        ])
+
+    def _output(self, prompt: str, sampling_params):
+        text = self.completion(prompt)
+        max_tokens = getattr(sampling_params, "max_tokens", None)
+        if max_tokens:
+            text = text[:max_tokens * CHARS_PER_TOKEN]
+        completion = SimpleNamespace(text=text, token_ids=list(range(max(1, len(text) // CHARS_PER_TOKEN))))
+        return SimpleNamespace(
+            outputs=[completion],
+            prompt_token_ids=list(range(len(prompt) // CHARS_PER_TOKEN)),
+            num_cached_tokens=0,
+            finished=True
+        )
+
+
+class StubDiffusionPipe:
+    """
+    Diffusers pipeline look-alike returning seeded synthetic panels.
+
+    A call sleeps step_ms per denoising step for a single 512x512 image with
+    true CFG; each extra image in the batch adds batch_cost of that,
+    modelling batching gains. Time scales with the pixel count, and halves
+    without true CFG (one transformer pass per step instead of two).
+    """
+
+    def __init__(self, step_ms: float = 20.0, batch_cost: float = 0.6):
+        self.step_ms = step_ms
+        self.batch_cost = batch_cost
+        self.batches = []
+
+    def __call__(self, prompt, negative_prompt=None, width: int = 512, height: int = 512,
+                 num_inference_steps: int = 15, generator=None, true_cfg_scale: float = 4.0, **kwargs):
+        prompts = prompt if isinstance(prompt, list) else [prompt]
+        generators = generator if isinstance(generator, list) else [generator] * len(prompts)
+        self.batches.append(len(prompts))
+        scale = 1 + self.batch_cost * (len(prompts) - 1)
+        scale *= width * height / (512 * 512)
+        if true_cfg_scale <= 1 or negative_prompt is None:
+            scale /= 2
+        time.sleep(num_inference_steps * self.step_ms * scale / 1000)
+        seeds = [g.initial_seed() if g is not None else 0 for g in generators]
+        return SimpleNamespace(images=[synthetic_panel(seed, width, height) for seed in seeds])
+
+
+class LocalS3Client:
+    """
+    boto3 S3 client look-alike writing objects under a local directory.
+
+    Each upload sleeps latency_ms plus the transfer time at bandwidth_mbps,
+    so background and blocking uploads can be compared.
+    """
+
+    def __init__(self, root: str, latency_ms: float = 50.0, bandwidth_mbps: float = 200.0):
+        self.root = root
+        self.latency_ms = latency_ms
+        self.bandwidth_mbps = bandwidth_mbps
+        self.uploaded: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def upload_fileobj(self, file_obj, bucket: str, key: str, ExtraArgs: Optional[Dict] = None,
+                       Config=None, **kwargs) -> None:
+        data = file_obj.read()
+        seconds = self.latency_ms / 1000
+        if self.bandwidth_mbps:
+            seconds += len(data) * 8 / (self.bandwidth_mbps * 1e6)
+        time.sleep(seconds)
+        path = os.path.join(self.root, bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(data)
+        with self._lock:
+            self.uploaded[key] = len(data)
+
+
+def stub_startup(state, llm: StubLLM, pipe: StubDiffusionPipe, warmup: bool = False):
+    """A startup.Startup that boots state with the stub engines behind the real front-ends"""
+    from batching import LLMBatcher
+    from model_state import LLM_BATCHING
+    from stable_diffusion import DiffusionBatcher, SD_BATCHED
+    from startup import Startup
+
+    return Startup(
+        state,
+        llm_loader=lambda: LLMBatcher(llm) if LLM_BATCHING else llm,
+        diffusion_loader=lambda: (pipe, DiffusionBatcher(pipe) if SD_BATCHED else None),
+        warmup=warmup
+    )
+
+
+def scene_story(scene_count: int, seed: str = "story") -> List[Dict]:
+    """Parsed scene dicts as the story stage returns them"""
+    return json.loads(StubLLM().completion(f"{seed}\nScenes: {scene_count}"))
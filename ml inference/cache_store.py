@@ -0,0 +1,154 @@
+# cache_store.py
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class TieredCache:
+    """
+    Two-tier byte cache: an in-memory LRU in front of a local-disk store.
+
+    Both tiers are capped in bytes and evict least-recently-used entries.
+    Disk entries survive restarts; their recency is rebuilt from file mtimes.
+    Pass disk_dir=None for a memory-only cache.
+    """
+
+    def __init__(self, name: str, memory_max_bytes: int,
+                 disk_dir: Optional[str] = None, disk_max_bytes: int = 0):
+        self.name = name
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {
+            "hits": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0
+        }
+        if disk_dir:
+            self._load_disk_index()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return cached bytes for key, promoting disk hits to memory"""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.counters["hits"] += 1
+                self.counters["memory_hits"] += 1
+                return data
+            on_disk = key in self._disk
+
+        data = self._read_disk(key) if on_disk else None
+        with self._lock:
+            if data is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["hits"] += 1
+            self.counters["disk_hits"] += 1
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            self._put_memory(key, data)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """Store bytes in both tiers"""
+        with self._lock:
+            self._put_memory(key, data)
+        if self.disk_dir:
+            self._write_disk(key, data)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes
+            }
+
+    def _put_memory(self, key: str, data: bytes) -> None:
+        if len(data) > self.memory_max_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.counters["memory_evictions"] += 1
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], key)
+
+    def _load_disk_index(self) -> None:
+        os.makedirs(self.disk_dir, exist_ok=True)
+        entries = []
+        for root, _, files in os.walk(self.disk_dir):
+            for filename in files:
+                if filename.endswith(".tmp"):
+                    continue
+                stat = os.stat(os.path.join(root, filename))
+                entries.append((stat.st_mtime, filename, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        logger.info(f"{self.name} cache: {len(self._disk)} entries on disk ({self._disk_bytes} bytes)")
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+            os.utime(path)
+            return data
+        except OSError:
+            with self._lock:
+                self._disk_bytes -= self._disk.pop(key, 0)
+            return None
+
+    def _write_disk(self, key: str, data: bytes) -> None:
+        if len(data) > self.disk_max_bytes:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"{self.name} cache: failed to write {key}: {str(e)}")
+            return
+
+        evicted = []
+        with self._lock:
+            self._disk_bytes -= self._disk.pop(key, 0)
+            self._disk[key] = len(data)
+            self._disk_bytes += len(data)
+            while self._disk_bytes > self.disk_max_bytes and len(self._disk) > 1:
+                old_key, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                self.counters["disk_evictions"] += 1
+                evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
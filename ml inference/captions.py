@@ -0,0 +1,178 @@
+# captions.py
+import os
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from config import FONT_CONFIG
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Caption engine configuration
+CAPTION_STRIP_HEIGHT = 70
+CAPTION_MARGIN = 40
+CAPTION_CACHE_SIZE = int(os.getenv("CAPTION_CACHE_SIZE", "256"))
+CAPTION_WORKERS = int(os.getenv("CAPTION_WORKERS", "4"))
+# Word widths are cheap to keep, but bound the table for long-lived workers
+CAPTION_MAX_WORDS = 50000
+
+
+@lru_cache(maxsize=None)
+def load_font(path: str = FONT_CONFIG["path"], size: int = FONT_CONFIG["base_size"]) -> ImageFont.FreeTypeFont:
+    """Load a TrueType font once per process"""
+    logger.info(f"Loading font {path} at size {size}")
+    return ImageFont.truetype(path, size)
+
+
+class CaptionRenderer:
+    """
+    Draws the white caption strip at the bottom of a panel.
+
+    The font is loaded once and word widths are measured once, so line
+    breaking is a single linear pass. Whole rendered strips are cached by
+    (text, width, height) because the same caption is often drawn again
+    (retries, cached panels, repeated requests). render_many() captions a
+    batch of panels on a thread pool; PIL releases the GIL while pasting.
+    """
+
+    def __init__(self, font: ImageFont.FreeTypeFont = None,
+                 cache_size: int = CAPTION_CACHE_SIZE,
+                 max_workers: int = CAPTION_WORKERS):
+        self.font = font or load_font()
+        self.cache_size = cache_size
+        self.max_workers = max_workers
+        self._widths = {}
+        self._space_width = self.font.getlength(" ")
+        # Scratch surface for measuring multi-line text
+        self._measure = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+        self._strips = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self.counters = {"hits": 0, "misses": 0}
+
+    def word_width(self, word: str) -> float:
+        width = self._widths.get(word)
+        if width is None:
+            if len(self._widths) >= CAPTION_MAX_WORDS:
+                self._widths.clear()
+            width = self._widths[word] = self.font.getlength(word)
+        return width
+
+    def wrap(self, text: str, max_width: int) -> List[str]:
+        """
+        Greedy line breaking in one pass over the words.
+
+        A word wider than max_width gets a line to itself, as before.
+        """
+        lines = []
+        current = []
+        current_width = 0.0
+
+        for word in text.split():
+            width = self.word_width(word)
+            line_width = current_width + self._space_width + width if current else width
+            if line_width <= max_width:
+                current.append(word)
+                current_width = line_width
+            elif not current:
+                lines.append(word)
+            else:
+                lines.append(" ".join(current))
+                current, current_width = [word], width
+                if width > max_width:
+                    lines.append(word)
+                    current, current_width = [], 0.0
+
+        if current:
+            lines.append(" ".join(current))
+        return lines
+
+    def layout(self, text: str, width: int, height: int = CAPTION_STRIP_HEIGHT) -> Tuple[str, Tuple[int, int], bool]:
+        """Wrapped text, its position inside the strip, and whether it fits the strip"""
+        wrapped_text = "\n".join(self.wrap(text, width - CAPTION_MARGIN))
+        left, top, right, bottom = self._measure.textbbox((0, 0), wrapped_text, font=self.font)
+        text_width, text_height = right - left, bottom - top
+        position = (width // 2 - text_width // 2, height // 2 - text_height // 2)
+        fits = position[1] + top >= 0 and position[1] + bottom <= height
+        return wrapped_text, position, fits
+
+    def render_strip(self, text: str, width: int, height: int = CAPTION_STRIP_HEIGHT) -> Optional[Image.Image]:
+        """
+        White strip with the text wrapped and centred; shared, do not modify.
+
+        Returns None when the text is taller than the strip, since it then
+        spills onto the panel above and cannot be drawn as a separate strip.
+        """
+        key = (text, width, height)
+        with self._lock:
+            strip = self._strips.get(key)
+            if strip is not None:
+                self._strips.move_to_end(key)
+                self.counters["hits"] += 1
+                return strip
+            self.counters["misses"] += 1
+
+        wrapped_text, position, fits = self.layout(text, width, height)
+        if not fits:
+            return None
+        strip = Image.new("RGB", (width, height), (255, 255, 255))
+        ImageDraw.Draw(strip).text(position, wrapped_text, font=self.font, fill=(0, 0, 0))
+
+        with self._lock:
+            self._strips[key] = strip
+            while len(self._strips) > self.cache_size:
+                self._strips.popitem(last=False)
+        return strip
+
+    def render(self, image: Image.Image, text: str, height: int = CAPTION_STRIP_HEIGHT) -> Image.Image:
+        """Return an RGB copy of image with the caption strip along the bottom"""
+        image = image.convert("RGB") if image.mode != "RGB" else image.copy()
+        top = image.height - height
+        strip = self.render_strip(text, image.width, height)
+        if strip is not None:
+            image.paste(strip, (0, top))
+            return image
+
+        # Overflowing caption: draw the box and the text straight onto the panel
+        wrapped_text, (x, y), _ = self.layout(text, image.width, height)
+        draw = ImageDraw.Draw(image)
+        draw.rectangle((0, top, image.width, image.height), fill=(255, 255, 255))
+        draw.text((x, top + y), wrapped_text, font=self.font, fill=(0, 0, 0))
+        return image
+
+    def render_many(self, items: Sequence[Tuple[Image.Image, str]]) -> List[Image.Image]:
+        """Caption a batch of (image, text) pairs in parallel"""
+        if len(items) <= 1 or self.max_workers <= 1:
+            return [self.render(image, text) for image, text in items]
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix="caption")
+        return list(self._executor.map(lambda item: self.render(*item), items))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else 0.0,
+                "entries": len(self._strips),
+                "words": len(self._widths)
+            }
+
+
+@lru_cache(maxsize=8)
+def renderer_for_font(font: ImageFont.FreeTypeFont) -> CaptionRenderer:
+    """Shared renderer (and caches) for a loaded font"""
+    return CaptionRenderer(font)
+
+
+def caption_renderer() -> CaptionRenderer:
+    """Process-wide renderer for the configured caption font"""
+    return renderer_for_font(load_font())
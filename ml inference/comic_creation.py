@@ -1,24 +1,106 @@
 # comic_creation.py
 import os
-from PIL import Image, ImageOps
+from PIL import Image, ImageDraw
 import logging
+from encoding import encode_renditions, encoding_report, rendition_object_name
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def grid_shape(panel_count, max_cols=2):
+    """Smallest (rows, cols) grid with at most max_cols columns for panel_count panels"""
+    cols = max(1, min(max_cols, panel_count))
+    rows = max(1, -(-panel_count // cols))
+    return rows, cols
+
+def grid_layout(grid_rows, grid_cols, image_size=(768, 768), padding=10):
+    """
+    Regular grid of equally sized panel slots
+
+    Returns:
+        tuple: (page_size, slots) with slots as (x, y, width, height) in row-major order
+    """
+    page_size = (
+        grid_cols * image_size[0] + (grid_cols + 1) * padding,
+        grid_rows * image_size[1] + (grid_rows + 1) * padding
+    )
+    slots = [
+        (padding + col * (image_size[0] + padding), padding + row * (image_size[1] + padding),
+         image_size[0], image_size[1])
+        for row in range(grid_rows)
+        for col in range(grid_cols)
+    ]
+    return page_size, slots
+
+def row_layout(panels_per_row, page_width=1550, row_height=768, padding=10):
+    """
+    Rows of full-width strips, each split evenly into its own number of panels,
+    e.g. [1, 2, 3] for a wide splash panel above a 2-panel and a 3-panel row
+
+    Returns:
+        tuple: (page_size, slots) with slots as (x, y, width, height) in reading order
+    """
+    page_size = (page_width, len(panels_per_row) * (row_height + padding) + padding)
+    slots = []
+    for row, count in enumerate(panels_per_row):
+        width = (page_width - (count + 1) * padding) // count
+        y = padding + row * (row_height + padding)
+        slots.extend((padding + col * (width + padding), y, width, row_height) for col in range(count))
+    return page_size, slots
+
+def place_panel(page, draw, image, slot, border=1, border_color=(0, 0, 0), resample=Image.BILINEAR):
+    """
+    Resize one image straight into its slot of the page and outline it
+
+    A slot at (x, y) holds the border at x..x+width+1 and the panel at
+    x+1, y+1, matching the old ImageOps.expand + paste layout without the
+    bordered copy of every panel.
+    """
+    x, y, width, height = slot
+    if image.size != (width, height):
+        image = image.resize((width, height), resample)
+    page.paste(image, (x + border, y + border))
+    if border:
+        draw.rectangle([x, y, x + width + 2 * border - 1, y + height + 2 * border - 1],
+                       outline=border_color, width=border)
+
+def composite_page(images, page_size, slots, border=1, background=(255, 255, 255),
+                   border_color=(0, 0, 0), resample=Image.BILINEAR) -> Image.Image:
+    """Paste panels into one preallocated page, one slot per image"""
+    page = Image.new("RGB", page_size, background)
+    draw = ImageDraw.Draw(page)
+    for j, (image, slot) in enumerate(zip(images, slots)):
+        try:
+            place_panel(page, draw, image, slot, border, border_color, resample)
+        except Exception as e:
+            logger.error(f"Error processing image {j}: {str(e)}")
+            continue
+    return page
+
+def compose_page(images, image_size=(768, 768), grid_rows=5, grid_cols=2,
+                 padding=10, layout=None) -> Image.Image:
+    """
+    Lay out up to grid_rows * grid_cols images on one page
+
+    Pass layout=(page_size, slots), e.g. from row_layout(), for anything
+    other than a regular grid.
+    """
+    page_size, slots = layout or grid_layout(grid_rows, grid_cols, image_size, padding)
+    return composite_page(images[:len(slots)], page_size, slots)
+
 def create_comic_pages(image_folder, output_folder, 
                       image_size=(768, 768), grid_rows=5, grid_cols=2, 
-                      padding=10):
-    """Create comic pages from generated images"""
+                      padding=10, layout=None, output_format=None, renditions=None):
+    """
+    Create the comic page from generated images
+
+    The page is written once per rendition (see encoding.OUTPUT_RENDITIONS)
+    in output_format, defaulting to encoding.OUTPUT_FORMAT.
+    """
     try:
-        # Compute page size
-        page_size = (
-            grid_cols * image_size[0] + (grid_cols + 1) * padding,
-            grid_rows * image_size[1] + (grid_rows + 1) * padding
-        )
-        
-        # Load images
+        page_size, slots = layout or grid_layout(grid_rows, grid_cols, image_size, padding)
+
         logger.info(f"Loading images from {image_folder}")
         image_paths = [
             os.path.join(image_folder, f) 
@@ -29,50 +111,37 @@ def create_comic_pages(image_folder, output_folder,
         if not image_paths:
             raise ValueError(f"No valid images found in {image_folder}")
         
-        images = []
+        # Create output folder
+        os.makedirs(output_folder, exist_ok=True)
+        
+        # Only the first page is saved, so only its panels are loaded; each
+        # source image is closed as soon as it has been placed
+        logger.info("Creating page 1")
+        page = Image.new("RGB", page_size, (255, 255, 255))
+        draw = ImageDraw.Draw(page)
+        placed = 0
         for img_path in image_paths:
+            if placed == len(slots):
+                break
             try:
-                img = Image.open(img_path)
-                images.append(img)
+                with Image.open(img_path) as img:
+                    place_panel(page, draw, img, slots[placed])
+                placed += 1
             except Exception as e:
                 logger.error(f"Error loading image {img_path}: {str(e)}")
                 continue
         
-        # Create output folder
-        os.makedirs(output_folder, exist_ok=True)
-        
-        # Create pages
-        pages = []
-        for i in range(0, len(images), grid_rows * grid_cols):
-            logger.info(f"Creating page {len(pages) + 1}")
-            page = Image.new("RGB", page_size, (255, 255, 255))
-            
-            for j in range(grid_rows * grid_cols):
-                if i + j < len(images):
-                    row = j // grid_cols
-                    col = j % grid_cols
-                    
-                    x = padding + col * (image_size[0] + padding)
-                    y = padding + row * (image_size[1] + padding)
-                    
-                    try:
-                        resized_img = images[i + j].resize(image_size)
-                        bordered_img = ImageOps.expand(resized_img, border=1, fill='black')
-                        page.paste(bordered_img, (x, y))
-                    except Exception as e:
-                        logger.error(f"Error processing image {i + j}: {str(e)}")
-                        continue
-            
-            pages.append(page)
-        
-        # Save pages
-        
         # Save only the first page
-        if pages:
-            output_path = os.path.join(output_folder, f"{os.path.basename(output_folder)}.png")
+        if placed:
+            base_path = os.path.join(output_folder, os.path.basename(output_folder))
             try:
-                pages[0].save(output_path)
-                logger.info(f"Saved page 1 to {output_path}")
+                encoded = encode_renditions(page, renditions, output_format)
+                for name, info in encoded.items():
+                    output_path = rendition_object_name(base_path, name, info["extension"])
+                    with open(output_path, "wb") as file:
+                        file.write(info["data"])
+                    logger.info(f"Saved page 1 ({name}) to {output_path}")
+                logger.info(f"Page encoding: {encoding_report(encoded)}")
             except Exception as e:
                 logger.error(f"Error saving page 1: {str(e)}")
                 
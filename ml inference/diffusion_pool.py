@@ -0,0 +1,112 @@
+# diffusion_pool.py
+import itertools
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from stable_diffusion import DiffusionBatcher, BASE_SEED
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class DiffusionWorker:
+    """One pipeline replica with its own batching queue and load counter"""
+
+    def __init__(self, device: str, pipe, batcher_factory: Callable = DiffusionBatcher):
+        self.device = device
+        self.batcher = batcher_factory(pipe, device=device)
+        self.inflight = 0
+        self.completed = 0
+
+
+def least_loaded(workers: List[DiffusionWorker], order: int) -> DiffusionWorker:
+    """Placement policy: fewest in-flight scenes, ties broken round-robin"""
+    lowest = min(worker.inflight for worker in workers)
+    candidates = [worker for worker in workers if worker.inflight == lowest]
+    return candidates[order % len(candidates)]
+
+
+class DiffusionWorkerPool:
+    """
+    Dispatcher over N independent diffusion pipeline replicas.
+
+    Drop-in for a single DiffusionBatcher: submit()/render() place each
+    scene on a replica chosen by `policy` (least-loaded by default). With
+    placement="request", all scenes of one render() call go to the same
+    replica so they can share a batch.
+    """
+
+    def __init__(self, replicas: List[Tuple[str, object]],
+                 policy: Callable = least_loaded,
+                 placement: str = "scene",
+                 batcher_factory: Callable = DiffusionBatcher):
+        if not replicas:
+            raise ValueError("DiffusionWorkerPool needs at least one replica")
+        self.workers = [DiffusionWorker(device, pipe, batcher_factory) for device, pipe in replicas]
+        self.policy = policy
+        self.placement = placement
+        self._lock = threading.Lock()
+        self._order = itertools.count()
+        logger.info(f"Diffusion worker pool with replicas on {[w.device for w in self.workers]}")
+
+    def _acquire(self, count: int = 1) -> DiffusionWorker:
+        with self._lock:
+            worker = self.policy(self.workers, next(self._order))
+            worker.inflight += count
+            return worker
+
+    def _release(self, worker: DiffusionWorker, future: Future) -> None:
+        with self._lock:
+            worker.inflight -= 1
+            worker.completed += 1
+
+    def _submit_to(self, worker: DiffusionWorker, prompt: str, seed: int,
+                   profile: Optional[str] = None) -> Future:
+        try:
+            future = worker.batcher.submit(prompt, seed, profile)
+        except Exception:
+            with self._lock:
+                worker.inflight -= 1
+            raise
+        future.add_done_callback(lambda f, w=worker: self._release(w, f))
+        return future
+
+    def submit(self, prompt: str, seed: int = BASE_SEED, profile: Optional[str] = None) -> Future:
+        """Queue one scene on the least-loaded replica"""
+        return self._submit_to(self._acquire(), prompt, seed, profile)
+
+    def render(self, prompts: List[str], seeds: List[int], profile: Optional[str] = None) -> List[Image.Image]:
+        if self.placement == "request":
+            worker = self._acquire(len(prompts))
+            futures = []
+            try:
+                for prompt, seed in zip(prompts, seeds):
+                    futures.append(self._submit_to(worker, prompt, seed, profile))
+            except Exception:
+                # _submit_to released the failed scene's slot; release the rest
+                with self._lock:
+                    worker.inflight -= len(prompts) - len(futures) - 1
+                raise
+        else:
+            futures = [self.submit(prompt, seed, profile) for prompt, seed in zip(prompts, seeds)]
+        return [future.result() for future in futures]
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return sum(worker.inflight for worker in self.workers)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                worker.device: {"inflight": worker.inflight, "completed": worker.completed}
+                for worker in self.workers
+            }
+
+    def close(self) -> None:
+        for worker in self.workers:
+            worker.batcher.close()
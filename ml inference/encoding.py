@@ -0,0 +1,98 @@
+# encoding.py
+import io
+import os
+import time
+import logging
+from typing import Dict, Optional
+
+from PIL import Image
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Output encoding configuration
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "png")
+OUTPUT_QUALITY = int(os.getenv("OUTPUT_QUALITY", "85"))  # JPEG/WebP
+PNG_COMPRESS_LEVEL = int(os.getenv("PNG_COMPRESS_LEVEL", "6"))
+# Comma-separated name:max_width pairs; 0 keeps the full size, e.g. "full:0,thumb:480"
+OUTPUT_RENDITIONS = os.getenv("OUTPUT_RENDITIONS", "full:0")
+
+FORMATS = {
+    "png": {"pil_format": "PNG", "content_type": "image/png", "extension": "png"},
+    "jpeg": {"pil_format": "JPEG", "content_type": "image/jpeg", "extension": "jpg"},
+    "webp": {"pil_format": "WEBP", "content_type": "image/webp", "extension": "webp"}
+}
+
+
+def parse_renditions(spec: str = OUTPUT_RENDITIONS) -> Dict[str, int]:
+    """Parse "full:0,thumb:480" into {"full": 0, "thumb": 480}"""
+    renditions = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, _, width = item.partition(":")
+        renditions[name.strip()] = int(width or 0)
+    if "full" not in renditions:
+        renditions = {"full": 0, **renditions}
+    return renditions
+
+
+def encode_image(image: Image.Image, fmt: str = OUTPUT_FORMAT, quality: int = OUTPUT_QUALITY,
+                 compress_level: int = PNG_COMPRESS_LEVEL) -> bytes:
+    """Encode an RGB image as PNG, progressive JPEG or WebP"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported output format: {fmt}")
+    buffer = io.BytesIO()
+    if fmt == "png":
+        image.save(buffer, format="PNG", compress_level=compress_level)
+    elif fmt == "jpeg":
+        image.save(buffer, format="JPEG", quality=quality, progressive=True, optimize=True)
+    else:
+        image.save(buffer, format="WEBP", quality=quality, method=4)
+    return buffer.getvalue()
+
+
+def encode_renditions(image: Image.Image, renditions: Optional[Dict[str, int]] = None,
+                      fmt: Optional[str] = None, quality: Optional[int] = None) -> Dict[str, Dict]:
+    """
+    Encode every rendition of a page in one pass.
+
+    Returns {name: {"data", "content_type", "extension", "format", "width",
+    "height", "bytes", "encode_ms"}}; smaller renditions are downscaled from
+    the full image.
+    """
+    renditions = renditions or parse_renditions()
+    fmt = fmt or OUTPUT_FORMAT
+    quality = quality or OUTPUT_QUALITY
+    encoded = {}
+    for name, max_width in renditions.items():
+        start = time.perf_counter()
+        rendition = image
+        if max_width and image.width > max_width:
+            height = round(image.height * max_width / image.width)
+            rendition = image.resize((max_width, height), Image.LANCZOS, reducing_gap=2.0)
+        data = encode_image(rendition, fmt, quality)
+        encoded[name] = {
+            "data": data,
+            "format": fmt,
+            "content_type": FORMATS[fmt]["content_type"],
+            "extension": FORMATS[fmt]["extension"],
+            "width": rendition.width,
+            "height": rendition.height,
+            "bytes": len(data),
+            "encode_ms": round((time.perf_counter() - start) * 1000, 2)
+        }
+    return encoded
+
+
+def rendition_object_name(base_name: str, rendition: str, extension: str) -> str:
+    """Object/file name of a rendition; the full page keeps the bare name"""
+    if rendition == "full":
+        return f"{base_name}.{extension}"
+    return f"{base_name}_{rendition}.{extension}"
+
+
+def encoding_report(encoded: Dict[str, Dict]) -> Dict[str, Dict]:
+    """Per-rendition format, size and encode time, without the image bytes"""
+    return {name: {key: value for key, value in info.items() if key != "data"}
+            for name, info in encoded.items()}
@@ -0,0 +1,341 @@
+# jobs.py
+import asyncio
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+from uuid import uuid4
+
+from metrics import record_request
+from admission import JobCancelled
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Scheduler configuration
+JOB_QUEUE_CAPACITY = int(os.getenv("JOB_QUEUE_CAPACITY", "16"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_HISTORY_SIZE = int(os.getenv("JOB_HISTORY_SIZE", "1000"))
+DEFAULT_JOB_SECONDS = 60.0
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue is at capacity"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Job queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class Job:
+    """
+    A single comic generation job and its progress events.
+
+    With collect_outputs set, the runner also hands over partial results
+    (the story, each finished panel, the MCQs) as they are produced; read
+    them with results().
+    """
+
+    def __init__(self, job_id: str, payload, priority: int = 0, deadline: Optional[float] = None,
+                 collect_outputs: bool = False):
+        self.id = job_id
+        self.payload = payload
+        self.priority = priority
+        self.deadline = deadline  # epoch seconds, or None
+        self.status = "queued"
+        self.stage = None
+        self.events = []
+        self.outputs = [] if collect_outputs else None
+        self.result = None
+        self.error = None
+        self.exception = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = asyncio.Event()
+        self._changed = asyncio.Event()
+        # Set from the event loop, read by the runner thread between stages
+        self.cancelled = threading.Event()
+        self.cancel_reason = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed", "cancelled")
+
+    @property
+    def queue_wait(self) -> Optional[float]:
+        """Seconds between submission and a worker picking the job up"""
+        if self.started_at is None:
+            return None
+        return self.started_at - self.created_at
+
+    def publish(self, stage: str, detail: Optional[Dict] = None) -> None:
+        """Record a progress event and wake up any streaming readers"""
+        self.stage = stage
+        self.events.append({
+            "stage": stage,
+            "detail": detail or {},
+            "time": round(time.time() - self.created_at, 3)
+        })
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def emit(self, kind: str, data: Dict) -> None:
+        """Record a partial result and wake up its reader"""
+        if self.outputs is None:
+            return
+        self.outputs.append({"type": kind, **data})
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def results(self):
+        """
+        Yield partial results as they are produced until the job finishes.
+
+        Each result is handed out once and then dropped, so panel images are
+        not kept around in the job history.
+        """
+        if self.outputs is None:
+            return
+        while True:
+            changed = self._changed
+            while self.outputs:
+                yield self.outputs.pop(0)
+            if self.finished:
+                return
+            await changed.wait()
+
+    async def stream(self):
+        """Yield progress events as they happen until the job finishes"""
+        index = 0
+        while True:
+            changed = self._changed
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.finished:
+                return
+            await changed.wait()
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "priority": self.priority,
+            "events": list(self.events),
+            "result": self.result,
+            "error": self.error,
+            "deadline": self.deadline,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+
+class JobScheduler:
+    """
+    Bounded, priority-aware job queue.
+
+    Jobs are run by `workers` asyncio tasks, each handing the blocking runner
+    to a dedicated thread pool so the event loop stays responsive. Higher
+    `priority` values run first; equal priorities run in submission order.
+    """
+
+    def __init__(self, runner: Callable,
+                 capacity: int = JOB_QUEUE_CAPACITY,
+                 workers: int = JOB_WORKERS,
+                 history_size: int = JOB_HISTORY_SIZE,
+                 admission=None):
+        self.runner = runner
+        self.capacity = capacity
+        self.workers = workers
+        self.history_size = history_size
+        self.admission = admission
+        self.running = 0
+        self._queue = None
+        self._loop = None
+        self._executor = None
+        self._tasks = []
+        self._jobs = OrderedDict()
+        self._counter = itertools.count()
+        self._durations = deque(maxlen=20)
+
+    async def start(self) -> None:
+        """Start the worker tasks on the running event loop"""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.PriorityQueue()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                            thread_name_prefix="comic-job")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Job scheduler started with {self.workers} workers, capacity {self.capacity}")
+
+    async def stop(self) -> None:
+        """Cancel the workers and shut down the thread pool"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def retry_after(self) -> int:
+        """Estimate seconds until a queue slot frees up"""
+        if self._durations:
+            avg = sum(self._durations) / len(self._durations)
+        else:
+            avg = DEFAULT_JOB_SECONDS
+        return max(1, int(avg * (self.queued / self.workers + 1)))
+
+    def submit(self, payload, priority: int = 0, job_id: Optional[str] = None,
+               deadline_s: Optional[float] = None, outputs: bool = False) -> Job:
+        """
+        Enqueue a job, raising QueueFullError when at capacity.
+
+        With an admission controller, a job that is not expected to finish
+        within deadline_s seconds raises DeadlineExceeded instead; admitted
+        jobs are cancelled if the deadline passes before they finish.
+        With outputs set, the runner gets a deliver callback and the job
+        collects its partial results (see Job.results).
+        """
+        if self._queue is None:
+            raise RuntimeError("Job scheduler is not running")
+        if self.queued >= self.capacity:
+            raise QueueFullError(self.retry_after())
+        if self.admission is not None:
+            self.admission.admit(deadline_s, self.queued + self.running, self.workers)
+
+        deadline = time.time() + deadline_s if deadline_s else None
+        job = Job(job_id or str(uuid4()), payload, priority, deadline, collect_outputs=outputs)
+        self._remember(job)
+        self._queue.put_nowait((-priority, next(self._counter), job))
+        job.publish("queued", {"position": self.queued})
+        return job
+
+    def complete(self, payload, result, job_id: Optional[str] = None) -> Job:
+        """Record a job that was answered without running (e.g. a cache hit)"""
+        job = Job(job_id or str(uuid4()), payload)
+        self._remember(job)
+        job.started_at = job.finished_at = time.time()
+        job.result = result
+        job.status = "succeeded"
+        job.publish(job.status)
+        job.done.set()
+        record_request("cached")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def cancel(self, job: Job, reason: str = "cancelled") -> bool:
+        """
+        Cancel a job; returns False if it had already finished.
+
+        A queued job finishes straight away. A running job stops before its
+        next pipeline stage and withdraws scenes still waiting for the GPU.
+        """
+        if job.finished:
+            return False
+        job.cancel_reason = reason
+        job.cancelled.set()
+        if job.status == "queued":
+            self._finish_cancelled(job)
+        logger.info(f"Cancelling job {job.id}: {reason}")
+        return True
+
+    async def wait(self, job: Job):
+        """Wait for a job and return its result, re-raising its error"""
+        await job.done.wait()
+        if job.exception is not None:
+            raise job.exception
+        return job.result
+
+    def _remember(self, job: Job) -> None:
+        self._jobs[job.id] = job
+        # Forget the oldest finished jobs once over the history limit
+        if len(self._jobs) > self.history_size:
+            for old_id in [j.id for j in self._jobs.values() if j.finished]:
+                if len(self._jobs) <= self.history_size:
+                    break
+                del self._jobs[old_id]
+
+    def _progress_callback(self, job: Job) -> Callable:
+        def progress(stage: str, detail: Optional[Dict] = None) -> None:
+            self._loop.call_soon_threadsafe(job.publish, stage, detail)
+        return progress
+
+    def _output_callback(self, job: Job) -> Optional[Callable]:
+        if job.outputs is None:
+            return None
+
+        def deliver(kind: str, data: Dict) -> None:
+            self._loop.call_soon_threadsafe(job.emit, kind, data)
+        return deliver
+
+    def _finish_cancelled(self, job: Job) -> None:
+        job.status = "cancelled"
+        job.error = job.cancel_reason
+        job.exception = JobCancelled(f"Job {job.id} was cancelled: {job.cancel_reason}")
+        job.finished_at = time.time()
+        record_request("cancelled")
+        job.publish(job.status, {"reason": job.cancel_reason})
+        job.done.set()
+
+    async def _worker(self) -> None:
+        while True:
+            _, _, job = await self._queue.get()
+            if job.finished:
+                # Cancelled while queued
+                self._queue.task_done()
+                continue
+            service = self.admission.service_estimate() if self.admission is not None else None
+            if job.deadline is not None and service is not None and time.time() + service > job.deadline:
+                # It can no longer make its deadline; running it would only
+                # delay the jobs behind it
+                job.cancel_reason = "deadline cannot be met"
+                self._finish_cancelled(job)
+                self._queue.task_done()
+                continue
+
+            job.status = "running"
+            job.started_at = time.time()
+            self.running += 1
+            expiry = None
+            if job.deadline is not None:
+                expiry = self._loop.call_later(max(0.0, job.deadline - time.time()),
+                                               self.cancel, job, "deadline exceeded")
+            try:
+                job.result = await self._loop.run_in_executor(
+                    self._executor, self.runner, job.payload, self._progress_callback(job), job.cancelled,
+                    self._output_callback(job)
+                )
+                job.status = "succeeded"
+            except Exception as e:
+                if job.cancelled.is_set():
+                    job.exception = JobCancelled(f"Job {job.id} was cancelled: {job.cancel_reason}")
+                    job.error = job.cancel_reason
+                    job.status = "cancelled"
+                else:
+                    logger.error(f"Job {job.id} failed: {str(e)}")
+                    job.exception = e
+                    job.error = str(e)
+                    job.status = "failed"
+            finally:
+                if expiry is not None:
+                    expiry.cancel()
+                self.running -= 1
+                job.finished_at = time.time()
+                self._durations.append(job.finished_at - job.started_at)
+                record_request(job.status, job.finished_at - job.started_at, job.queue_wait)
+                job.publish(job.status)
+                job.done.set()
+                self._queue.task_done()
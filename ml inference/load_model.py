@@ -4,17 +4,105 @@ from huggingface_hub import login
 from vllm import LLM
 from diffusers import DiffusionPipeline
 import logging
+import os
+import shutil
+import threading
+from typing import List
 from config import HUGGING_FACE_TOKEN
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+STORY_MODEL_ID = "Sreenington/Phi-3-mini-4k-instruct-AWQ"
+# Context window of the story model: prompt plus completion tokens
+STORY_MAX_MODEL_LEN = 4096
+SD_MODEL_ID = "Qwen/Qwen-Image"
+
+# Comma-separated diffusion replica devices, e.g. "cuda:0,cuda:1" or
+# "cuda:0+cuda:1,cuda:2+cuda:3" for replicas split over device groups.
+# Empty keeps the single pipeline split with device_map="balanced".
+SD_REPLICA_DEVICES = [d.strip() for d in os.getenv("SD_REPLICA_DEVICES", "").split(",") if d.strip()]
+
+# Reuse the KV cache of shared prompt prefixes (the fixed story/MCQ templates)
+LLM_PREFIX_CACHING = os.getenv("LLM_PREFIX_CACHING", "1") == "1"
+
+# Artifacts kept across restarts: vLLM's torch.compile/CUDA graph cache and,
+# with SD_SNAPSHOT=1, a local bf16 safetensors copy of the diffusion pipeline
+MODEL_ARTIFACT_DIR = os.getenv("MODEL_ARTIFACT_DIR", os.path.expanduser("~/.cache/comic-models"))
+os.environ.setdefault("VLLM_CACHE_ROOT", os.path.join(MODEL_ARTIFACT_DIR, "vllm"))
+SD_SNAPSHOT = os.getenv("SD_SNAPSHOT", "0") == "1"
+SD_SNAPSHOT_DIR = os.path.join(MODEL_ARTIFACT_DIR, "qwen-image")
+
+# Held around each call into the vLLM engine (add, abort, step); see batching.EngineLoop
+llm_engine_lock = threading.RLock()
+
+
+class PrefixCacheStats:
+    """Running totals of prompt tokens and how many were served from the prefix cache"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def record(self, outputs) -> None:
+        """Add the prompt/cached token counts of finished vLLM RequestOutputs"""
+        for output in outputs:
+            prompt_tokens = len(getattr(output, "prompt_token_ids", None) or [])
+            cached_tokens = getattr(output, "num_cached_tokens", None) or 0
+            with self._lock:
+                self.requests += 1
+                self.prompt_tokens += prompt_tokens
+                self.cached_tokens += cached_tokens
+            logger.info(f"Prompt tokens: {prompt_tokens}, served from prefix cache: {cached_tokens}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": LLM_PREFIX_CACHING,
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "hit_rate": round(self.cached_tokens / self.prompt_tokens, 4) if self.prompt_tokens else 0.0
+            }
+
+
+prefix_cache_stats = PrefixCacheStats()
+
+
+def diffusion_source() -> str:
+    """The local pipeline snapshot when one has been saved, else the hub model id"""
+    if SD_SNAPSHOT and os.path.exists(os.path.join(SD_SNAPSHOT_DIR, "model_index.json")):
+        return SD_SNAPSHOT_DIR
+    return SD_MODEL_ID
+
+def save_diffusion_snapshot(pipe, source: str) -> None:
+    """
+    Save a freshly downloaded pipeline as safetensors in its loaded dtype.
+
+    The next boot reads the snapshot from local disk without resolving the
+    hub or converting weights. Failures only cost the speed-up, so they are
+    logged rather than raised.
+    """
+    if not SD_SNAPSHOT or source == SD_SNAPSHOT_DIR:
+        return
+    partial = SD_SNAPSHOT_DIR + ".partial"
+    try:
+        shutil.rmtree(partial, ignore_errors=True)
+        pipe.save_pretrained(partial, safe_serialization=True)
+        os.replace(partial, SD_SNAPSHOT_DIR)
+        logger.info(f"Saved diffusion pipeline snapshot to {SD_SNAPSHOT_DIR}")
+    except Exception as e:
+        shutil.rmtree(partial, ignore_errors=True)
+        logger.warning(f"Could not save diffusion snapshot: {str(e)}")
+
 def load_story():
     """Load the LLM model for story generation"""
     
     try:
         logger.info("Loading LLM model...")
-        model_path = "Sreenington/Phi-3-mini-4k-instruct-AWQ"
+        model_path = STORY_MODEL_ID
         VLLM_ALLOW_LONG_MAX_MODEL_LEN=1
         
         llm = LLM(
@@ -23,8 +111,8 @@ def load_story():
             tensor_parallel_size=1,
             quantization="awq_marlin",
            
-            max_model_len = 4096,
-            enable_prefix_caching=False,
+            max_model_len = STORY_MAX_MODEL_LEN,
+            enable_prefix_caching=LLM_PREFIX_CACHING,
             enable_chunked_prefill=True,
             gpu_memory_utilization=0.30,
             max_num_batched_tokens = 4096
@@ -46,7 +134,7 @@ def load_stablediffusion():
         # Clear CUDA cache before loading model
         torch.cuda.empty_cache()
         
-        model_name = "Qwen/Qwen-Image"
+        model_name = diffusion_source()
 
         if torch.cuda.is_available():
             torch_dtype = torch.bfloat16
@@ -60,13 +148,47 @@ def load_stablediffusion():
 
             device_map="balanced"  # This is where "auto" is valid
         )
-        
+        save_diffusion_snapshot(pipe, model_name)
 
-       
-        
         logger.info("SDXL Turbo model loaded successfully")
         return pipe
         
     except Exception as e:
         logger.error(f"Error loading SDXL Turbo model: {str(e)}")
-        raise Exception(f"Error loading SDXL Turbo model: {str(e)}")
\ No newline at end of file
+        raise Exception(f"Error loading SDXL Turbo model: {str(e)}")
+
+def load_stablediffusion_replica(device: str):
+    """Load one full diffusion pipeline on a device or a `+`-joined device group"""
+    try:
+        logger.info(f"Loading qwen image replica on {device}...")
+        torch_dtype = torch.bfloat16 if torch.cuda.is_available() else torch.float32
+        devices = device.split("+")
+        source = diffusion_source()
+
+        if len(devices) == 1:
+            pipe = DiffusionPipeline.from_pretrained(source, torch_dtype=torch_dtype)
+            pipe = pipe.to(device)
+        else:
+            # Split this replica only across the GPUs in its group
+            max_memory = {}
+            for group_device in devices:
+                index = int(group_device.split(":")[1])
+                max_memory[index] = torch.cuda.mem_get_info(index)[0]
+            pipe = DiffusionPipeline.from_pretrained(
+                source,
+                torch_dtype=torch_dtype,
+                device_map="balanced",
+                max_memory=max_memory
+            )
+        save_diffusion_snapshot(pipe, source)
+
+        logger.info(f"Qwen image replica loaded on {device}")
+        return pipe
+
+    except Exception as e:
+        logger.error(f"Error loading diffusion replica on {device}: {str(e)}")
+        raise Exception(f"Error loading diffusion replica on {device}: {str(e)}")
+
+def load_stablediffusion_replicas(devices: List[str] = SD_REPLICA_DEVICES) -> List:
+    """Load one independent diffusion pipeline per device or device group"""
+    return [(device, load_stablediffusion_replica(device)) for device in devices]
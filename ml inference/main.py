@@ -1,24 +1,33 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Dict, Optional
-import os
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
+from typing import Dict, Literal, Optional
 from contextlib import asynccontextmanager
-import torch
-from vllm import SamplingParams
 from uuid import uuid4
-import io
+import base64
 import json
 
-from load_model import load_story, load_stablediffusion
-from s3_image_upload import upload_to_s3
-from story_gen import generate_story
-from stable_diffusion import generate_stablediffusion, add_text_on_genImages
-from comic_creation import create_comic_pages
-from story_postprocess import story_post_process
-from config import OUTPUT_DIR_BASE
-from mcq import generate_mcqs_from_story
+from model_state import ModelState, release_models
+from startup import Startup
+from model_server import MODEL_SERVER_SOCKET, connect_remote_models
+from pipeline import run_comic_pipeline, pipeline_fingerprint, MAX_PANEL_COUNT, S3_BUCKET_NAME
+from s3_image_upload import S3Uploader
+from result_cache import ResultCache, RESULT_CACHE_ENABLED, FIELD_DEFAULTS
+from jobs import JobScheduler, QueueFullError
+from stable_diffusion import panel_cache, MAX_SCENES, DEFAULT_RENDER_PROFILE
+from load_model import prefix_cache_stats
+from captions import caption_renderer
+from postprocess import shared_executor, shutdown_shared_executor
+from metrics import registry, record_request
+from admission import (admission_controller, DeadlineExceeded, JobCancelled,
+                       ADMISSION_DEFAULT_DEADLINE_S, CANCEL_POLL_S)
 # uvicorn main:app --host 0.0.0.0 --port 5000 --workers 2 --log-level info
+# With several workers, run `python model_server.py` once and set
+# MODEL_SERVER_SOCKET so the workers share one copy of the models.
 
 # Pydantic models for request validation
 from typing import List
@@ -29,6 +38,22 @@ class ComicRequest(BaseModel):
     style: str
     dont_include: str 
     uuid: Optional[str] = None
+    priority: int = 0  # higher runs first when the job queue is busy
+    wait: bool = True  # False returns a job id instead of blocking
+    use_cache: bool = True  # False always runs the full pipeline
+    output_format: Optional[Literal["png", "jpeg", "webp"]] = None  # defaults to OUTPUT_FORMAT
+    background_upload: bool = False  # True responds once the page is encoded; S3 upload continues
+    panel_count: int = Field(MAX_SCENES, ge=1, le=MAX_PANEL_COUNT)  # scenes written and drawn
+    include_timings: bool = False  # True adds the per-stage timing breakdown to the response
+    deadline_s: Optional[float] = Field(None, gt=0)  # seconds the client will wait; 503 if it can't be met
+    render_profile: Optional[Literal["preview", "standard", "high"]] = None  # defaults to SD_RENDER_PROFILE
+
+class JobAccepted(BaseModel):
+    job_id: str
+    uuid: str
+    status: str
+    status_url: str
+    events_url: str
 
 class ComicResponse(BaseModel):
     status: bool
@@ -36,36 +61,73 @@ class ComicResponse(BaseModel):
     uuid: str
     image_url: str
     mcqs: List[str]
-
-# Global state management - define it at module level
-class ModelState:
-    def __init__(self):
-        self.llm = None
-        self.sd_model = None  # Changed from base/refiner to single sd_model
-        self.is_initialized = False
+    renditions: Optional[Dict[str, str]] = None  # URL per rendition, e.g. full and thumb
+    upload: Optional[Dict] = None  # set for background uploads: status_url and local_url
+    timings: Optional[Dict] = None  # seconds per stage and queue wait, when include_timings is set
 
 # Create the global state instance at module level
 global_model_state = ModelState()
+startup = Startup(global_model_state, connect=connect_remote_models if MODEL_SERVER_SOCKET else None)
+
+# Finished comics keyed by normalized request content
+result_cache = ResultCache(
+    field_defaults={**FIELD_DEFAULTS, "render_profile": DEFAULT_RENDER_PROFILE}
+) if RESULT_CACHE_ENABLED else None
+
+# Shared S3 upload service, created in lifespan
+s3_uploader = None
+
+def run_comic_job(payload, progress, cancelled=None, deliver=None):
+    """Job runner: executes the blocking pipeline on a scheduler thread"""
+    request, user_uuid = payload
+    return run_comic_pipeline(request, global_model_state, user_uuid, progress,
+                              cache=result_cache if request.use_cache else None,
+                              uploader=s3_uploader, cancelled=cancelled, deliver=deliver)
+
+def lookup_cached_result(request, user_uuid: str) -> Optional[Dict]:
+    """Answer from the result cache if an equivalent comic was already made"""
+    if result_cache is None or not request.use_cache:
+        return None
+    cached = result_cache.get(request, pipeline_fingerprint())
+    if cached is None:
+        return None
+    return {
+        "uuid": user_uuid,
+        "image_url": cached["image_url"],
+        "renditions": cached.get("renditions"),
+        "mcqs": cached["mcqs"],
+        "story": cached.get("story"),
+        "timings": {"cache_hit": True}
+    }
+
+job_scheduler = JobScheduler(runner=run_comic_job, admission=admission_controller)
 
 # Application lifespan management
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global s3_uploader
     try:
         # Use the global model state
-        print("Loading models...")
-        global_model_state.llm = load_story()
-        global_model_state.sd_model = load_stablediffusion()  # Load single SDXL Turbo model
-        global_model_state.is_initialized = True
-        print("Models loaded successfully!")
+        if MODEL_SERVER_SOCKET:
+            # Thin HTTP worker: models live in the shared model_server process
+            print(f"Connecting to model server at {MODEL_SERVER_SOCKET}...")
+            await startup.start(background=False)
+        else:
+            # Loads and warms up in the background; /health/ready turns 200 when done
+            print("Loading models...")
+            await startup.start()
+        s3_uploader = S3Uploader(S3_BUCKET_NAME)
+        await job_scheduler.start()
         yield
     finally:
         print("Cleaning up resources...")
         try:
-            if global_model_state.llm:
-                del global_model_state.llm
-            if global_model_state.sd_model:
-                del global_model_state.sd_model
-            torch.cuda.empty_cache()
+            await job_scheduler.stop()
+            release_models(global_model_state)
+            shutdown_shared_executor()
+            if s3_uploader is not None:
+                s3_uploader.close()
+                s3_uploader = None
             print("Cleanup complete")
         except Exception as e:
             print(f"Error during cleanup: {str(e)}")
@@ -91,107 +153,290 @@ app.add_middleware(
 async def health_check():
     """Health check endpoint"""
     return {
-        "status": "healthy",
+        "status": "healthy" if startup.ready else startup.status,
         "model_status": "initialized" if global_model_state.is_initialized else "not initialized"
     }
 
-@app.post("/generate-comic", response_model=ComicResponse)
-async def generate_comic(request: ComicRequest):
-    """Generate a comic based on the provided parameters"""
-    
+@app.get("/health/live")
+async def liveness():
+    """Liveness probe: the process is up and startup has not failed"""
+    if startup.failed:
+        return JSONResponse(status_code=503, content={"status": "failed", "error": startup.error})
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    """Readiness probe: 200 once the models are loaded and warmed up"""
+    report = startup.report()
+    if not startup.ready:
+        return JSONResponse(status_code=503, content=report)
+    return report
+
+async def submit_comic(request: ComicRequest, outputs: bool = False):
+    """
+    Answer from the result cache or queue a pipeline job.
+
+    Raises the HTTP error for a full queue or an unmeetable deadline. With
+    outputs set, the job collects its partial results for streaming.
+    """
     if not global_model_state.is_initialized:
         raise HTTPException(status_code=503, detail="Models are not initialized")
     
+    # Use provided UUID or generate a new one
+    user_uuid = request.uuid or str(uuid4())
+
     try:
-        # Use provided UUID or generate a new one
-        user_uuid = request.uuid or str(uuid4())
-        
-        # Create user-specific directories
-        user_output_dir = os.path.join(OUTPUT_DIR_BASE, user_uuid)
-        user_generated_images_dir = os.path.join(user_output_dir, 'generated_images')
-        user_comic_pages_dir = os.path.join(user_output_dir, 'comic_pages')
-        user_comic_pages_final_dir = os.path.join(user_output_dir, user_uuid)
-        
-        os.makedirs(user_generated_images_dir, exist_ok=True)
-        os.makedirs(user_comic_pages_dir, exist_ok=True)
-        os.makedirs(user_comic_pages_final_dir, exist_ok=True)
-        
-        # Prepare sampling parameters
-        sampling_params = SamplingParams(
-            temperature=0.9,
-            top_p=0.7,
-            top_k=5,
-            max_tokens=1000
-        )
-        
-        # 1. Generate story
-        data_point = {
-            "User": request.user_theme,
-            "Genre": request.genre,
-            "Style": request.style,
-            "DontWantToInclude": request.dont_include
-        }
-        
-        story = generate_story(
-            data_point=data_point,
-            llm=global_model_state.llm,
-            sampling_params=sampling_params
-        )
-        
-        # 2. Post-process story
-        processed_story = story_post_process(story)
-        mcqs = generate_mcqs_from_story(
-            story_text=json.dumps(processed_story),
-            llm=global_model_state.llm
-        )
-        # Ensure mcqs is a list of strings
-        if not isinstance(mcqs, list):
-            mcqs = [str(mcqs)]
-        else:
-            mcqs = [str(m) for m in mcqs]
-        
-        # 3. Generate images using SDXL Turbo
-        generate_stablediffusion(
-            story_post_process=processed_story,
-            model=global_model_state.sd_model,  # Pass single model instead of base/refiner
-            output_dir=user_generated_images_dir
-        )
-        
-        # 4. Add text overlays
-        add_text_on_genImages(
-            story_post_process=processed_story,
-            input_dir=user_generated_images_dir,
-            output_dir=user_comic_pages_dir
+        cached = await run_in_threadpool(lookup_cached_result, request, user_uuid)
+        if cached is not None:
+            return job_scheduler.complete((request, user_uuid), cached)
+        return job_scheduler.submit((request, user_uuid), priority=request.priority,
+                                    deadline_s=request.deadline_s or ADMISSION_DEFAULT_DEADLINE_S,
+                                    outputs=outputs)
+    except QueueFullError as e:
+        record_request("rejected")
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
         )
-        
-        # 5. Create final comic pages
-        create_comic_pages(
-            image_folder=user_comic_pages_dir,
-            output_folder=user_comic_pages_final_dir
+    except DeadlineExceeded as e:
+        # Shed the request now rather than let it time out upstream
+        record_request("rejected")
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
         )
 
-        # Read the file content into memory
-        comic_file_path = os.path.join(user_comic_pages_final_dir,  f"{user_uuid}.png")
-        with open(comic_file_path, 'rb') as file:
-            file_content = file.read()
+def comic_response(request: ComicRequest, job, result: Dict) -> ComicResponse:
+    return ComicResponse(
+        status=True,
+        message="Comic generated successfully",
+        uuid=result["uuid"],
+        image_url=result["image_url"],
+        mcqs=result["mcqs"],
+        renditions=result.get("renditions"),
+        upload=upload_links(result.get("upload")),
+        timings=request_timings(job, result) if request.include_timings else None
+    )
 
-        # Upload the file content to S3
-        upload_to_s3(io.BytesIO(file_content), 'comicimages3upload', f"{user_uuid}.png")
-
-        del story, processed_story
-        torch.cuda.empty_cache()
+@app.post("/generate-comic", response_model=ComicResponse)
+async def generate_comic(request: ComicRequest, http_request: Request):
+    """Generate a comic based on the provided parameters"""
+    job = await submit_comic(request)
+    user_uuid = job.payload[1]
 
-        return ComicResponse(
-            status=True,
-            message="Comic generated successfully",
-            uuid = user_uuid,
-            image_url =  f'https://comicimages3upload.s3.us-east-1.amazonaws.com/{user_uuid}.png',
-            mcqs = mcqs
+    # Job mode: return straight away and let the client poll /jobs/{id}
+    if not request.wait:
+        return JSONResponse(
+            status_code=202,
+            content=jsonable_encoder(JobAccepted(
+                job_id=job.id,
+                uuid=user_uuid,
+                status=job.status,
+                status_url=f"/jobs/{job.id}",
+                events_url=f"/jobs/{job.id}/events"
+            ))
         )
-        
+
+    try:
+        result = await wait_for_client(job, http_request)
+        if result is None:
+            # The client is gone; nobody will read a response
+            return Response(status_code=499)
+        return comic_response(request, job, result)
+
+    except JobCancelled as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/generate-comic/stream")
+async def generate_comic_stream(request: ComicRequest):
+    """
+    Generate a comic and stream it as Server-Sent Events.
+
+    Events: "story" with the parsed scenes, one "panel" per captioned scene
+    as soon as it is drawn (base64 image in the output format), "mcqs", and
+    finally "page" with the same body as POST /generate-comic, or "error"
+    with status and detail. Panel and MCQ events arrive in completion order.
+    Closing the connection cancels the job.
+    """
+    job = await submit_comic(request, outputs=True)
+    return StreamingResponse(comic_events(request, job), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+async def comic_events(request: ComicRequest, job):
+    """Partial results of a job as SSE messages, then the final page"""
+    try:
+        async for output in job.results():
+            kind = output.pop("type")
+            if kind == "panel":
+                output["data"] = base64.b64encode(output["data"]).decode("ascii")
+            yield sse_event(kind, output)
+
+        try:
+            result = await job_scheduler.wait(job)
+        except JobCancelled as e:
+            yield sse_event("error", {"status": 504, "detail": str(e)})
+            return
+        except Exception as e:
+            yield sse_event("error", {"status": 500, "detail": str(e)})
+            return
+        if job.outputs is None:
+            # Answered from the result cache: no panels, only the finished comic
+            if result.get("story") is not None:
+                yield sse_event("story", {"story": result["story"]})
+            yield sse_event("mcqs", {"mcqs": result["mcqs"]})
+        yield sse_event("page", jsonable_encoder(comic_response(request, job, result)))
+    finally:
+        # Runs when the client disconnects mid-stream too
+        if not job.finished:
+            job_scheduler.cancel(job, "client disconnected")
+
+def sse_event(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def wait_for_client(job, http_request: Request) -> Optional[Dict]:
+    """
+    Wait for a job while watching the connection.
+
+    If the client disconnects first, the job is cancelled so its remaining
+    stages and queued renders are not run for nobody; returns None then.
+    """
+    waiter = asyncio.ensure_future(job_scheduler.wait(job))
+    while True:
+        done, _ = await asyncio.wait({waiter}, timeout=CANCEL_POLL_S)
+        if done:
+            return waiter.result()
+        if await http_request.is_disconnected():
+            job_scheduler.cancel(job, "client disconnected")
+            waiter.cancel()
+            return None
+
+def request_timings(job, result: Dict) -> Dict:
+    """Stage timings of a finished job plus the time it spent queued"""
+    timings = dict(result.get("timings") or {})
+    if job.queue_wait is not None:
+        timings["queue_wait"] = round(job.queue_wait, 3)
+    return timings
+
+def upload_links(upload: Optional[Dict]) -> Optional[Dict]:
+    """Status and local serving paths for a background upload"""
+    if upload is None:
+        return None
+    return {
+        **upload,
+        "status_url": f"/uploads/{upload['object_name']}",
+        "local_url": f"/comics/{upload['object_name']}"
+    }
+
+@app.get("/uploads/{object_name}")
+async def get_upload(object_name: str):
+    """State of a background S3 upload"""
+    status = s3_uploader.tracker.status(object_name) if s3_uploader is not None else None
+    if status is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return status
+
+@app.get("/comics/{object_name}")
+async def get_comic(object_name: str):
+    """
+    Serve a page from this worker until its S3 upload has landed.
+
+    Afterwards, once the local copy expires, or on any other worker (the
+    local copy only exists where the upload ran), redirect to the S3 object.
+    Without sticky routing a client can therefore be redirected before a
+    background upload finishes and briefly get an error from S3.
+    """
+    if s3_uploader is None:
+        raise HTTPException(status_code=404, detail="Comic not found")
+    local = s3_uploader.tracker.local_copy(object_name)
+    status = s3_uploader.tracker.status(object_name)
+    if status is not None and status["status"] == "done":
+        return RedirectResponse(status["url"])
+    if local is not None:
+        data, content_type = local
+        return Response(content=data, media_type=content_type or "application/octet-stream")
+    if status is not None and status["status"] == "failed":
+        raise HTTPException(status_code=404, detail="Comic not found")
+    return RedirectResponse(s3_uploader.object_url(object_name))
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Result, panel, caption and LLM prefix cache hit-rate and eviction counters"""
+    return {
+        "result": result_cache.stats() if result_cache is not None else {"enabled": False},
+        "panel": panel_cache.stats() if panel_cache is not None else {"enabled": False},
+        "caption": caption_renderer().stats(),
+        "prefix": prefix_cache_stats.stats()
+    }
+
+@registry.collector
+def service_gauges():
+    """Queue depth, render and post-processing load and admission state, read at scrape time"""
+    admission = admission_controller.stats()
+    renderer = global_model_state.sd_renderer
+    return [
+        ("comic_jobs_queued", "Jobs waiting for a scheduler worker", {(): job_scheduler.queued}),
+        ("comic_render_pending", "Scenes queued or rendering on the diffusion renderer",
+         {(): renderer.pending} if renderer is not None else {}),
+        ("comic_postprocess_inflight", "Caption and encode tasks queued or running",
+         {(): shared_executor().stats()["inflight"]}),
+        ("comic_models_ready", "1 once the models are loaded and warmed up", {(): int(startup.ready)}),
+        ("comic_stage_inflight", "Pipeline stages running now",
+         {(("stage", stage),): count for stage, count in admission["inflight"].items()}),
+        ("comic_stage_latency_ewma_seconds", "Recent stage duration used for admission",
+         {(("stage", stage),): seconds for stage, seconds in admission["latency_ewma"].items()}),
+        ("comic_service_estimate_seconds", "Predicted time to run one request",
+         {(): admission["service_estimate"]} if admission["service_estimate"] is not None else {})
+    ]
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Poll the status and result of a queued comic job"""
+    job = job_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running comic job"""
+    job = job_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job_scheduler.cancel(job, "cancelled by client")
+    return job.to_dict()
+
+@app.get("/admission")
+async def admission_stats():
+    """In-flight stages, latency estimates and admission counters"""
+    return {
+        **admission_controller.stats(),
+        "queued": job_scheduler.queued,
+        "running": job_scheduler.running,
+        "workers": job_scheduler.workers
+    }
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """Stream job progress as Server-Sent Events"""
+    job = job_scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_source():
+        async for event in job.stream():
+            yield sse_event(event["stage"], event)
+
+    return StreamingResponse(event_source(), media_type="text/event-stream")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
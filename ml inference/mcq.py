@@ -1,12 +1,18 @@
-from load_model import load_story
+import time
+import logging
+
+from load_model import load_story, prefix_cache_stats
+from metrics import record_llm
 from vllm import SamplingParams
 
+logger = logging.getLogger(__name__)
 
 
-def generate_mcqs_from_story(story_text, llm, sampling_params=None):
 
-    prompt = f'''
-       Generate 3 multiple-choice questions (MCQs) that assess the underlying concepts of the provided story. Each question must include 4 answer options, clearly indicate the correct answer, and ensure that the questions focus on key themes, character motivations, and plot points. The questions should be structured as follow:
+# The instructions and worked examples never change, so they form a shared
+# prompt prefix for vLLM's prefix cache; the story text is appended last.
+MCQ_PROMPT_PREFIX = '''
+       Generate 3 multiple-choice questions (MCQs) that assess the underlying concepts of the story given at the end. Each question must include 4 answer options, clearly indicate the correct answer, and ensure that the questions focus on key themes, character motivations, and plot points. The questions should be structured as follow:
 1. **Question 1: [Insert a key concept or theme related to the story]**
    - A) [Option A]
    - B) [Option B]
@@ -30,7 +36,19 @@ def generate_mcqs_from_story(story_text, llm, sampling_params=None):
 
 
    dont print this input in the output, just generate the questions based on the story text provided
-    '''.replace('story', story_text)
+'''
+
+MCQ_PROMPT_STORY = '''
+Story:
+{story_text}
+
+Questions:
+'''
+
+
+def generate_mcqs_from_story(story_text, llm, sampling_params=None):
+
+    prompt = MCQ_PROMPT_PREFIX + MCQ_PROMPT_STORY.format(story_text=story_text)
 
     if llm is None:
         llm = load_story()
@@ -45,7 +63,10 @@ def generate_mcqs_from_story(story_text, llm, sampling_params=None):
             
         )
 
+    start = time.perf_counter()
     outputs = llm.generate([prompt], sampling_params)
+    record_llm("mcq", outputs, time.perf_counter() - start)
+    prefix_cache_stats.record(outputs)
     raw_text = outputs[0].outputs[0].text.strip()
-    print("LLM response:", raw_text)
+    logger.debug(f"MCQ response: {raw_text}")
     return raw_text  # Return the generated text
\ No newline at end of file
@@ -0,0 +1,228 @@
+# metrics.py
+#
+# In-process counters and histograms exported in the Prometheus text format
+# from GET /metrics. Every hook returns straight away when METRICS_ENABLED=0,
+# so the instrumented code paths pay one global lookup.
+import os
+import re
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+RATE_BUCKETS = (0.5, 1, 2, 4, 8, 16, 32, 64, 128)
+SIZE_BUCKETS = (16e3, 64e3, 256e3, 1e6, 4e6, 16e6, 64e6)
+
+
+def _label_text(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic total per label set"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *label_values) -> None:
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_label_text(self.labels, key)} {value}"
+                    for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """Cumulative buckets, sum and count per label set"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                entry = self._values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    bucket = _label_text(self.labels, key, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{bucket} {bucket_count}")
+                bucket = _label_text(self.labels, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{bucket} {count}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {round(total, 6)}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, key)} {count}")
+        return lines
+
+
+class Registry:
+    """Named metrics plus collectors that read gauges at scrape time"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name: str, help_text: str, labels: Iterable[str] = ()) -> Counter:
+        metric = Counter(name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labels: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn: Callable[[], Iterable[Tuple[str, str, Dict[Tuple, float]]]]) -> Callable:
+        """
+        Register fn() yielding (name, help, {((label, value), ...): gauge}).
+
+        Used as a decorator; collectors run only when /metrics is scraped.
+        """
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        """The Prometheus text exposition of every metric"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        for collect in self._collectors:
+            for name, help_text, values in collect():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} gauge")
+                for labels, value in values.items():
+                    names = tuple(label for label, _ in labels)
+                    label_values = tuple(value for _, value in labels)
+                    lines.append(f"{name}{_label_text(names, label_values)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+requests_total = registry.counter("comic_requests_total", "Comic requests by outcome", ["status"])
+request_seconds = registry.histogram("comic_request_seconds", "End-to-end comic generation time")
+queue_wait_seconds = registry.histogram("comic_queue_wait_seconds", "Time a job waited for a scheduler worker")
+stage_seconds = registry.histogram("comic_stage_seconds", "Wall time per pipeline stage", ["stage"])
+llm_seconds = registry.histogram("comic_llm_seconds", "LLM generate call time", ["task"])
+llm_prompt_tokens = registry.counter("comic_llm_prompt_tokens_total", "Prompt tokens sent to the LLM", ["task"])
+llm_generated_tokens = registry.counter("comic_llm_generated_tokens_total", "Tokens generated by the LLM", ["task"])
+diffusion_steps = registry.counter("comic_diffusion_steps_total", "Denoising steps run, counted per image")
+diffusion_seconds = registry.histogram("comic_diffusion_batch_seconds", "Diffusion pipeline call time")
+diffusion_steps_per_second = registry.histogram(
+    "comic_diffusion_steps_per_second", "Image denoising steps per second per pipeline call", buckets=RATE_BUCKETS
+)
+upload_bytes = registry.counter("comic_upload_bytes_total", "Bytes uploaded to S3")
+uploads_total = registry.counter("comic_uploads_total", "S3 upload attempts by outcome", ["status"])
+upload_seconds = registry.histogram("comic_upload_seconds", "S3 upload attempt time")
+upload_size = registry.histogram("comic_upload_size_bytes", "Size of uploaded objects", buckets=SIZE_BUCKETS)
+
+
+@registry.collector
+def cuda_memory():
+    """Allocated and peak allocated CUDA memory per device"""
+    # Imported here so the scheduler and streaming modules don't need torch
+    try:
+        import torch
+    except ImportError:
+        return []
+    if not torch.cuda.is_available():
+        return []
+    devices = range(torch.cuda.device_count())
+    return [
+        ("comic_cuda_memory_allocated_bytes", "CUDA memory currently allocated by tensors",
+         {(("device", f"cuda:{i}"),): torch.cuda.memory_allocated(i) for i in devices}),
+        ("comic_cuda_memory_peak_bytes", "Peak CUDA memory allocated since start",
+         {(("device", f"cuda:{i}"),): torch.cuda.max_memory_allocated(i) for i in devices})
+    ]
+
+
+# --- hooks -------------------------------------------------------------------
+
+def stage_kind(stage: str) -> str:
+    """image_3 -> image, so per-scene stages share one series"""
+    return re.sub(r"_\d+$", "", stage)
+
+
+def record_stages(timings: Dict[str, Dict]) -> None:
+    """Observe StageGraph.timings for one pipeline run"""
+    if not METRICS_ENABLED:
+        return
+    for stage, timing in timings.items():
+        stage_seconds.observe(timing["duration"], stage_kind(stage))
+
+
+def record_llm(task: str, outputs, seconds: float) -> None:
+    """Observe one generate call and the token counts of its RequestOutputs"""
+    if not METRICS_ENABLED:
+        return
+    llm_seconds.observe(seconds, task)
+    for output in outputs:
+        llm_prompt_tokens.inc(len(getattr(output, "prompt_token_ids", None) or []), task)
+        llm_generated_tokens.inc(sum(len(completion.token_ids or []) for completion in output.outputs), task)
+
+
+def record_diffusion(images: int, steps: int, seconds: float) -> None:
+    """Observe one pipeline call rendering `images` images with `steps` steps each"""
+    if not METRICS_ENABLED:
+        return
+    diffusion_steps.inc(images * steps)
+    diffusion_seconds.observe(seconds)
+    if seconds > 0:
+        diffusion_steps_per_second.observe(images * steps / seconds)
+
+
+def record_upload(size: int, seconds: float, ok: bool) -> None:
+    """Observe one S3 upload attempt"""
+    if not METRICS_ENABLED:
+        return
+    uploads_total.inc(1, "ok" if ok else "error")
+    upload_seconds.observe(seconds)
+    if ok:
+        upload_bytes.inc(size)
+        upload_size.observe(size)
+
+
+def record_request(status: str, seconds: Optional[float] = None, queue_wait: Optional[float] = None) -> None:
+    """Observe a finished comic request"""
+    if not METRICS_ENABLED:
+        return
+    requests_total.inc(1, status)
+    if seconds is not None:
+        request_seconds.observe(seconds)
+    if queue_wait is not None:
+        queue_wait_seconds.observe(queue_wait)
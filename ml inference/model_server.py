@@ -0,0 +1,435 @@
+# model_server.py
+#
+# Dedicated inference process: loads the LLM and diffusion models once and
+# serves every uvicorn worker over a Unix socket.
+#
+#   MODEL_SERVER_SOCKET=/tmp/comic-models.sock python model_server.py
+#   MODEL_SERVER_SOCKET=/tmp/comic-models.sock uvicorn main:app --workers 4 ...
+#
+# Rendered images are handed back through shared memory, so pixel data never
+# goes through the socket or pickle.
+#
+# Messages are pickled, so the socket is only for this machine's API workers:
+# it is created mode 0600 and every connection must know the shared secret.
+# Set MODEL_SERVER_AUTHKEY in both processes, or leave it unset and the
+# server writes a random key to <socket>.key (mode 0600) for clients to read.
+import os
+import time
+import queue
+import secrets
+import logging
+import threading
+from uuid import uuid4
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Client, Listener
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MODEL_SERVER_SOCKET = os.getenv("MODEL_SERVER_SOCKET", "")
+MODEL_SERVER_AUTHKEY = os.getenv("MODEL_SERVER_AUTHKEY", "")
+MODEL_CLIENT_THREADS = int(os.getenv("MODEL_CLIENT_THREADS", "8"))
+# Socket connections one client process keeps open to the server
+MODEL_CLIENT_CONNECTIONS = int(os.getenv("MODEL_CLIENT_CONNECTIONS", "8"))
+# Connections (and handler threads) the server serves at once; more wait to be accepted
+MODEL_SERVER_MAX_CONNECTIONS = int(os.getenv("MODEL_SERVER_MAX_CONNECTIONS", "64"))
+# Exported images no client picked up within this many seconds are freed
+MODEL_SHM_TTL_S = float(os.getenv("MODEL_SHM_TTL_S", "300"))
+SHM_PREFIX = "comic_"
+
+
+class RemoteError(Exception):
+    """An error raised inside the model server"""
+
+
+# --- authentication ----------------------------------------------------------
+
+def key_path(address: str) -> str:
+    return f"{address}.key"
+
+
+def server_authkey(address: str) -> bytes:
+    """MODEL_SERVER_AUTHKEY, or a fresh random key written to <socket>.key"""
+    if MODEL_SERVER_AUTHKEY:
+        return MODEL_SERVER_AUTHKEY.encode("utf-8")
+    authkey = secrets.token_hex(32).encode("utf-8")
+    path = key_path(address)
+    if os.path.exists(path):
+        os.remove(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as file:
+        file.write(authkey)
+    return authkey
+
+
+def client_authkey(address: str) -> bytes:
+    """MODEL_SERVER_AUTHKEY, or the key the server wrote next to its socket"""
+    if MODEL_SERVER_AUTHKEY:
+        return MODEL_SERVER_AUTHKEY.encode("utf-8")
+    try:
+        with open(key_path(address), "rb") as file:
+            return file.read().strip()
+    except OSError as e:
+        raise RuntimeError(f"No MODEL_SERVER_AUTHKEY set and no key file for {address}: {str(e)}")
+
+
+# --- shared-memory image transport -------------------------------------------
+
+# Blocks handed to clients and not yet known to be picked up: name -> export time
+_exported = {}
+_exported_lock = threading.Lock()
+
+
+def export_image(image: Image.Image) -> Dict:
+    """
+    Copy an image into a new shared-memory block and describe it.
+
+    The client takes over the block: attaching registers it with the
+    client's resource tracker and it unlinks the block once read. Until
+    then the server remembers it, and sweep_exported() frees blocks whose
+    client never came for them.
+    """
+    sweep_exported()
+    image = image.convert("RGB")
+    data = image.tobytes()
+    block = shared_memory.SharedMemory(name=f"{SHM_PREFIX}{uuid4().hex[:16]}", create=True, size=len(data))
+    block.buf[:len(data)] = data
+    resource_tracker.unregister(block._name, "shared_memory")
+    block.close()
+    with _exported_lock:
+        _exported[block.name] = time.monotonic()
+    return {"shm": block.name, "size": image.size, "nbytes": len(data)}
+
+
+def discard_export(name: str) -> None:
+    """Free an exported block whose client will not read it"""
+    with _exported_lock:
+        _exported.pop(name, None)
+    try:
+        block = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    block.close()
+    block.unlink()
+
+
+def sweep_exported(ttl: float = MODEL_SHM_TTL_S) -> None:
+    """Forget blocks clients have unlinked; free the ones older than ttl"""
+    now = time.monotonic()
+    with _exported_lock:
+        stale = [name for name, exported_at in _exported.items() if now - exported_at > ttl]
+    for name in stale:
+        discard_export(name)
+
+
+def import_image(handle: Dict) -> Image.Image:
+    """
+    Build an image from a shared-memory block and release the block.
+
+    The pixels are copied once, out of the mapped block into the image;
+    the name is unlinked as soon as the block is attached.
+    """
+    block = shared_memory.SharedMemory(name=handle["shm"])
+    block.unlink()
+    try:
+        view = Image.frombuffer("RGB", tuple(handle["size"]), block.buf[:handle["nbytes"]], "raw", "RGB", 0, 1)
+        image = view.copy()
+        # The view must let go of the mapping before it can be closed
+        del view
+        return image
+    finally:
+        block.close()
+
+
+class RemoteOutput:
+    """Minimal stand-in for a vLLM RequestOutput"""
+
+    class Completion:
+        def __init__(self, text: str, token_ids: List[int]):
+            self.text = text
+            self.token_ids = token_ids
+
+    def __init__(self, text: str, token_ids: List[int], prompt_token_ids: List[int],
+                 num_cached_tokens: int = 0):
+        self.outputs = [self.Completion(text, token_ids)]
+        self.prompt_token_ids = prompt_token_ids
+        self.num_cached_tokens = num_cached_tokens
+
+
+# --- server ------------------------------------------------------------------
+
+class ModelServer:
+    """Serve generate/stream/render calls for one ModelState"""
+
+    def __init__(self, state, address: str = MODEL_SERVER_SOCKET, authkey: Optional[bytes] = None,
+                 max_connections: int = MODEL_SERVER_MAX_CONNECTIONS):
+        self.state = state
+        self.address = address
+        self.authkey = authkey or server_authkey(address)
+        # One handler thread per connection, so this also caps the threads
+        self._slots = threading.BoundedSemaphore(max_connections)
+
+    def serve_forever(self) -> None:
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        # Owner-only from the moment the socket file exists
+        umask = os.umask(0o177)
+        try:
+            listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        finally:
+            os.umask(umask)
+        os.chmod(self.address, 0o600)
+        with listener:
+            logger.info(f"Model server listening on {self.address}")
+            while True:
+                self._slots.acquire()
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    self._slots.release()
+                    logger.error(f"Model server rejected a connection: {str(e)}")
+                    continue
+                threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+    def _serve_connection(self, conn) -> None:
+        try:
+            self._handle(conn)
+        finally:
+            self._slots.release()
+
+    def _handle(self, conn) -> None:
+        with conn:
+            while True:
+                try:
+                    op, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    if op == "stream":
+                        stream = self._stream(*args)
+                        try:
+                            for delta in stream:
+                                conn.send(("delta", delta))
+                        finally:
+                            # Aborts the engine request if the client went away
+                            stream.close()
+                        conn.send(("ok", None))
+                    else:
+                        result = getattr(self, f"_{op}")(*args)
+                        try:
+                            conn.send(("ok", result))
+                        except OSError:
+                            if op == "render":
+                                discard_export(result["shm"])
+                            raise
+                except OSError:
+                    return
+                except Exception as e:
+                    logger.error(f"Model server {op} failed: {str(e)}")
+                    try:
+                        conn.send(("error", str(e)))
+                    except OSError:
+                        return
+
+    def _ping(self):
+        return {"initialized": self.state.is_initialized}
+
+    def _generate(self, prompts, sampling_params):
+        outputs = self.state.llm.generate(prompts, sampling_params)
+        return [
+            (
+                output.outputs[0].text,
+                list(output.outputs[0].token_ids),
+                list(output.prompt_token_ids or []),
+                getattr(output, "num_cached_tokens", 0) or 0
+            )
+            for output in outputs
+        ]
+
+    def _stream(self, prompt, sampling_params):
+        from story_stream import stream_completion
+        return stream_completion(self.state.llm, prompt, sampling_params)
+
+    def _render(self, prompt: str, seed: int, profile: Optional[str] = None):
+        from stable_diffusion import render_batch, render_profile
+        if self.state.sd_renderer is not None:
+            image = self.state.sd_renderer.submit(prompt, seed, profile).result()
+        else:
+            image = render_batch(self.state.sd_model, [prompt], [seed], render_profile(profile)["render"])[0]
+        return export_image(image)
+
+
+# --- client ------------------------------------------------------------------
+
+class ModelServerClient:
+    """
+    Thread-safe client over a bounded pool of socket connections.
+
+    Each call checks a connection out for its duration and returns it, so
+    however many threads use the client, at most `max_connections` sockets
+    (and server handler threads) exist; further callers wait for one.
+    """
+
+    def __init__(self, address: str = MODEL_SERVER_SOCKET, authkey: Optional[bytes] = None,
+                 max_connections: int = MODEL_CLIENT_CONNECTIONS):
+        self.address = address
+        self.authkey = authkey or client_authkey(address)
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._connections = set()
+        self._lock = threading.Lock()
+
+    @property
+    def open_connections(self) -> int:
+        with self._lock:
+            return len(self._connections)
+
+    def _checkout(self):
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            conn = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._connections.add(conn)
+        return conn
+
+    def _checkin(self, conn) -> None:
+        self._idle.put(conn)
+        self._slots.release()
+
+    def _discard(self, conn) -> None:
+        """Close a connection that may hold a half-read reply"""
+        with self._lock:
+            self._connections.discard(conn)
+        conn.close()
+        self._slots.release()
+
+    def call(self, op: str, *args):
+        conn = self._checkout()
+        try:
+            conn.send((op, args))
+            status, payload = conn.recv()
+        except BaseException:
+            self._discard(conn)
+            raise
+        self._checkin(conn)
+        if status == "error":
+            raise RemoteError(payload)
+        return payload
+
+    def stream(self, op: str, *args):
+        conn = self._checkout()
+        finished = False
+        try:
+            conn.send((op, args))
+            while True:
+                status, payload = conn.recv()
+                if status == "delta":
+                    yield payload
+                    continue
+                finished = True
+                if status == "error":
+                    raise RemoteError(payload)
+                return
+        finally:
+            if finished:
+                self._checkin(conn)
+            else:
+                # Stopped early: drop the connection so the server aborts the
+                # request and leftover deltas can't reach the next call
+                self._discard(conn)
+
+    def close(self) -> None:
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = set()
+        while not self._idle.empty():
+            self._idle.get_nowait()
+
+
+class RemoteLLM:
+    """vllm.LLM look-alike backed by the model server"""
+
+    def __init__(self, client: ModelServerClient):
+        self.client = client
+
+    def generate(self, prompts, sampling_params=None, **kwargs):
+        if isinstance(prompts, str):
+            prompts = [prompts]
+        return [RemoteOutput(*result) for result in self.client.call("generate", prompts, sampling_params)]
+
+    def stream_completion(self, prompt: str, sampling_params):
+        return self.client.stream("stream", prompt, sampling_params)
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class RemoteRenderer:
+    """DiffusionBatcher look-alike backed by the model server"""
+
+    def __init__(self, client: ModelServerClient, max_workers: int = MODEL_CLIENT_THREADS):
+        self.client = client
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="remote-render")
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _render(self, prompt: str, seed: int, profile: Optional[str] = None) -> Image.Image:
+        return import_image(self.client.call("render", prompt, seed, profile))
+
+    def _done(self, future: Future) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, prompt: str, seed: int, profile: Optional[str] = None) -> Future:
+        with self._lock:
+            self._pending += 1
+        future = self._executor.submit(self._render, prompt, seed, profile)
+        # Also runs for a scene withdrawn while still queued
+        future.add_done_callback(self._done)
+        return future
+
+    def render(self, prompts: List[str], seeds: List[int], profile: Optional[str] = None) -> List[Image.Image]:
+        futures = [self.submit(prompt, seed, profile) for prompt, seed in zip(prompts, seeds)]
+        return [future.result() for future in futures]
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return self._pending
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def connect_remote_models(state, address: str = MODEL_SERVER_SOCKET) -> None:
+    """Point a ModelState at the model server instead of loading models"""
+    client = ModelServerClient(address)
+    if not client.call("ping")["initialized"]:
+        raise RuntimeError(f"Model server at {address} has no models loaded")
+    state.llm = RemoteLLM(client)
+    state.sd_model = None
+    state.sd_renderer = RemoteRenderer(client)
+    state.is_initialized = True
+
+
+if __name__ == "__main__":
+    from model_state import ModelState
+    from startup import Startup
+
+    if not MODEL_SERVER_SOCKET:
+        raise SystemExit("Set MODEL_SERVER_SOCKET to the Unix socket path to listen on")
+    server_state = ModelState()
+    Startup(server_state).run()
+    ModelServer(server_state).serve_forever()
@@ -0,0 +1,59 @@
+# model_state.py
+import os
+import logging
+
+import torch
+
+from load_model import load_story, load_stablediffusion, load_stablediffusion_replicas, SD_REPLICA_DEVICES
+from batching import LLMBatcher
+from stable_diffusion import DiffusionBatcher, SD_BATCHED
+from diffusion_pool import DiffusionWorkerPool
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Merge story/MCQ prompts from concurrent jobs into shared vLLM batches
+LLM_BATCHING = os.getenv("LLM_BATCHING", "1") == "1"
+
+# Global state management
+class ModelState:
+    def __init__(self):
+        self.llm = None
+        self.sd_model = None  # Changed from base/refiner to single sd_model
+        self.sd_renderer = None  # Shared batching queue in front of sd_model
+        self.is_initialized = False
+
+def load_llm():
+    """Load the LLM behind its batching front-end"""
+    llm = load_story()
+    if LLM_BATCHING:
+        llm = LLMBatcher(llm)
+    return llm
+
+def load_diffusion():
+    """Load the diffusion pipeline(s); returns (sd_model, sd_renderer)"""
+    if SD_REPLICA_DEVICES:
+        # One independent pipeline per device behind a least-loaded dispatcher
+        replicas = load_stablediffusion_replicas(SD_REPLICA_DEVICES)
+        return replicas[0][1], DiffusionWorkerPool(replicas)
+    sd_model = load_stablediffusion()  # Load single SDXL Turbo model
+    return sd_model, DiffusionBatcher(sd_model) if SD_BATCHED else None
+
+def load_models(state: ModelState) -> None:
+    """Load the LLM and diffusion models into state, with their batching front-ends"""
+    state.llm = load_llm()
+    state.sd_model, state.sd_renderer = load_diffusion()
+    state.is_initialized = True
+
+def release_models(state: ModelState) -> None:
+    """Stop the batching threads and free the models held by state"""
+    if hasattr(state.llm, "close"):
+        state.llm.close()
+    if state.sd_renderer is not None:
+        state.sd_renderer.close()
+    if state.llm:
+        del state.llm
+    if state.sd_model:
+        del state.sd_model
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
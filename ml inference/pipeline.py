@@ -0,0 +1,368 @@
+# pipeline.py
+import os
+import io
+import hashlib
+import json
+import logging
+import threading
+from functools import partial
+from typing import Callable, Dict, Optional
+
+import torch
+from vllm import SamplingParams
+
+from s3_image_upload import upload_to_s3
+from story_gen import generate_story, stream_story, STORY_PROMPT_PREFIX, STORY_PROMPT_REQUEST, STORY_GUIDED_JSON
+from stable_diffusion import render_scene, render_profile, MAX_SCENES, BASE_SEED, RENDER_PROFILES, DEFAULT_RENDER_PROFILE
+from comic_creation import grid_shape
+from postprocess import shared_executor, caption_panel, encode_page
+from encoding import (OUTPUT_FORMAT, OUTPUT_QUALITY, OUTPUT_RENDITIONS, FORMATS, parse_renditions,
+                      rendition_object_name, encoding_report, encode_image)
+from story_postprocess import story_post_process, normalize_scene
+from config import OUTPUT_DIR_BASE
+from mcq import generate_mcqs_from_story, MCQ_PROMPT_PREFIX, MCQ_PROMPT_STORY
+from stage_graph import StageGraph
+from metrics import record_stages, stage_kind
+from admission import admission_controller
+from load_model import STORY_MODEL_ID, SD_MODEL_ID
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+S3_BUCKET_NAME = 'comicimages3upload'
+STORY_STREAMING = os.getenv("STORY_STREAMING", "0") == "1"
+STORY_SAMPLING = {
+    "temperature": 0.9,
+    "top_p": 0.7,
+    "top_k": 5,
+    "max_tokens": 1000
+}
+# Largest panel_count a request may ask for
+MAX_PANEL_COUNT = int(os.getenv("MAX_PANEL_COUNT", "10"))
+# Debug mode: also write every scene, overlay and page to OUTPUT_DIR_BASE
+PERSIST_INTERMEDIATES = os.getenv("PERSIST_INTERMEDIATES", "0") == "1"
+
+
+def _noop_progress(stage: str, detail: Optional[Dict] = None) -> None:
+    pass
+
+
+def pipeline_fingerprint() -> Dict:
+    """Model and sampling settings that change the output for a given request"""
+    return {
+        "story_model": STORY_MODEL_ID,
+        "sd_model": SD_MODEL_ID,
+        "story_sampling": STORY_SAMPLING,
+        "guided_json": STORY_GUIDED_JSON,
+        "prompts": hashlib.sha256(
+            (STORY_PROMPT_PREFIX + STORY_PROMPT_REQUEST + MCQ_PROMPT_PREFIX + MCQ_PROMPT_STORY).encode("utf-8")
+        ).hexdigest()[:16],
+        "output": [OUTPUT_FORMAT, OUTPUT_QUALITY, OUTPUT_RENDITIONS],
+        "render_profiles": [DEFAULT_RENDER_PROFILE, RENDER_PROFILES],
+        "max_scenes": MAX_SCENES,
+        "base_seed": BASE_SEED
+    }
+
+
+def run_comic_pipeline(request, model_state, user_uuid: str,
+                       progress: Callable = _noop_progress,
+                       stream: bool = STORY_STREAMING,
+                       cache=None,
+                       uploader=None,
+                       cancelled=None,
+                       deliver: Optional[Callable] = None) -> Dict:
+    """
+    Run the full comic generation pipeline synchronously.
+
+    Stages run as a dependency graph: MCQs are generated while the scenes
+    render, and each scene's overlay is drawn as soon as its image is ready.
+    Images are handed between stages in memory and the page is encoded once,
+    straight into the upload buffer. Captions and the page encode run on the
+    post-processing pool shared by all requests.
+    This is blocking (LLM, diffusion, PIL and S3 work) and is meant to be run
+    off the event loop by the job scheduler.
+
+    Args:
+        request: ComicRequest with the user inputs
+        model_state: ModelState holding the loaded llm and sd_model
+        user_uuid (str): id used for output folders and the S3 object key
+        progress (callable): called as progress(stage, detail) between stages
+        stream (bool): stream the story and start rendering each scene as
+            soon as the model finishes writing it
+        cache (ResultCache): if given, successful results are stored in it
+        uploader (S3Uploader): shared upload service; without one a plain
+            upload_to_s3 call is made. If request.background_upload is set,
+            the page is handed to it after encoding and the result returns
+            without waiting for S3.
+        cancelled (threading.Event): when set, no further stage starts, queued
+            scenes are withdrawn from the renderer and GraphCancelled is raised
+        deliver (callable): if given, called as deliver(kind, data) with each
+            partial result as soon as it exists: "story" once parsed, "panel"
+            for every captioned scene (encoded in the output format) and
+            "mcqs". Results arrive in completion order.
+
+    Returns:
+        dict: uuid, image_url, rendition URLs and mcqs for the ComicResponse,
+        plus per-stage timings and per-rendition encode size and time
+    """
+    # User-specific directories, only written when persisting intermediates
+    user_output_dir = os.path.join(OUTPUT_DIR_BASE, user_uuid)
+    user_generated_images_dir = os.path.join(user_output_dir, 'generated_images')
+    user_comic_pages_dir = os.path.join(user_output_dir, 'comic_pages')
+    user_comic_pages_final_dir = os.path.join(user_output_dir, user_uuid)
+    output_format = getattr(request, "output_format", None) or OUTPUT_FORMAT
+    renditions = parse_renditions()
+    background_upload = uploader is not None and getattr(request, "background_upload", False)
+
+    # Prepare sampling parameters
+    sampling_params = SamplingParams(**STORY_SAMPLING)
+    # One panel per scene: the story, the renders and the page grid are all sized by it
+    panel_count = getattr(request, "panel_count", None) or MAX_SCENES
+    # Steps, resolution and CFG of the renders, and the page's panel size
+    profile_name = getattr(request, "render_profile", None) or DEFAULT_RENDER_PROFILE
+    profile = render_profile(profile_name)
+
+    data_point = {
+        "User": request.user_theme,
+        "Genre": request.genre,
+        "Style": request.style,
+        "DontWantToInclude": request.dont_include
+    }
+
+    def stage_started(name):
+        admission_controller.stage_started(stage_kind(name))
+        progress(name)
+
+    def stage_finished(name, seconds, succeeded):
+        admission_controller.stage_finished(stage_kind(name), seconds, succeeded)
+
+    graph = StageGraph(max_workers=panel_count + 2, on_stage=stage_started,
+                       on_stage_end=stage_finished, cancelled=cancelled)
+    overlay_stages = {}
+
+    def add_scene_stages(scene_num, scene_content):
+        """Fan out a render -> overlay pair for one scene"""
+        if scene_num in overlay_stages or len(overlay_stages) >= panel_count:
+            return
+        graph.add(f"image_{scene_num}", partial(
+            _render_scene, scene_num, scene_content, model_state,
+            os.path.join(user_generated_images_dir, f"scene_{scene_num}.png"), cancelled, profile_name
+        ))
+        graph.add(f"overlay_{scene_num}", partial(
+            _overlay_scene, scene_num, scene_content,
+            os.path.join(user_comic_pages_dir, f"scene_{scene_num}_with_text.png"),
+            partial(_deliver_panel, deliver, scene_num, output_format) if deliver else None
+        ), deps=[f"image_{scene_num}"])
+        overlay_stages[scene_num] = f"overlay_{scene_num}"
+
+    # 1. Generate story; when streaming, each scene starts rendering on arrival
+    def stream_scenes():
+        scenes = []
+        for idx, scene in enumerate(stream_story(
+            data_point=data_point,
+            llm=model_state.llm,
+            sampling_params=sampling_params,
+            scene_count=panel_count
+        ), start=1):
+            scenes.append(scene)
+            normalized = normalize_scene(scene, default_num=idx)
+            if normalized:
+                add_scene_stages(*normalized)
+            if cancelled is not None and cancelled.is_set():
+                # Leaving the loop closes the stream and aborts the request
+                break
+        return scenes
+
+    if stream:
+        graph.add("story", stream_scenes)
+    else:
+        graph.add("story", lambda: generate_story(
+            data_point=data_point,
+            llm=model_state.llm,
+            sampling_params=sampling_params,
+            scene_count=panel_count
+        ))
+
+    # 2. Post-process story, then fan out one render/overlay pair per scene
+    def post_process(story):
+        processed_story = story_post_process(story)
+        if deliver is not None:
+            deliver("story", {"story": processed_story})
+        for scene_num, scene_content in processed_story.items():
+            add_scene_stages(scene_num, scene_content)
+
+        # 5. Create final comic page once every overlay is drawn
+        graph.add("comic_page", partial(
+            _compose_and_encode,
+            grid_shape(panel_count), profile["panel_size"], renditions, output_format,
+            os.path.join(user_comic_pages_final_dir, user_uuid)
+        ), deps=[overlay_stages[num] for num in sorted(overlay_stages)])
+        if not background_upload:
+            graph.add("upload", partial(_upload_renditions, uploader, user_uuid), deps=["comic_page"])
+        return processed_story
+
+    graph.add("story_post_process", post_process, deps=["story"])
+
+    # 3. MCQs only need the story, so they run while the scenes render
+    def mcqs_stage(processed_story):
+        mcqs = _mcq_strings(generate_mcqs_from_story(
+            story_text=json.dumps(processed_story),
+            llm=model_state.llm
+        ))
+        if deliver is not None:
+            deliver("mcqs", {"mcqs": mcqs})
+        return mcqs
+
+    graph.add("mcqs", mcqs_stage, deps=["story_post_process"])
+
+    try:
+        results = graph.run()
+    finally:
+        record_stages(graph.timings)
+    timings = graph.timing_report()
+    progress("timings", timings)
+
+    mcqs = results["mcqs"]
+    encoded = results["comic_page"]
+    encoding = encoding_report(encoded)
+    progress("encoding", encoding)
+    object_names = {
+        name: rendition_object_name(user_uuid, name, info["extension"])
+        for name, info in encoded.items()
+    }
+    rendition_urls = {name: _object_url(uploader, object_name) for name, object_name in object_names.items()}
+    image_url = rendition_urls["full"]
+    story = results["story_post_process"]
+
+    def cache_result(url):
+        if cache is not None and url is not None:
+            cache.put(request, pipeline_fingerprint(), story, mcqs, image_url, rendition_urls)
+
+    upload = None
+    if background_upload:
+        # The URLs are already known; S3 catches up on the uploader's pool.
+        # Cache only once every rendition is up, so a hit never links to a failed one
+        on_done = _all_uploaded(len(encoded), cache_result)
+        for name, info in encoded.items():
+            uploader.upload_in_background(info["data"], object_names[name], info["content_type"],
+                                          on_done=on_done)
+        upload = {"object_name": object_names["full"], "status": "pending"}
+    else:
+        failed = [object_names[name] for name, url in results["upload"].items() if url is None]
+        if failed:
+            raise Exception(f"Failed to upload {', '.join(failed)} to S3")
+        cache_result(image_url)
+
+    del results
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+    return {
+        "uuid": user_uuid,
+        "image_url": image_url,
+        "mcqs": mcqs,
+        "renditions": rendition_urls,
+        "upload": upload,
+        "encoding": encoding,
+        "timings": timings
+    }
+
+
+def _mcq_strings(mcqs) -> list:
+    """Ensure mcqs is a list of strings"""
+    if not isinstance(mcqs, list):
+        return [str(mcqs)]
+    return [str(m) for m in mcqs]
+
+
+def _object_url(uploader, object_name: str) -> str:
+    if uploader is not None:
+        return uploader.object_url(object_name)
+    return f'https://{S3_BUCKET_NAME}.s3.us-east-1.amazonaws.com/{object_name}'
+
+
+def _all_uploaded(count: int, callback: Callable) -> Callable:
+    """
+    on_done for `count` background uploads: calls callback(url) once the
+    last one ends, with url None if any of them failed.
+    """
+    state = {"remaining": count, "ok": True}
+    lock = threading.Lock()
+
+    def on_done(url):
+        with lock:
+            state["remaining"] -= 1
+            state["ok"] = state["ok"] and url is not None
+            if state["remaining"]:
+                return
+        callback(url if state["ok"] else None)
+    return on_done
+
+
+def _upload_renditions(uploader, user_uuid: str, encoded: Dict) -> Dict:
+    """Upload every encoded rendition; returns {rendition: url, or None on failure}"""
+    artifacts = [
+        (rendition_object_name(user_uuid, name, info["extension"]), info["data"], info["content_type"])
+        for name, info in encoded.items()
+    ]
+    if uploader is not None:
+        urls = uploader.upload_many(artifacts)
+    else:
+        urls = {object_name: upload_to_s3(io.BytesIO(data), S3_BUCKET_NAME, object_name)
+                for object_name, data, _ in artifacts}
+    return {name: urls[artifact[0]] for name, artifact in zip(encoded, artifacts)}
+
+
+def _persist(data, path: str) -> None:
+    """Write an intermediate image or encoded bytes to disk in debug mode"""
+    if not PERSIST_INTERMEDIATES:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if isinstance(data, bytes):
+        with open(path, 'wb') as file:
+            file.write(data)
+    else:
+        data.save(path)
+    logger.info(f"Saved {path}")
+
+
+def _render_scene(scene_num, scene_content, model_state, persist_path: str, cancelled=None, profile=None):
+    """Render one scene in memory, optionally saving it for debugging"""
+    image = render_scene(
+        scene_num, scene_content,
+        model=model_state.sd_model, renderer=model_state.sd_renderer,
+        cancelled=cancelled, profile=profile
+    )
+    if image is not None:
+        _persist(image, persist_path)
+    return image
+
+
+def _overlay_scene(scene_num, scene_content, persist_path: str, on_captioned, image):
+    """Overlay text on a scene if its image was rendered"""
+    if image is None:
+        logger.warning(f"Skipping text overlay for failed scene {scene_num}")
+        return None
+    logger.info(f"Adding text to scene {scene_num}")
+    image = shared_executor().run(caption_panel, image, scene_content['narration'])
+    _persist(image, persist_path)
+    if on_captioned is not None:
+        on_captioned(image)
+    return image
+
+
+def _deliver_panel(deliver: Callable, scene_num, output_format: str, image) -> None:
+    """Encode one captioned panel and hand it to the streaming reader"""
+    data = shared_executor().run(encode_image, image, output_format)
+    deliver("panel", {"scene": scene_num, "content_type": FORMATS[output_format]["content_type"], "data": data})
+
+
+def _compose_and_encode(grid, panel_size, renditions: Dict, output_format: str, persist_base: str, *images) -> Dict:
+    """Lay out the captioned scenes on a (rows, cols) grid and encode each rendition once"""
+    images = [image for image in images if image is not None]
+    if not images:
+        raise ValueError("No scenes were rendered for the comic page")
+    encoded = shared_executor().run(encode_page, images, grid, renditions, output_format, None, panel_size)
+    for name, info in encoded.items():
+        _persist(info["data"], rendition_object_name(persist_base, name, info["extension"]))
+    return encoded
@@ -0,0 +1,133 @@
+# postprocess.py
+#
+# Shared CPU pool for the post-diffusion work of every in-flight request:
+# caption overlays, page composition and output encoding. The task functions
+# only depend on PIL, captions, comic_creation and encoding, so workers start
+# without importing torch or the model code.
+import os
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from captions import caption_renderer
+from comic_creation import compose_page
+from encoding import encode_renditions
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# "thread" or "process"; threads suffice while PIL releases the GIL
+POSTPROCESS_MODE = os.getenv("POSTPROCESS_MODE", "thread")
+POSTPROCESS_WORKERS = int(os.getenv("POSTPROCESS_WORKERS", str(os.cpu_count() or 2)))
+# Tasks queued or running at once; submitters block beyond this, which
+# bounds the panels and pages held in memory
+POSTPROCESS_MAX_INFLIGHT = int(os.getenv("POSTPROCESS_MAX_INFLIGHT", str(4 * POSTPROCESS_WORKERS)))
+
+
+# --- tasks -------------------------------------------------------------------
+
+def caption_panel(image: Image.Image, text: str) -> Image.Image:
+    """Draw the caption strip onto one panel"""
+    return caption_renderer().render(image, text)
+
+
+def encode_page(images: List[Image.Image], grid: Tuple[int, int],
+                renditions: Optional[Dict[str, int]] = None, fmt: Optional[str] = None,
+                quality: Optional[int] = None,
+                panel_size: Tuple[int, int] = (768, 768)) -> Dict[str, Dict]:
+    """Lay the captioned panels out on a (rows, cols) grid of panel_size slots and encode every rendition"""
+    page = compose_page(images, image_size=tuple(panel_size), grid_rows=grid[0], grid_cols=grid[1])
+    return encode_renditions(page, renditions, fmt, quality)
+
+
+# --- executor ----------------------------------------------------------------
+
+class PostProcessExecutor:
+    """
+    Bounded thread or process pool shared by all requests.
+
+    submit() blocks while max_inflight tasks are outstanding, so a burst of
+    requests queues on the pool instead of piling decoded images up in
+    memory. Process workers are spawned, never forked, because the parent
+    holds CUDA state.
+    """
+
+    def __init__(self, mode: str = POSTPROCESS_MODE, workers: int = POSTPROCESS_WORKERS,
+                 max_inflight: int = POSTPROCESS_MAX_INFLIGHT):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown post-processing mode: {mode}")
+        self.mode = mode
+        self.workers = workers
+        self.max_inflight = max(max_inflight, workers)
+        if mode == "process":
+            self._executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="postprocess")
+        self._slots = threading.BoundedSemaphore(self.max_inflight)
+        self._lock = threading.Lock()
+        self.counters = {"submitted": 0, "completed": 0, "failed": 0, "inflight": 0}
+        logger.info(f"Post-processing pool: {workers} {mode} workers, {self.max_inflight} tasks in flight")
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Queue fn(*args), waiting for a free slot first"""
+        self._slots.acquire()
+        with self._lock:
+            self.counters["submitted"] += 1
+            self.counters["inflight"] += 1
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def run(self, fn: Callable, *args):
+        """Run fn(*args) on the pool and wait for the result"""
+        return self.submit(fn, *args).result()
+
+    def map(self, fn: Callable, *iterables) -> List:
+        futures = [self.submit(fn, *args) for args in zip(*iterables)]
+        return [future.result() for future in futures]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"mode": self.mode, "workers": self.workers, **self.counters}
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _release(self, future) -> None:
+        with self._lock:
+            self.counters["inflight"] -= 1
+            if future is not None:
+                failed = future.cancelled() or future.exception() is not None
+                self.counters["failed" if failed else "completed"] += 1
+        self._slots.release()
+
+
+_shared_executor = None
+_shared_lock = threading.Lock()
+
+
+def shared_executor() -> PostProcessExecutor:
+    """The process-wide post-processing pool, created on first use"""
+    global _shared_executor
+    with _shared_lock:
+        if _shared_executor is None:
+            _shared_executor = PostProcessExecutor()
+        return _shared_executor
+
+
+def shutdown_shared_executor() -> None:
+    global _shared_executor
+    with _shared_lock:
+        if _shared_executor is not None:
+            _shared_executor.close()
+            _shared_executor = None
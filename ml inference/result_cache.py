@@ -0,0 +1,76 @@
+# result_cache.py
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, Optional
+
+from cache_store import TieredCache
+from config import OUTPUT_DIR_BASE
+from encoding import OUTPUT_FORMAT
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Result cache configuration
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") == "1"
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join(OUTPUT_DIR_BASE, "result_cache"))
+RESULT_CACHE_MEMORY_MB = int(os.getenv("RESULT_CACHE_MEMORY_MB", "256"))
+RESULT_CACHE_DISK_MB = int(os.getenv("RESULT_CACHE_DISK_MB", "2048"))
+
+REQUEST_FIELDS = ("user_theme", "genre", "style", "dont_include", "panel_count", "output_format", "render_profile")
+# Value an unset optional field stands for, so leaving it out and sending the
+# default give the same key
+FIELD_DEFAULTS = {"output_format": OUTPUT_FORMAT}
+
+
+def normalize_field(value) -> str:
+    """Case- and whitespace-insensitive form of a request field"""
+    return " ".join(str(value or "").lower().split())
+
+
+def request_cache_key(request, config: Dict, defaults: Optional[Dict] = None) -> str:
+    """Content hash of the normalized request plus the model/sampling config"""
+    defaults = FIELD_DEFAULTS if defaults is None else defaults
+    payload = {
+        "request": {field: normalize_field(getattr(request, field, None) or defaults.get(field))
+                    for field in REQUEST_FIELDS},
+        "config": config
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class ResultCache:
+    """
+    Cache of finished comics keyed by request content.
+
+    Each entry holds the parsed story, the MCQs and the uploaded page and
+    rendition URLs; the page itself is served from S3.
+    """
+
+    def __init__(self, memory_max_bytes: int = RESULT_CACHE_MEMORY_MB * 1024 ** 2,
+                 disk_dir: Optional[str] = RESULT_CACHE_DIR,
+                 disk_max_bytes: int = RESULT_CACHE_DISK_MB * 1024 ** 2,
+                 field_defaults: Optional[Dict] = None):
+        self.store = TieredCache("result", memory_max_bytes, disk_dir, disk_max_bytes)
+        self.field_defaults = FIELD_DEFAULTS if field_defaults is None else field_defaults
+
+    def get(self, request, config: Dict) -> Optional[Dict]:
+        """Return the cached result for an equivalent request, if any"""
+        data = self.store.get(request_cache_key(request, config, self.field_defaults))
+        if data is None:
+            return None
+        try:
+            return json.loads(data.decode("utf-8"))
+        except ValueError as e:
+            logger.error(f"Corrupt result cache entry: {str(e)}")
+            return None
+
+    def put(self, request, config: Dict, story: Dict, mcqs, image_url: str,
+            renditions: Optional[Dict[str, str]] = None) -> None:
+        entry = {"story": story, "mcqs": mcqs, "image_url": image_url, "renditions": renditions}
+        self.store.put(request_cache_key(request, config, self.field_defaults), json.dumps(entry).encode("utf-8"))
+
+    def stats(self) -> Dict:
+        return self.store.stats()
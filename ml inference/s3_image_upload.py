@@ -1,27 +1,258 @@
-import boto3
-import requests
-import os
-from config import AWS_ACCESS_KEY, AWS_SECRET_KEY, AWS_BUCKET_NAME, AWS_REGION
-# AWS S3 configuration
-
-
-# Express backend URL
-EXPRESS_BACKEND_URL = 'http://your-express-backend-url.com/upload'
-
-
-
-def upload_to_s3(file_obj, bucket_name, object_name=None):
-    if object_name is None:
-        object_name = os.path.basename(file_obj.name)
-
-    s3_client = boto3.client('s3', region_name=AWS_REGION,
-                             aws_access_key_id=AWS_ACCESS_KEY,
-                             aws_secret_access_key=AWS_SECRET_KEY)
-    try:
-        s3_client.upload_fileobj(file_obj, bucket_name, object_name)
-        url = f"https://{bucket_name}.s3.{AWS_REGION}.amazonaws.com/{object_name}"
-        return url
-    except Exception as e:
-        print(f"Error uploading {file_obj.name} to S3: {e}")
-        return None
-
+import boto3
+import requests
+import os
+import io
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, Optional, Tuple
+from metrics import record_upload
+from config import AWS_ACCESS_KEY, AWS_SECRET_KEY, AWS_BUCKET_NAME, AWS_REGION
+# AWS S3 configuration
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Custom endpoint for S3-compatible stores (e.g. a local MinIO for testing)
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "32"))
+S3_UPLOAD_WORKERS = int(os.getenv("S3_UPLOAD_WORKERS", "8"))
+S3_MULTIPART_THRESHOLD_MB = int(os.getenv("S3_MULTIPART_THRESHOLD_MB", "8"))
+S3_MULTIPART_CHUNK_MB = int(os.getenv("S3_MULTIPART_CHUNK_MB", "8"))
+# Upload retries: attempt n waits S3_UPLOAD_BACKOFF_S * 2 ** (n - 1) first
+S3_UPLOAD_RETRIES = int(os.getenv("S3_UPLOAD_RETRIES", "4"))
+S3_UPLOAD_BACKOFF_S = float(os.getenv("S3_UPLOAD_BACKOFF_S", "0.5"))
+# Keep uploaded bytes servable locally this long after the upload ends
+UPLOAD_LOCAL_TTL_S = float(os.getenv("UPLOAD_LOCAL_TTL_S", "300"))
+UPLOAD_HISTORY_SIZE = int(os.getenv("UPLOAD_HISTORY_SIZE", "1000"))
+
+
+# Express backend URL
+EXPRESS_BACKEND_URL = 'http://your-express-backend-url.com/upload'
+
+
+def create_s3_client(endpoint_url=S3_ENDPOINT_URL, max_pool_connections=S3_MAX_POOL_CONNECTIONS):
+    """S3 client with a connection pool sized for concurrent uploads"""
+    from botocore.config import Config
+
+    return boto3.client('s3', region_name=AWS_REGION,
+                        aws_access_key_id=AWS_ACCESS_KEY,
+                        aws_secret_access_key=AWS_SECRET_KEY,
+                        endpoint_url=endpoint_url,
+                        config=Config(max_pool_connections=max_pool_connections,
+                                      retries={"max_attempts": 3, "mode": "standard"}))
+
+
+@lru_cache(maxsize=1)
+def _shared_client():
+    return create_s3_client()
+
+
+def _remaining_bytes(file_obj) -> int:
+    """Bytes left to read in a seekable file object"""
+    try:
+        position = file_obj.tell()
+        end = file_obj.seek(0, io.SEEK_END)
+        file_obj.seek(position)
+        return end - position
+    except (AttributeError, OSError):
+        return 0
+
+
+def upload_to_s3(file_obj, bucket_name, object_name=None):
+    if object_name is None:
+        object_name = os.path.basename(file_obj.name)
+
+    # Reuse one client (and its connection pool) across calls
+    s3_client = _shared_client()
+    size = _remaining_bytes(file_obj)
+    start = time.perf_counter()
+    try:
+        s3_client.upload_fileobj(file_obj, bucket_name, object_name)
+        url = f"https://{bucket_name}.s3.{AWS_REGION}.amazonaws.com/{object_name}"
+        record_upload(size, time.perf_counter() - start, True)
+        return url
+    except Exception as e:
+        record_upload(0, time.perf_counter() - start, False)
+        logger.error(f"Error uploading {object_name} to S3: {str(e)}")
+        return None
+
+
+class UploadTracker:
+    """
+    State of background uploads, plus a local copy of each object.
+
+    The local copy can be served while the upload is queued or retrying,
+    and for local_ttl seconds after it finishes. Only the most recent
+    history_size uploads are remembered.
+    """
+
+    def __init__(self, local_ttl: float = UPLOAD_LOCAL_TTL_S, history_size: int = UPLOAD_HISTORY_SIZE):
+        self.local_ttl = local_ttl
+        self.history_size = history_size
+        self._uploads = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, object_name: str, data: bytes, content_type: Optional[str]) -> None:
+        with self._lock:
+            self._uploads.pop(object_name, None)
+            self._uploads[object_name] = {
+                "object_name": object_name,
+                "status": "pending",
+                "attempts": 0,
+                "url": None,
+                "error": None,
+                "queued_at": time.time(),
+                "finished_at": None,
+                "data": bytes(data),
+                "content_type": content_type
+            }
+            self._expire()
+
+    def attempt(self, object_name: str) -> None:
+        with self._lock:
+            entry = self._uploads.get(object_name)
+            if entry is not None:
+                entry["status"] = "uploading"
+                entry["attempts"] += 1
+
+    def finish(self, object_name: str, url: Optional[str], error: Optional[str] = None) -> None:
+        with self._lock:
+            entry = self._uploads.get(object_name)
+            if entry is not None:
+                entry["status"] = "done" if url else "failed"
+                entry["url"] = url
+                entry["error"] = None if url else error
+                entry["finished_at"] = time.time()
+
+    def status(self, object_name: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._uploads.get(object_name)
+            if entry is None:
+                return None
+            return {key: value for key, value in entry.items() if key not in ("data", "content_type")}
+
+    def local_copy(self, object_name: str) -> Optional[Tuple[bytes, Optional[str]]]:
+        """Bytes and content type of an object that may not be in S3 yet"""
+        with self._lock:
+            self._expire()
+            entry = self._uploads.get(object_name)
+            if entry is None or entry["data"] is None:
+                return None
+            return entry["data"], entry["content_type"]
+
+    def _expire(self) -> None:
+        now = time.time()
+        for entry in self._uploads.values():
+            if entry["finished_at"] is not None and now - entry["finished_at"] > self.local_ttl:
+                entry["data"] = None
+        while len(self._uploads) > self.history_size:
+            self._uploads.popitem(last=False)
+
+
+class S3Uploader:
+    """
+    Long-lived upload service: one pooled S3 client plus an upload thread pool.
+
+    Create it once at startup and share it. Large objects go up as
+    concurrent multipart uploads; upload_many() sends several artifacts
+    (page, panels, thumbnails) in parallel, and upload_in_background()
+    queues one without waiting for it.
+    """
+
+    def __init__(self, bucket_name, endpoint_url=S3_ENDPOINT_URL,
+                 max_workers=S3_UPLOAD_WORKERS,
+                 max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                 multipart_threshold_mb=S3_MULTIPART_THRESHOLD_MB,
+                 multipart_chunk_mb=S3_MULTIPART_CHUNK_MB):
+        from boto3.s3.transfer import TransferConfig
+
+        self.bucket_name = bucket_name
+        self.endpoint_url = endpoint_url
+        self.client = create_s3_client(endpoint_url, max_pool_connections)
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold_mb * 1024 ** 2,
+            multipart_chunksize=multipart_chunk_mb * 1024 ** 2,
+            max_concurrency=max(1, max_pool_connections // max(1, max_workers)),
+            use_threads=True
+        )
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="s3-upload")
+        self.tracker = UploadTracker()
+
+    def object_url(self, object_name: str) -> str:
+        """Public URL of an object in this bucket"""
+        if self.endpoint_url:
+            return f"{self.endpoint_url.rstrip('/')}/{self.bucket_name}/{object_name}"
+        return f"https://{self.bucket_name}.s3.{AWS_REGION}.amazonaws.com/{object_name}"
+
+    def upload(self, data, object_name: str, content_type: Optional[str] = None) -> Optional[str]:
+        """Upload bytes or a file object; returns the object URL, or None on failure"""
+        file_obj = io.BytesIO(data) if isinstance(data, (bytes, bytearray, memoryview)) else data
+        extra_args = {"ContentType": content_type} if content_type else None
+        size = _remaining_bytes(file_obj)
+        start = time.perf_counter()
+        try:
+            self.client.upload_fileobj(file_obj, self.bucket_name, object_name,
+                                       ExtraArgs=extra_args, Config=self.transfer_config)
+            record_upload(size, time.perf_counter() - start, True)
+            return self.object_url(object_name)
+        except Exception as e:
+            record_upload(0, time.perf_counter() - start, False)
+            logger.error(f"Error uploading {object_name} to S3: {str(e)}")
+            return None
+
+    def upload_with_retry(self, data, object_name: str, content_type: Optional[str] = None,
+                          retries: int = S3_UPLOAD_RETRIES,
+                          backoff: float = S3_UPLOAD_BACKOFF_S) -> Optional[str]:
+        """upload() with exponential backoff between failed attempts"""
+        data = data.getvalue() if isinstance(data, io.BytesIO) else data
+        for attempt in range(1, retries + 1):
+            if attempt > 1:
+                delay = backoff * 2 ** (attempt - 2)
+                logger.warning(f"Retrying upload of {object_name} in {delay}s (attempt {attempt}/{retries})")
+                time.sleep(delay)
+            self.tracker.attempt(object_name)
+            url = self.upload(data, object_name, content_type)
+            if url is not None:
+                return url
+        logger.error(f"Giving up on {object_name} after {retries} upload attempts")
+        return None
+
+    def upload_in_background(self, data: bytes, object_name: str, content_type: Optional[str] = None,
+                             on_done: Optional[Callable] = None) -> Future:
+        """
+        Queue a retried upload and return immediately.
+
+        Progress is recorded in self.tracker, which also keeps the bytes
+        for local serving until the object is in S3. on_done(url) is called
+        when the upload ends; url is None if every attempt failed.
+        """
+        self.tracker.start(object_name, data, content_type)
+
+        def run():
+            url = None
+            try:
+                url = self.upload_with_retry(data, object_name, content_type)
+            finally:
+                self.tracker.finish(object_name, url, error=None if url else "upload failed")
+            if on_done is not None:
+                on_done(url)
+            return url
+
+        return self._executor.submit(run)
+
+    def upload_many(self, artifacts: Iterable[Tuple]) -> Dict[str, Optional[str]]:
+        """Upload (object_name, data[, content_type]) artifacts concurrently, with retries"""
+        futures = {}
+        for object_name, data, *content_type in artifacts:
+            futures[object_name] = self._executor.submit(self.upload_with_retry, data, object_name, *content_type)
+        return {object_name: future.result() for object_name, future in futures.items()}
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        close = getattr(self.client, "close", None)
+        if close is not None:
+            close()
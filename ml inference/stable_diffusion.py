@@ -1,232 +1,335 @@
 # stable_diffusion.py
 import torch
 import os
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
 import logging
-from typing import Tuple, Dict
-from load_model import load_stablediffusion
-from config import IMAGE_GENERATION_PARAMS, FONT_CONFIG
-import torch.multiprocessing as mp
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Optional
+from load_model import SD_MODEL_ID
+from config import OUTPUT_DIR_BASE
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 import threading
+import time
+from typing import List
+from batching import MicroBatcher
+from cache_store import TieredCache
+from metrics import record_diffusion
+import hashlib
+import json
+import struct
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Thread lock for model access
+# Thread lock for model access (guards the per-pipeline lock registry)
 model_lock = threading.Lock()
+_pipeline_locks = {}
 
-def wrap_text(text: str, max_width: int, draw: ImageDraw.Draw, font: ImageFont.FreeTypeFont) -> str:
-    """Wrap text to fit within specified width"""
-    words = text.split()
-    wrapped_lines = []
-    current_line = []
+POSITIVE_MAGIC = "Ultra HD, 4K, cinematic composition."
+NEGATIVE_PROMPT = " "  # using an empty string if you do not have specific concept to remove
+BASE_SEED = 42
+MAX_SCENES = 4
+# Quality/latency tiers a request can pick. "render" goes to the pipeline;
+# a true_cfg_scale of 1 turns true CFG off, halving the transformer passes
+# per step. "panel_size" is the slot size of each panel on the final page.
+RENDER_PROFILES = {
+    "preview": {
+        "render": {"width": 384, "height": 384, "num_inference_steps": 6, "true_cfg_scale": 1.0},
+        "panel_size": (384, 384)
+    },
+    "standard": {
+        "render": {"width": 512, "height": 512, "num_inference_steps": 15, "true_cfg_scale": 7.0},
+        "panel_size": (768, 768)
+    },
+    "high": {
+        "render": {"width": 768, "height": 768, "num_inference_steps": 30, "true_cfg_scale": 7.0},
+        "panel_size": (768, 768)
+    }
+}
+DEFAULT_RENDER_PROFILE = os.getenv("SD_RENDER_PROFILE", "standard")
 
-    for word in words:
-        current_line.append(word)
-        line_width = draw.textlength(" ".join(current_line), font=font)
-        
-        if line_width > max_width:
-            if len(current_line) == 1:
-                wrapped_lines.append(current_line[0])
-                current_line = []
-            else:
-                current_line.pop()
-                wrapped_lines.append(" ".join(current_line))
-                current_line = [word]
-
-    if current_line:
-        wrapped_lines.append(" ".join(current_line))
-    
-    return "\n".join(wrapped_lines)
-
-def add_text_box(img: Image.Image,
-                text: str,
-                position: Tuple[int, int, int, int],
-                font: ImageFont.FreeTypeFont) -> Image.Image:
-    """Add text box with background to image"""
-    draw = ImageDraw.Draw(img)
-    
-    # Draw background box
-    draw.rectangle(position, fill=(255, 255, 255, 90))
-    
-    # Calculate text position
-    box_width = position[2] - position[0] - 40
-    wrapped_text = wrap_text(text, box_width, draw, font)
-    
-    # Center text in box
-    text_bbox = draw.textbbox((0, 0), wrapped_text, font=font)
-    text_width = text_bbox[2] - text_bbox[0]
-    text_height = text_bbox[3] - text_bbox[1]
-    
-    box_center_x = (position[2] + position[0]) // 2
-    box_center_y = (position[3] + position[1]) // 2
-    text_x = box_center_x - text_width // 2
-    text_y = box_center_y - text_height // 2
-    
-    # Draw text
-    draw.text((text_x, text_y), wrapped_text, font=font, fill=(0, 0, 0, 255))
-    
-    return img
+def render_profile(name: Optional[str] = None) -> Dict:
+    """Settings of a named render profile; None picks DEFAULT_RENDER_PROFILE"""
+    name = name or DEFAULT_RENDER_PROFILE
+    if name not in RENDER_PROFILES:
+        raise ValueError(f"Unknown render profile: {name}")
+    return RENDER_PROFILES[name]
+
+RENDER_PARAMS = render_profile()["render"]
+
+# Batched rendering configuration
+SD_BATCHED = os.getenv("SD_BATCHED", "1") == "1"
+SD_BATCH_WINDOW_MS = float(os.getenv("SD_BATCH_WINDOW_MS", "20"))
+SD_MAX_BATCH_SIZE = int(os.getenv("SD_MAX_BATCH_SIZE", "4"))
+# Rough activation memory needed per 512x512 image in a batch; scaled by pixel count
+SD_BYTES_PER_IMAGE = int(os.getenv("SD_BYTES_PER_IMAGE", str(3 * 1024 ** 3)))
+
+# Panel cache configuration
+PANEL_CACHE_ENABLED = os.getenv("PANEL_CACHE_ENABLED", "1") == "1"
+PANEL_CACHE_DIR = os.getenv("PANEL_CACHE_DIR", os.path.join(OUTPUT_DIR_BASE, "panel_cache"))
+PANEL_CACHE_MEMORY_MB = int(os.getenv("PANEL_CACHE_MEMORY_MB", "512"))
+PANEL_CACHE_DISK_MB = int(os.getenv("PANEL_CACHE_DISK_MB", "4096"))
+
+class PanelCache:
+    """
+    Rendered panels keyed by everything that determines their pixels: the
+    exact prompt sent to the pipeline, the negative prompt, the seed, the
+    render parameters and the model id. Panels are stored as raw RGB.
+    """
+
+    def __init__(self, memory_max_bytes: int = PANEL_CACHE_MEMORY_MB * 1024 ** 2,
+                 disk_dir: Optional[str] = PANEL_CACHE_DIR,
+                 disk_max_bytes: int = PANEL_CACHE_DISK_MB * 1024 ** 2):
+        self.store = TieredCache("panel", memory_max_bytes, disk_dir, disk_max_bytes)
+
+    @staticmethod
+    def key(full_prompt: str, seed: int, render_params: dict, model_id: str = SD_MODEL_ID) -> str:
+        payload = {
+            "prompt": full_prompt,
+            "negative_prompt": NEGATIVE_PROMPT,
+            "seed": seed,
+            "render_params": render_params,
+            "model": model_id
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, full_prompt: str, seed: int, render_params: dict) -> Optional[Image.Image]:
+        data = self.store.get(self.key(full_prompt, seed, render_params))
+        if data is None:
+            return None
+        width, height = struct.unpack(">II", data[:8])
+        return Image.frombytes("RGB", (width, height), data[8:])
+
+    def put(self, full_prompt: str, seed: int, render_params: dict, image: Image.Image) -> None:
+        image = image.convert("RGB")
+        data = struct.pack(">II", *image.size) + image.tobytes()
+        self.store.put(self.key(full_prompt, seed, render_params), data)
+
+    def stats(self) -> Dict:
+        return self.store.stats()
+
+panel_cache = PanelCache() if PANEL_CACHE_ENABLED else None
+
+def _generator_device(device: Optional[str] = None) -> str:
+    """Device for seeded generators; the first device of a group like cuda:0+cuda:1"""
+    if not torch.cuda.is_available():
+        return "cpu"
+    if device is None:
+        return "cuda"
+    device = device.split("+")[0]
+    return device if device.startswith("cuda") else "cpu"
+
+def pipeline_kwargs(params: dict, count: Optional[int] = None) -> Dict:
+    """
+    Keyword arguments for one pipeline call with these render params.
+
+    The negative prompt is only sent when true CFG is on, since it is what
+    makes the pipeline run the second (unconditional) pass. `count` gives
+    list-valued prompts for a batch.
+    """
+    kwargs = dict(params)
+    if params.get("true_cfg_scale", 1.0) > 1.0:
+        kwargs["negative_prompt"] = NEGATIVE_PROMPT if count is None else [NEGATIVE_PROMPT] * count
+    return kwargs
+
+def pipeline_lock(pipe) -> threading.Lock:
+    """Lock serializing calls into one pipeline; replicas run independently"""
+    with model_lock:
+        lock = _pipeline_locks.get(id(pipe))
+        if lock is None:
+            lock = _pipeline_locks[id(pipe)] = threading.Lock()
+        return lock
 
 def generate_image(prompt: str,
                   pipe,
                   seed: int = 42,
-                  params: dict = IMAGE_GENERATION_PARAMS) -> Image.Image:
+                  params: Optional[dict] = None) -> Image.Image:
     """Generate a single image using SDXL Turbo"""
     try:
+        params = params or RENDER_PARAMS
+        full_prompt = prompt + POSITIVE_MAGIC
+        if panel_cache is not None:
+            cached = panel_cache.get(full_prompt, seed, params)
+            if cached is not None:
+                logger.info(f"Panel cache hit for prompt: {prompt[:50]}...")
+                return cached
+
         # Use a lock to ensure only one thread accesses the model at a time
-        with model_lock:
-            generator = torch.manual_seed(seed)
-            positive_magic = {
-            "en": "Ultra HD, 4K, cinematic composition." # for english prompt,
-    
-}
-            negative_prompt = " "  # using an empty string if you do not have specific concept to remove
-            
-            
+        with pipeline_lock(pipe):
             # Generate image with SDXL Turbo
             logger.info(f"Generating image for prompt: {prompt[:50]}...")
+            start = time.perf_counter()
             image = pipe(
-            prompt=prompt + positive_magic["en"],
-            negative_prompt=negative_prompt,
-            width=512,
-            height=512,
-            num_inference_steps=15,
-            true_cfg_scale=7,
-            generator=torch.Generator(device="cuda").manual_seed(42)
+            prompt=full_prompt,
+            **pipeline_kwargs(params),
+            generator=torch.Generator(device=_generator_device()).manual_seed(seed)
         ).images[0]
-            
-            return image
+            record_diffusion(1, params["num_inference_steps"], time.perf_counter() - start)
+
+        if panel_cache is not None:
+            panel_cache.put(full_prompt, seed, params, image)
+        return image
         
     except Exception as e:
         logger.error(f"Image generation error: {str(e)}")
         raise Exception(f"Image generation error: {str(e)}")
 
-def process_scene(scene_data, model, output_dir):
-    """Process a single scene - for thread pool"""
-    scene_num, prompt = scene_data
+def select_batch_size(max_batch_size: int = SD_MAX_BATCH_SIZE,
+                      bytes_per_image: int = SD_BYTES_PER_IMAGE,
+                      device: Optional[str] = None,
+                      params: Optional[dict] = None) -> int:
+    """Pick how many images to render at once from free GPU memory"""
+    generator_device = _generator_device(device)
+    if not generator_device.startswith("cuda"):
+        return max_batch_size
+    params = params or RENDER_PARAMS
+    bytes_per_image = max(1, int(bytes_per_image * params["width"] * params["height"] / (512 * 512)))
+    free_bytes, _ = torch.cuda.mem_get_info(None if generator_device == "cuda" else generator_device)
+    return max(1, min(max_batch_size, free_bytes // bytes_per_image))
+
+def render_batch(pipe,
+                 prompts: List[str],
+                 seeds: List[int],
+                 params: Optional[dict] = None,
+                 device: Optional[str] = None) -> List[Image.Image]:
+    """Render several prompts in one pipeline call, one seeded generator each"""
     try:
-        # Generate the image using the shared model instance
-        image = generate_image(prompt, model)
-        
-        # Save the image
-        output_path = os.path.join(output_dir, f"scene_{scene_num}.png")
-        image.save(output_path)
-        logger.info(f"Saved scene {scene_num} to {output_path}")
-        return scene_num, True
+        params = params or RENDER_PARAMS
+        full_prompts = [prompt + POSITIVE_MAGIC for prompt in prompts]
+        images = [None] * len(prompts)
+        if panel_cache is not None:
+            for i, (full_prompt, seed) in enumerate(zip(full_prompts, seeds)):
+                images[i] = panel_cache.get(full_prompt, seed, params)
+
+        # Only the panels missing from the cache go to the pipeline
+        missing = [i for i, image in enumerate(images) if image is None]
+        if not missing:
+            logger.info(f"Panel cache hit for all {len(prompts)} images")
+            return images
+
+        generators = [torch.Generator(device=_generator_device(device)).manual_seed(seeds[i])
+                      for i in missing]
+        with pipeline_lock(pipe):
+            logger.info(f"Generating batch of {len(missing)} images "
+                        f"({len(prompts) - len(missing)} from panel cache)")
+            start = time.perf_counter()
+            rendered = pipe(
+                prompt=[full_prompts[i] for i in missing],
+                **pipeline_kwargs(params, len(missing)),
+                generator=generators
+            ).images
+            record_diffusion(len(missing), params["num_inference_steps"], time.perf_counter() - start)
+
+        for i, image in zip(missing, rendered):
+            images[i] = image
+            if panel_cache is not None:
+                panel_cache.put(full_prompts[i], seeds[i], params, image)
+        return images
+
     except Exception as e:
-        logger.error(f"Error processing scene {scene_num}: {str(e)}")
-        return scene_num, False
+        logger.error(f"Batched image generation error: {str(e)}")
+        raise Exception(f"Batched image generation error: {str(e)}")
 
-def generate_stablediffusion(story_post_process: Dict, output_dir, model=None) -> None:
-    """Generate images for all scenes in the story concurrently using SDXL Turbo"""
-    try:
-        # Create output directory
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Check for CUDA availability
-        if not torch.cuda.is_available():
-            raise RuntimeError("CUDA is not available. Cannot generate images.")
-        
-        # Load model if not provided
-        if model is None:
-            logger.info("Loading SDXL Turbo model...")
-            model = load_stablediffusion()
-            logger.info("Model loaded successfully")
-        positive_magic = {
-        "en": "Ultra HD, comic cartoon composition."}
-        # Move model to GPU
-        #model.to("cuda")  # Use balanced device map for multi-GPU setups
-        
-        # Prepare prompts and scene numbers
-        tasks = []
-        for idx, (scene_num, scene_content) in enumerate(story_post_process.items()):
-            
-            if idx >= 4:
-                break
-            image_prompt = scene_content['image_prompt']
-            dialogue = scene_content.get('dialogue', '')
-            prompt = f'{image_prompt} Render the following dialogue in a speech bubble: "{dialogue}". Maintain environment setup and character consistency.'
-            tasks.append((scene_num, prompt))
-        
-        # Process scenes concurrently using a thread pool and the same model instance
-        logger.info(f"Starting concurrent image generation for {len(tasks)} scenes using SDXL Turbo")
-        
-        # Use ThreadPoolExecutor to submit tasks
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            # Submit all tasks to the thread pool
-            futures = []
-            for scene_num, prompt in tasks:
-                futures.append(
-                    executor.submit(
-                        process_scene, 
-                        (scene_num, prompt), 
-                        model, 
-                        output_dir
-                    )
+class DiffusionBatcher:
+    """
+    Shared render queue for one diffusion pipeline.
+
+    Scenes submitted by concurrent requests within `window_ms` are rendered
+    together; each flush is grouped by render profile, since one pipeline
+    call has one resolution and step count, and each group is split into
+    chunks sized by select_batch_size(). `device` is the replica's device (or `cuda:0+cuda:1` group) when the
+    pipeline is one of several replicas.
+    """
+
+    def __init__(self, pipe,
+                 window_ms: float = SD_BATCH_WINDOW_MS,
+                 max_batch_size: int = SD_MAX_BATCH_SIZE,
+                 device: Optional[str] = None):
+        self.pipe = pipe
+        self.max_batch_size = max_batch_size
+        self.device = device
+        self._batcher = MicroBatcher(
+            self._render,
+            max_wait_ms=window_ms,
+            max_batch_cost=max_batch_size,
+            name=f"diffusion-batcher-{device}" if device else "diffusion-batcher"
+        )
+
+    def submit(self, prompt: str, seed: int = BASE_SEED, profile: Optional[str] = None) -> Future:
+        """Queue one scene and return a future for its image"""
+        render_profile(profile)
+        return self._batcher.submit((prompt, seed, profile or DEFAULT_RENDER_PROFILE))
+
+    def render(self, prompts: List[str], seeds: List[int], profile: Optional[str] = None) -> List[Image.Image]:
+        futures = [self.submit(prompt, seed, profile) for prompt, seed in zip(prompts, seeds)]
+        return [future.result() for future in futures]
+
+    @property
+    def pending(self) -> int:
+        return self._batcher.pending
+
+    def close(self) -> None:
+        self._batcher.close()
+
+    def _render(self, items: List) -> List[Image.Image]:
+        images = [None] * len(items)
+        groups = {}
+        for i, (_, _, profile) in enumerate(items):
+            groups.setdefault(profile, []).append(i)
+        for profile, indices in groups.items():
+            params = render_profile(profile)["render"]
+            chunk_size = select_batch_size(self.max_batch_size, device=self.device, params=params)
+            for start in range(0, len(indices), chunk_size):
+                chunk = indices[start:start + chunk_size]
+                rendered = render_batch(
+                    self.pipe,
+                    [items[i][0] for i in chunk],
+                    [items[i][1] for i in chunk],
+                    params=params,
+                    device=self.device
                 )
-            
-            # Process results as they complete
-            for future in as_completed(futures):
-                scene_num, success = future.result()
-                if success:
-                    logger.info(f"Successfully processed scene {scene_num}")
-                else:
-                    logger.warning(f"Failed to process scene {scene_num}")
-        
-        logger.info("All image generation completed")
-                
-    except Exception as e:
-        logger.error(f"Error in batch image generation: {str(e)}")
-        raise
+                for i, image in zip(chunk, rendered):
+                    images[i] = image
+        return images
+
+def build_scene_prompt(scene_content: Dict) -> str:
+    """Build the diffusion prompt for one scene"""
+    image_prompt = scene_content['image_prompt']
+    dialogue = scene_content.get('dialogue', '')
+    return f'{image_prompt} Render the following dialogue in a speech bubble: "{dialogue}". Maintain environment setup and character consistency.'
 
-def add_text_on_genImages(story_post_process, input_dir: str, output_dir: str) -> None:
-    """Add text overlays to the generated images"""
+def scene_seed(scene_num, base_seed: int = BASE_SEED) -> int:
+    """Deterministic per-scene seed so panels in a batch differ"""
+    return base_seed + int(scene_num)
+
+def render_scene(scene_num, scene_content: Dict, model=None,
+                 renderer=None, batched: bool = SD_BATCHED,
+                 cancelled: Optional[threading.Event] = None,
+                 poll_interval: float = 0.25,
+                 profile: Optional[str] = None) -> Optional[Image.Image]:
+    """
+    Render one scene in memory at the given render profile, returning None
+    if generation failed.
+
+    If `cancelled` is set while the scene is still queued on the renderer,
+    it is withdrawn from the queue and None is returned.
+    """
+    prompt = build_scene_prompt(scene_content)
+    params = render_profile(profile)["render"]
     try:
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Load fonts
-        base_font_size = FONT_CONFIG["base_size"]
-        font_path = FONT_CONFIG["path"]
-        narration_font = ImageFont.truetype(font_path, base_font_size )
-        dialogue_font = ImageFont.truetype(font_path, base_font_size)
-        
-        # Process each scene
-        for scene_num, scene_content in story_post_process.items():
-            logger.info(f"Adding text to scene {scene_num}")
-            
-            # Load image
-            image_path = os.path.join(input_dir, f"scene_{scene_num}.png")
-            if not os.path.exists(image_path):
-                logger.warning(f"Image not found: {image_path}")
-                continue
-                
-            image = Image.open(image_path).convert("RGBA")
-            img_width, img_height = image.size
-            
-            # Add narration at top
-            #image = add_text_box(
-            #    image,
-            #    scene_content['narration'],
-            ##    (0, 0, img_width, 70),
-             #   narration_font
-           # )
-            
-            # Add dialogue at bottom
-            image = add_text_box(
-                image,
-                scene_content['narration'],
-                (0, img_height - 70, img_width, img_height),
-                dialogue_font
-            )
-            
-            # Save final image
-            output_path = os.path.join(output_dir, f"scene_{scene_num}_with_text.png")
-            image.convert("RGB").save(output_path)
-            logger.info(f"Saved scene {scene_num} with text to {output_path}")
-            
+        if not batched:
+            return generate_image(prompt, model, seed=scene_seed(scene_num), params=params)
+        if renderer is not None:
+            future = renderer.submit(prompt, scene_seed(scene_num), profile)
+            while cancelled is not None:
+                try:
+                    return future.result(timeout=poll_interval)
+                except FutureTimeoutError:
+                    if cancelled.is_set() and future.cancel():
+                        logger.info(f"Withdrew scene {scene_num} from the render queue")
+                        return None
+            return future.result()
+        return render_batch(model, [prompt], [scene_seed(scene_num)], params)[0]
     except Exception as e:
-        logger.error(f"Error in text overlay process: {str(e)}")
-        raise Exception(f"Text overlay error: {str(e)}")
\ No newline at end of file
+        logger.error(f"Error processing scene {scene_num}: {str(e)}")
+        return None
@@ -0,0 +1,157 @@
+# stage_graph.py
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """A named unit of work and the stages it depends on"""
+
+    def __init__(self, name: str, fn: Callable, deps: Iterable[str] = ()):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+
+
+class GraphCancelled(Exception):
+    """Raised by StageGraph.run() when its cancel event was set"""
+
+
+class StageGraph:
+    """
+    Run pipeline stages as a dependency graph.
+
+    Each stage starts on the thread pool as soon as all of its dependencies
+    have finished, and is called with their results as positional arguments
+    in `deps` order. Stages may add further stages while the graph is running
+    (e.g. one render stage per scene once the story is parsed).
+
+    Setting `cancelled` stops the graph: no further stage starts, and run()
+    raises GraphCancelled once the stages already running have returned, so
+    the caller never has work left behind on the GPU. Long stages should
+    check the event themselves to return early. The same wait applies when
+    a stage fails. on_stage_end(name, seconds, succeeded) is called after
+    every stage; succeeded is False if it raised or the graph was cancelled.
+    """
+
+    def __init__(self, max_workers: int = 8, on_stage: Optional[Callable] = None,
+                 on_stage_end: Optional[Callable] = None,
+                 cancelled: Optional[threading.Event] = None,
+                 poll_interval: float = 0.25):
+        self.max_workers = max_workers
+        self.on_stage = on_stage
+        self.on_stage_end = on_stage_end
+        self.cancelled = cancelled
+        self.poll_interval = poll_interval
+        self.results = {}
+        self.timings = {}
+        self._stages = {}
+        self._started = set()
+        self._lock = threading.Lock()
+        self._wakeup = Future()
+        self._start_time = None
+
+    def add(self, name: str, fn: Callable, deps: Iterable[str] = ()) -> None:
+        """Register a stage; safe to call from inside a running stage"""
+        with self._lock:
+            if name in self._stages:
+                raise ValueError(f"Stage {name} is already defined")
+            self._stages[name] = Stage(name, fn, deps)
+            wakeup = self._wakeup
+        if not wakeup.done():
+            wakeup.set_result(None)
+
+    def run(self) -> Dict:
+        """Run every stage and return the results keyed by stage name"""
+        self._start_time = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="stage")
+        running = {}
+        try:
+            while True:
+                if self._is_cancelled():
+                    raise GraphCancelled("Stage graph was cancelled")
+                with self._lock:
+                    if self._wakeup.done():
+                        self._wakeup = Future()
+                    wakeup = self._wakeup
+                    for stage in self._ready_stages():
+                        self._started.add(stage.name)
+                        running[executor.submit(self._run_stage, stage)] = stage.name
+                    if not running:
+                        blocked = [name for name in self._stages if name not in self._started]
+                        if blocked:
+                            raise RuntimeError(f"Stages with unmet dependencies: {blocked}")
+                        break
+
+                timeout = self.poll_interval if self.cancelled is not None else None
+                done, _ = wait(list(running) + [wakeup], timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future is wakeup:
+                        continue
+                    name = running.pop(future)
+                    # Propagate the first stage failure and drop queued stages
+                    error = future.exception()
+                    if error is not None:
+                        if not isinstance(error, GraphCancelled):
+                            logger.error(f"Stage {name} failed: {str(error)}")
+                        raise error
+        finally:
+            # Queued stages are dropped, running ones are waited for
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        self._log_timings()
+        return self.results
+
+    def timing_report(self) -> Dict[str, float]:
+        """Per-stage durations plus wall time and the time saved by overlap"""
+        report = {name: round(t["duration"], 3) for name, t in self.timings.items()}
+        if self.timings:
+            wall = max(t["end"] for t in self.timings.values())
+            serial = sum(t["duration"] for t in self.timings.values())
+            report["wall_time"] = round(wall, 3)
+            report["serial_time"] = round(serial, 3)
+            report["overlap_saved"] = round(serial - wall, 3)
+        return report
+
+    def _ready_stages(self):
+        return [
+            stage for stage in self._stages.values()
+            if stage.name not in self._started
+            and all(dep in self.results for dep in stage.deps)
+        ]
+
+    def _is_cancelled(self) -> bool:
+        return self.cancelled is not None and self.cancelled.is_set()
+
+    def _run_stage(self, stage: Stage):
+        if self._is_cancelled():
+            raise GraphCancelled("Stage graph was cancelled")
+        args = [self.results[dep] for dep in stage.deps]
+        start = time.perf_counter() - self._start_time
+        if self.on_stage:
+            self.on_stage(stage.name)
+        succeeded = False
+        try:
+            result = stage.fn(*args)
+            succeeded = not self._is_cancelled()
+        finally:
+            end = time.perf_counter() - self._start_time
+            if self.on_stage_end:
+                self.on_stage_end(stage.name, end - start, succeeded)
+        with self._lock:
+            self.results[stage.name] = result
+            self.timings[stage.name] = {"start": start, "end": end, "duration": end - start}
+        return result
+
+    def _log_timings(self) -> None:
+        report = self.timing_report()
+        if "wall_time" in report:
+            logger.info(
+                f"Stage timings: wall {report['wall_time']}s, serial {report['serial_time']}s, "
+                f"overlap saved {report['overlap_saved']}s"
+            )
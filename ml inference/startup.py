@@ -0,0 +1,197 @@
+# startup.py
+#
+# Model boot sequence: load the LLM and the diffusion pipeline side by side,
+# warm both up, then mark the ModelState initialized. Loaders and warm-ups
+# are plain callables, so the sequencing can be exercised with stubs on CPU:
+#
+#   Startup(state, llm_loader=lambda: FakeLLM(), diffusion_loader=lambda: (pipe, None),
+#           llm_warmup=lambda llm: None, diffusion_warmup=lambda model, renderer: None).run()
+import os
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import torch
+from vllm import SamplingParams
+
+from model_state import ModelState, load_llm, load_diffusion
+from stable_diffusion import RENDER_PARAMS, BASE_SEED, pipeline_kwargs, pipeline_lock, _generator_device
+from story_gen import STORY_PROMPT_PREFIX
+from mcq import MCQ_PROMPT_PREFIX
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Load the two models at the same time; set to 0 if they share a GPU and
+# vLLM's memory profiling is thrown off by the diffusion weights arriving
+STARTUP_CONCURRENT = os.getenv("STARTUP_CONCURRENT", "1") == "1"
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "1") == "1"
+# Load in the background so liveness answers while the models come up
+STARTUP_BACKGROUND = os.getenv("STARTUP_BACKGROUND", "1") == "1"
+WARMUP_STEPS = int(os.getenv("WARMUP_STEPS", "2"))
+
+
+def warmup_llm(llm) -> None:
+    """Prefill the fixed story and MCQ templates, leaving them in the prefix cache"""
+    llm.generate([STORY_PROMPT_PREFIX, MCQ_PROMPT_PREFIX], SamplingParams(max_tokens=1))
+
+
+def diffusion_replicas(sd_model, sd_renderer) -> List[Tuple[Optional[str], object]]:
+    """(device, pipeline) of every replica behind the renderer"""
+    if hasattr(sd_renderer, "workers"):
+        return [(worker.device, worker.batcher.pipe) for worker in sd_renderer.workers]
+    return [(getattr(sd_renderer, "device", None), sd_model)]
+
+
+def warmup_diffusion(sd_model, sd_renderer) -> None:
+    """
+    Render one short image per replica at the default profile's resolution.
+
+    This bypasses the panel cache and loads the kernels and allocator pools
+    the first real request would otherwise pay for.
+    """
+    params = {**RENDER_PARAMS, "num_inference_steps": WARMUP_STEPS}
+
+    def render(replica):
+        device, pipe = replica
+        generator = torch.Generator(device=_generator_device(device)).manual_seed(BASE_SEED)
+        with pipeline_lock(pipe):
+            pipe(prompt=["warm-up"], **pipeline_kwargs(params, 1), generator=[generator])
+
+    replicas = diffusion_replicas(sd_model, sd_renderer)
+    with ThreadPoolExecutor(max_workers=len(replicas), thread_name_prefix="warmup") as pool:
+        list(pool.map(render, replicas))
+
+
+class Startup:
+    """
+    Boots the models into a ModelState and reports how far it got.
+
+    status moves pending -> loading -> warming -> ready, or to failed.
+    phases holds the start offset and duration of every step, so loads that
+    ran concurrently show up as overlapping intervals. With `connect` set,
+    the models live in another process and connecting is the only step.
+    """
+
+    def __init__(self, state: ModelState,
+                 llm_loader: Callable = load_llm,
+                 diffusion_loader: Callable = load_diffusion,
+                 llm_warmup: Optional[Callable] = warmup_llm,
+                 diffusion_warmup: Optional[Callable] = warmup_diffusion,
+                 concurrent: bool = STARTUP_CONCURRENT,
+                 warmup: bool = STARTUP_WARMUP,
+                 connect: Optional[Callable] = None):
+        self.state = state
+        self.llm_loader = llm_loader
+        self.diffusion_loader = diffusion_loader
+        self.llm_warmup = llm_warmup
+        self.diffusion_warmup = diffusion_warmup
+        self.concurrent = concurrent
+        self.warmup = warmup
+        self.connect = connect
+        self.status = "pending"
+        self.error = None
+        self.phases = {}
+        self._t0 = None
+        self._task = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    @property
+    def failed(self) -> bool:
+        return self.status == "failed"
+
+    def run(self) -> None:
+        """Load, warm up and mark the state initialized; blocks until done"""
+        self._t0 = time.perf_counter()
+        try:
+            if self.connect is not None:
+                self.status = "connecting"
+                self._phase("connect", self.connect, self.state)
+            else:
+                self.status = "loading"
+                self._steps(("load_llm", self._load_llm), ("load_diffusion", self._load_diffusion))
+                if self.warmup:
+                    self.status = "warming"
+                    steps = []
+                    if self.llm_warmup is not None:
+                        steps.append(("warmup_llm", lambda: self.llm_warmup(self.state.llm)))
+                    if self.diffusion_warmup is not None:
+                        steps.append(("warmup_diffusion", lambda: self.diffusion_warmup(
+                            self.state.sd_model, self.state.sd_renderer)))
+                    self._steps(*steps)
+            self.state.is_initialized = True
+            self.status = "ready"
+            self._record("total", self._t0)
+            logger.info(f"Models ready in {self.phases['total']['duration_s']}s: {self.phases}")
+
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            self._record("total", self._t0)
+            logger.error(f"Model startup failed: {str(e)}")
+            raise Exception(f"Model startup failed: {str(e)}")
+
+    async def start(self, background: bool = STARTUP_BACKGROUND) -> None:
+        """Run the boot sequence on a thread; in the background unless told to wait"""
+        if not background:
+            await asyncio.to_thread(self.run)
+            return
+        self._task = asyncio.create_task(asyncio.to_thread(self._run_quietly))
+
+    def report(self) -> Dict:
+        with self._lock:
+            phases = dict(self.phases)
+        report = {"status": self.status, "phases": phases}
+        if self._t0 is not None and "total" not in phases:
+            report["elapsed_s"] = round(time.perf_counter() - self._t0, 3)
+        if self.error:
+            report["error"] = self.error
+        return report
+
+    def _run_quietly(self) -> None:
+        try:
+            self.run()
+        except Exception:
+            pass  # Logged by run(); readiness and liveness report the failure
+
+    def _load_llm(self) -> None:
+        self.state.llm = self.llm_loader()
+
+    def _load_diffusion(self) -> None:
+        self.state.sd_model, self.state.sd_renderer = self.diffusion_loader()
+
+    def _steps(self, *steps) -> None:
+        """Run (name, fn) steps concurrently or in order; the first failure is raised"""
+        if not self.concurrent or len(steps) <= 1:
+            for name, fn in steps:
+                self._phase(name, fn)
+            return
+        # Leaving the pool waits for every step, so nothing is still loading
+        # when the caller sees a failure and releases the state
+        with ThreadPoolExecutor(max_workers=len(steps), thread_name_prefix="startup") as pool:
+            futures = [pool.submit(self._phase, name, fn) for name, fn in steps]
+        for future in futures:
+            future.result()
+
+    def _phase(self, name: str, fn: Callable, *args):
+        start = time.perf_counter()
+        logger.info(f"Startup phase {name} started")
+        try:
+            return fn(*args)
+        finally:
+            self._record(name, start)
+            logger.info(f"Startup phase {name} took {self.phases[name]['duration_s']}s")
+
+    def _record(self, name: str, start: float) -> None:
+        with self._lock:
+            self.phases[name] = {
+                "start_s": round(start - self._t0, 3),
+                "duration_s": round(time.perf_counter() - start, 3)
+            }
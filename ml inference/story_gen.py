@@ -1,14 +1,149 @@
 # story_gen.py
 from vllm import SamplingParams
-from load_model import load_story
+from load_model import load_story, prefix_cache_stats, STORY_MAX_MODEL_LEN
+from metrics import record_llm
+from story_stream import SceneStreamParser, stream_completion
 
 import logging
 import json
+import os
+import time
+
+try:
+    from vllm.sampling_params import GuidedDecodingParams
+except ImportError:  # vLLM without structured output support
+    GuidedDecodingParams = None
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def generate_story(data_point: dict, llm=None, sampling_params=None) -> list:
+# Constrain story decoding to the scene JSON schema
+STORY_GUIDED_JSON = os.getenv("STORY_GUIDED_JSON", "1") == "1"
+STORY_SCENE_COUNT = 10
+# Token budget per requested scene, plus a little for the array brackets.
+# A scene with a detailed image prompt and dialogue can run past 150 tokens,
+# and guided decoding stops at the closing `]` anyway, so this errs high.
+STORY_TOKENS_PER_SCENE = int(os.getenv("STORY_TOKENS_PER_SCENE", "200"))
+STORY_TOKENS_OVERHEAD = int(os.getenv("STORY_TOKENS_OVERHEAD", "32"))
+# Guided stories cut short by max_tokens are regenerated once with twice the budget
+STORY_TRUNCATION_RETRY = os.getenv("STORY_TRUNCATION_RETRY", "1") == "1"
+# Prompt length estimate when the engine has no tokenizer to ask; errs high
+PROMPT_CHARS_PER_TOKEN = 3
+
+if STORY_GUIDED_JSON and GuidedDecodingParams is None:
+    logger.warning("This vLLM build has no GuidedDecodingParams, story decoding is unconstrained")
+
+# Fixed instructions come first so every request shares the same prompt
+# prefix and vLLM can reuse its KV cache; only the tail varies per request.
+STORY_PROMPT_PREFIX = """
+You are an advanced text generator. Write a **JSON story** with the number of scenes given in the request below, about the requested topic, in the requested style and genre.
+
+The story should be educational, teaching the topic through an engaging narrative.
+Include character dialogue in EVERY scene - this is very important!
+
+### **Rules & Format**:  
+- Each scene must be a **dictionary** with four keys: `"scene"`, `"narration"`, `"image_prompt"`, and `"dialogue"`.
+- The `"scene"` key should contain the scene number, counting from 1
+- The `"narration"` key should contain descriptive text about what's happening
+- The `"image_prompt"` should be **a detailed visual description** for illustration
+- The `"dialogue"` key MUST include **character dialogue **
+- **Output must be in a valid JSON array** with no extra text before or after
+- Make the story both entertaining AND educational, explaining the topic in technical terms mixing with entertaiment kids can understand
+- Avoid every element listed under "Avoid" in the request
+
+Every scene in your JSON array must have this EXACT structure:
+{
+  "scene": (number),
+  "narration": "(descriptive text about what's happening)",
+  "image_prompt": "(detailed visual description for illustration)",
+  "dialogue": "(character dialogue with speaker name, like 'Mito: \"Hello!\"')"
+}
+DONT PRINT RESPONSE
+"""
+
+STORY_PROMPT_REQUEST = """
+### **Request**:
+Scenes: {SceneCount}
+Topic: {User}
+Style: {Style}
+Genre: {Genre}
+Avoid: {DontWantToInclude}
+
+BEGIN JSON ARRAY:
+"""
+
+def story_json_schema(scene_count: int = STORY_SCENE_COUNT) -> dict:
+    """JSON schema for an array of exactly scene_count scene objects"""
+    text = {"type": "string", "minLength": 1}
+    return {
+        "type": "array",
+        "minItems": scene_count,
+        "maxItems": scene_count,
+        "items": {
+            "type": "object",
+            "properties": {
+                "scene": {"type": "integer", "minimum": 1, "maximum": scene_count},
+                "narration": text,
+                "image_prompt": text,
+                "dialogue": text
+            },
+            "required": ["scene", "narration", "image_prompt", "dialogue"],
+            "additionalProperties": False
+        }
+    }
+
+def story_token_budget(scene_count: int = STORY_SCENE_COUNT) -> int:
+    """Upper bound on the tokens needed for scene_count scenes"""
+    return scene_count * STORY_TOKENS_PER_SCENE + STORY_TOKENS_OVERHEAD
+
+def scene_stop_strings(scene_count: int) -> list:
+    """The model opening the scene after the last one wanted, with or without a space"""
+    return [f'"scene": {scene_count + 1}', f'"scene":{scene_count + 1}']
+
+def story_sampling_params(sampling_params, scene_count: int = STORY_SCENE_COUNT):
+    """
+    Copy of sampling_params sized and constrained for scene_count scenes.
+
+    max_tokens is capped at the scene budget. With guided decoding the
+    grammar only accepts exactly scene_count scenes, so decoding ends as soon
+    as the closing `]` is written; max_tokens is then set to the scene budget
+    even when the caller asked for less, since a cut-off array is a failure.
+    Without it, decoding stops when the model starts scene scene_count + 1.
+    """
+    params = sampling_params.clone()
+    budget = story_token_budget(scene_count)
+    params.max_tokens = min(params.max_tokens or budget, budget)
+    if STORY_GUIDED_JSON and GuidedDecodingParams is not None:
+        params.guided_decoding = GuidedDecodingParams(json=story_json_schema(scene_count))
+        params.max_tokens = budget
+    else:
+        stop = getattr(params, "stop", None) or []
+        params.stop = ([stop] if isinstance(stop, str) else list(stop)) + scene_stop_strings(scene_count)
+    return params
+
+def prompt_token_count(llm, prompt: str) -> int:
+    """Tokens in prompt, from the engine's tokenizer when it has one"""
+    try:
+        return len(llm.get_tokenizer().encode(prompt))
+    except Exception:
+        return len(prompt) // PROMPT_CHARS_PER_TOKEN + 1
+
+def completion_room(llm, prompt: str) -> int:
+    """Most tokens the engine can generate after prompt within its context window"""
+    return max(1, STORY_MAX_MODEL_LEN - prompt_token_count(llm, prompt))
+
+def build_story_prompt(data_point: dict, scene_count: int = STORY_SCENE_COUNT) -> str:
+    """Build the story generation prompt: the shared template, then the request fields"""
+    return STORY_PROMPT_PREFIX + STORY_PROMPT_REQUEST.format(
+        SceneCount=scene_count,
+        User=data_point['User'],
+        Style=data_point['Style'],
+        Genre=data_point['Genre'],
+        DontWantToInclude=data_point['DontWantToInclude']
+    )
+
+def generate_story(data_point: dict, llm=None, sampling_params=None,
+                   scene_count: int = STORY_SCENE_COUNT) -> list:
     """
     Generate a story using the provided LLM model and parameters.
     
@@ -16,6 +151,7 @@ def generate_story(data_point: dict, llm=None, sampling_params=None) -> list:
         data_point (dict): Input parameters for story generation
         llm: Pre-loaded LLM model
         sampling_params: Pre-configured sampling parameters
+        scene_count (int): Number of scenes to write
     
     Returns:
         list: Generated story segments
@@ -42,38 +178,39 @@ def generate_story(data_point: dict, llm=None, sampling_params=None) -> list:
 
             )
 
-        prompt = f"""
-You are an advanced text generator. Write a **10-scene JSON story** in **{data_point['Style']}** about {data_point['User']} in {data_point['Genre']} style.  
-Avoid elements like {data_point['DontWantToInclude']}.
-
-The story should be educational,  {data_point['User']} through an engaging narrative.
-Include character dialogue in EVERY scene - this is very important!
-
-### **Rules & Format**:  
-- Each scene must be a **dictionary** with four keys: `"scene"`, `"narration"`, `"image_prompt"`, and `"dialogue"`.
-- The `"scene"` key should contain the scene number (1-10)
-- The `"narration"` key should contain descriptive text about what's happening
-- The `"image_prompt"` should be **a detailed visual description** for illustration
-- The `"dialogue"` key MUST include **character dialogue **
-- **Output must be in a valid JSON array** with no extra text before or after
-- Make the story both entertaining AND educational, explaining {data_point['User']} in technical terms mixing with entertaiment kids can understand
-
-Every scene in your JSON array must have this EXACT structure:
-{{
-  "scene": (number),
-  "narration": "(descriptive text about what's happening)",
-  "image_prompt": "(detailed visual description for illustration)",
-  "dialogue": "(character dialogue with speaker name, like 'Mito: \"Hello!\"')"
-}}
-DONT PRINT RESPONSE
-BEGIN JSON ARRAY:
-"""
+        sampling_params = story_sampling_params(sampling_params, scene_count)
+        prompt = build_story_prompt(data_point, scene_count)
+        room = completion_room(llm, prompt)
+        sampling_params.max_tokens = min(sampling_params.max_tokens, room)
 
         logger.info("Generating story...")
-        outputs = llm.generate([prompt], sampling_params)
-        raw_text = outputs[0].outputs[0].text.strip()
-        logger.info(f"Raw response length: {len(raw_text)}")
-        logger.info("Raw response: " + raw_text[:500] + "...") # First 500 chars
+        raw_text = _generate_text(llm, prompt, sampling_params)
+
+        if getattr(sampling_params, "guided_decoding", None) is not None:
+            # Constrained output is exactly the scene array: one parse, no fallbacks
+            try:
+                parsed_response = json.loads(raw_text)[:scene_count]
+                logger.info(f"Parsed guided JSON with {len(parsed_response)} scenes")
+                return parsed_response
+            except json.JSONDecodeError:
+                pass
+            # Only possible when max_tokens cut the array short; retry with
+            # more tokens if the context window has any left
+            if STORY_TRUNCATION_RETRY and sampling_params.max_tokens < room:
+                retry_params = sampling_params.clone()
+                retry_params.max_tokens = min(sampling_params.max_tokens * 2, room)
+                logger.warning(f"Guided story was truncated at {sampling_params.max_tokens} tokens, "
+                               f"retrying with {retry_params.max_tokens}")
+                raw_text = _generate_text(llm, prompt, retry_params)
+                try:
+                    return json.loads(raw_text)[:scene_count]
+                except json.JSONDecodeError:
+                    pass
+            parser = SceneStreamParser()
+            parsed_response = parser.feed(raw_text)
+            parser.close()
+            logger.warning(f"Guided story was truncated, kept {len(parsed_response)} complete scenes")
+            return parsed_response
 
         # Try to parse as JSON
         try:
@@ -81,21 +218,87 @@ BEGIN JSON ARRAY:
             if "[" in raw_text:
                 json_start = raw_text.find("[")
                 json_text = raw_text[json_start:]
-                parsed_response = json.loads(json_text)
+                parsed_response = json.loads(json_text)[:scene_count]
                 logger.info(f"Successfully parsed JSON with {len(parsed_response)} scenes")
                 return parsed_response
             else:
                 logger.warning("No JSON array found in response")
         except json.JSONDecodeError as e:
+            # Expected when the stop string cut the array after the last scene
+            parser = SceneStreamParser()
+            parsed_response = parser.feed(raw_text)[:scene_count]
+            parser.close()
+            if parsed_response:
+                logger.info(f"Parsed {len(parsed_response)} complete scenes from unterminated JSON")
+                return parsed_response
             logger.error(f"Failed to parse JSON: {e}")
         
         # Fallback to your original method if JSON parsing fails
         response = raw_text.split("\n\n")
         logger.warning(f"Falling back to newline splitting, got {len(response)} segments")
-        print("printing the response")
-        print(response)
+        logger.debug(f"Story segments: {response}")
         return response
 
     except Exception as e:
         logger.error(f"Error generating story: {str(e)}")
-        raise Exception(f"Failed to load LLM model: {e}")
\ No newline at end of file
+        raise Exception(f"Failed to load LLM model: {e}")
+
+def _generate_text(llm, prompt: str, sampling_params) -> str:
+    """One story completion, recorded in the LLM metrics"""
+    start = time.perf_counter()
+    outputs = llm.generate([prompt], sampling_params)
+    record_llm("story", outputs, time.perf_counter() - start)
+    prefix_cache_stats.record(outputs)
+    raw_text = outputs[0].outputs[0].text.strip()
+    logger.info(f"Raw response length: {len(raw_text)}")
+    logger.info("Raw response: " + raw_text[:500] + "...") # First 500 chars
+    return raw_text
+
+def stream_story(data_point: dict, llm=None, sampling_params=None,
+                 scene_count: int = STORY_SCENE_COUNT):
+    """
+    Stream the story, yielding each scene dict as soon as it is complete.
+
+    Args:
+        data_point (dict): Input parameters for story generation
+        llm: Pre-loaded LLM model
+        sampling_params: Pre-configured sampling parameters
+        scene_count (int): Number of scenes to write; decoding is aborted
+            once this many are complete
+
+    Yields:
+        dict: Parsed scene objects, in generation order
+    """
+    if llm is None:
+        logger.info("No model provided, loading new instance...")
+        llm = load_story()
+
+    if sampling_params is None:
+        sampling_params = SamplingParams(
+            temperature=0.2,
+            top_p=0.95,
+            max_tokens=750,
+            frequency_penalty=0.1,
+            presence_penalty=0.1,
+        )
+
+    sampling_params = story_sampling_params(sampling_params, scene_count)
+    prompt = build_story_prompt(data_point, scene_count)
+    sampling_params.max_tokens = min(sampling_params.max_tokens, completion_room(llm, prompt))
+    parser = SceneStreamParser()
+    count = 0
+    logger.info("Streaming story...")
+    deltas = stream_completion(llm, prompt, sampling_params)
+    try:
+        for delta in deltas:
+            for scene in parser.feed(delta)[:scene_count - count]:
+                count += 1
+                yield scene
+            # Stop decoding as soon as the last scene object is closed
+            if parser.done or count >= scene_count:
+                break
+    finally:
+        deltas.close()
+    if count < scene_count:
+        parser.close()
+    logger.info(f"Streamed {count} scenes")
@@ -1,20 +1,66 @@
 import re
+import json
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SCENE_FIELDS = ("narration", "image_prompt", "dialogue")
+
+def normalize_scene(scene, default_num=None):
+    """
+    Turn one parsed scene object into (scene_num, scene_data)
+
+    Args:
+        scene (dict): Scene object with scene/narration/image_prompt/dialogue keys
+        default_num (int): Scene number to use if the object has none
+
+    Returns:
+        tuple: (scene_num, scene_data), or None if the scene is unusable
+    """
+    if not isinstance(scene, dict):
+        return None
+    try:
+        scene_num = int(scene.get("scene", default_num))
+    except (TypeError, ValueError):
+        return None
+
+    scene_data = {}
+    for field in SCENE_FIELDS:
+        value = scene.get(field, "")
+        if not isinstance(value, str):
+            value = json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+        scene_data[field] = value.strip()
+
+    if not all(scene_data.values()):
+        logger.warning(f"Scene {scene_num} has empty fields: {scene_data}")
+        return None
+    return scene_num, scene_data
+
 def story_post_process(response):
     """
     Process the story response into a structured format
     
     Args:
-        response (list): Raw story response from the model
+        response (list): Raw story response from the model, either text
+            segments or already-parsed scene dicts
         
     Returns:
         dict: Processed story with scene information
     """
     try:
+        # Already-parsed JSON scenes need no regex pass
+        if response and all(isinstance(item, dict) for item in response):
+            story_map = {}
+            for idx, scene in enumerate(response, start=1):
+                normalized = normalize_scene(scene, default_num=idx)
+                if normalized:
+                    story_map[normalized[0]] = normalized[1]
+            if not story_map:
+                raise ValueError("No valid scenes could be processed")
+            logger.info(f"Successfully processed {len(story_map)} scenes")
+            return story_map
+
         # Combine all elements of the list into a single string
         input_text = ''.join(response)
         
@@ -0,0 +1,144 @@
+# story_stream.py
+import re
+import json
+import time
+import logging
+from typing import Iterator, List
+
+from load_model import prefix_cache_stats
+from batching import engine_loop
+from metrics import record_llm
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# A string value ends at a quote followed by `,`, `}` or the next key
+FIELD_PATTERN = r'"{}"\s*:\s*"(.*?)"\s*(?=,|}}|"\w+"\s*:)'
+
+
+class SceneStreamParser:
+    """
+    Incremental parser for a JSON array of scene objects.
+
+    Text is fed in arbitrary chunks; feed() returns every top-level object
+    whose closing brace has arrived. Leading text before the array, trailing
+    text after it, a missing `[` (objects separated by blank lines) and a
+    truncated final object are all tolerated.
+    """
+
+    def __init__(self):
+        self.done = False
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._in_array = False
+        self._object_start = None
+
+    def feed(self, text: str) -> List[dict]:
+        """Consume a chunk of model output and return completed scenes"""
+        if self.done:
+            return []
+        self._buffer += text
+        scenes = []
+
+        while self._pos < len(self._buffer):
+            char = self._buffer[self._pos]
+            self._pos += 1
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if self._depth == 0:
+                if char == "[":
+                    self._in_array = True
+                elif char == "]" and self._in_array:
+                    self.done = True
+                    break
+                elif char == "{":
+                    self._depth = 1
+                    self._object_start = self._pos - 1
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    scene = self._parse_object(self._buffer[self._object_start:self._pos])
+                    if scene is not None:
+                        scenes.append(scene)
+                    self._object_start = None
+
+        # Drop text that can no longer be part of an object
+        if self._object_start is None:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        return scenes
+
+    def close(self) -> List[dict]:
+        """Finish the stream; an unterminated trailing object is discarded"""
+        if self._object_start is not None:
+            logger.warning("Story output was truncated, dropping the incomplete last scene")
+        self.done = True
+        return []
+
+    @staticmethod
+    def _parse_object(text: str):
+        try:
+            return json.loads(text, strict=False)
+        except json.JSONDecodeError:
+            pass
+
+        # Salvage the fields from a slightly malformed object
+        scene = {}
+        number = re.search(r'"scene"\s*:\s*(\d+)', text)
+        if number:
+            scene["scene"] = int(number.group(1))
+        for field in ("narration", "image_prompt", "dialogue"):
+            match = re.search(FIELD_PATTERN.format(field), text, re.DOTALL)
+            if match:
+                scene[field] = match.group(1)
+        if "image_prompt" not in scene:
+            logger.warning(f"Skipping unparseable scene object: {text[:100]}")
+            return None
+        return scene
+
+
+def stream_completion(llm, prompt: str, sampling_params) -> Iterator[str]:
+    """
+    Yield text deltas for one prompt straight from the vLLM engine.
+
+    The request runs on the engine's shared EngineLoop, so it is decoded in
+    the same steps as batched generate() calls and other streams. Closing
+    the generator early aborts the request, which is how callers stop
+    decoding once they have enough.
+    """
+    if hasattr(type(llm), "stream_completion"):
+        # Remote engines (model_server.RemoteLLM) stream on their own
+        yield from llm.stream_completion(prompt, sampling_params)
+        return
+
+    start = time.perf_counter()
+    outputs = engine_loop(llm.llm_engine).stream(prompt, sampling_params)
+    sent = 0
+    try:
+        for output in outputs:
+            text = output.outputs[0].text
+            if output.finished:
+                record_llm("story", [output], time.perf_counter() - start)
+                prefix_cache_stats.record([output])
+            if len(text) > sent:
+                delta, sent = text[sent:], len(text)
+                yield delta
+    finally:
+        outputs.close()
@@ -0,0 +1,11 @@
+# conftest.py
+#
+# The service is a flat set of modules, not a package: put the service
+# directory and the benchmark stubs on the path. Tests of modules that need
+# torch, vllm or the private config module skip when those are missing.
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
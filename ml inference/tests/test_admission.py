@@ -0,0 +1,68 @@
+import pytest
+
+import admission
+from admission import AdmissionController, DeadlineExceeded
+
+
+def record(controller, stage, seconds, succeeded=True):
+    controller.stage_started(stage)
+    controller.stage_finished(stage, seconds, succeeded)
+
+
+def warm(controller):
+    """One request's worth of stage latencies: a 10s critical path"""
+    for stage, seconds in (("story", 2), ("story_post_process", 0), ("image", 5), ("overlay", 1),
+                           ("mcqs", 3), ("comic_page", 1), ("upload", 1)):
+        record(controller, stage, seconds)
+
+
+def test_admits_everything_before_any_data():
+    controller = AdmissionController()
+    assert controller.estimate(ahead=50, workers=2) is None
+    assert controller.admit(deadline=0.001, ahead=50, workers=2) is None
+    assert controller.counters["admitted"] == 1
+
+
+def test_service_estimate_follows_critical_path():
+    controller = AdmissionController()
+    warm(controller)
+    # image + overlay (6s) is the slower of the parallel chains, not mcqs (3s)
+    assert controller.service_estimate() == pytest.approx(10)
+
+
+def test_failed_stages_do_not_move_the_ewma():
+    controller = AdmissionController(alpha=0.5)
+    record(controller, "story", 2)
+    record(controller, "story", 100, succeeded=False)
+    assert controller.stats()["latency_ewma"]["story"] == 2
+    assert controller.stats()["inflight"] == {}
+    record(controller, "story", 4)
+    assert controller.stats()["latency_ewma"]["story"] == 3
+
+
+def test_estimate_with_a_free_worker_is_one_service_time():
+    controller = AdmissionController()
+    warm(controller)
+    assert controller.estimate(ahead=1, workers=2) == pytest.approx(10)
+
+
+def test_estimate_uses_the_most_advanced_inflight_stage():
+    controller = AdmissionController()
+    warm(controller)
+    controller.stage_started("upload")
+    controller.stage_started("story")
+    # The upload finishes in ~1s, then this job runs for a full service time
+    assert controller.estimate(ahead=2, workers=2) == pytest.approx(11)
+    # Each further wave of queued jobs adds a full service time
+    assert controller.estimate(ahead=4, workers=2) == pytest.approx(21)
+
+
+def test_rejects_past_the_deadline(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_ENABLED", True)
+    controller = AdmissionController()
+    warm(controller)
+    with pytest.raises(DeadlineExceeded) as error:
+        controller.admit(deadline=4, ahead=0, workers=1)
+    assert error.value.retry_after == 6
+    assert controller.counters["rejected"] == 1
+    assert controller.admit(deadline=30, ahead=0, workers=1) == pytest.approx(10)
@@ -0,0 +1,173 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+batching = pytest.importorskip("batching")
+from batching import EngineLoop, LLMBatcher, MicroBatcher
+from vllm import SamplingParams
+
+
+class Recorder:
+    def __init__(self, seconds: float = 0.0):
+        self.seconds = seconds
+        self.batches = []
+
+    def __call__(self, items):
+        self.batches.append(list(items))
+        time.sleep(self.seconds)
+        return [item * 10 for item in items]
+
+
+def test_items_within_the_window_share_a_batch():
+    recorder = Recorder()
+    batcher = MicroBatcher(recorder, max_wait_ms=100, max_batch_cost=100)
+    futures = [batcher.submit(number) for number in range(5)]
+    assert [future.result(2) for future in futures] == [0, 10, 20, 30, 40]
+    assert recorder.batches == [[0, 1, 2, 3, 4]]
+    batcher.close()
+
+
+def test_batch_is_flushed_when_the_budget_fills():
+    recorder = Recorder()
+    batcher = MicroBatcher(recorder, max_wait_ms=5000, max_batch_cost=6, cost_fn=lambda item: item)
+    start = time.monotonic()
+    futures = [batcher.submit(number) for number in (3, 3, 4)]
+    assert [future.result(2) for future in futures[:2]] == [30, 30]
+    assert time.monotonic() - start < 1
+    assert recorder.batches[0] == [3, 3]
+    batcher.close()
+
+
+def test_cancelled_items_are_dropped():
+    recorder = Recorder()
+    batcher = MicroBatcher(recorder, max_wait_ms=200, max_batch_cost=100)
+    futures = [batcher.submit(number) for number in range(3)]
+    assert futures[1].cancel()
+    assert futures[2].result(2) == 20
+    assert recorder.batches == [[0, 2]]
+    batcher.close()
+
+
+def test_batch_failure_reaches_every_caller():
+    def fail(items):
+        raise ValueError("engine error")
+
+    batcher = MicroBatcher(fail, max_wait_ms=50, max_batch_cost=100)
+    futures = [batcher.submit(number) for number in range(2)]
+    for future in futures:
+        with pytest.raises(ValueError, match="engine error"):
+            future.result(2)
+    batcher.close()
+    with pytest.raises(RuntimeError):
+        batcher.submit(1)
+
+
+def test_llm_batcher_merges_concurrent_calls():
+    from stub_engines import StubLLM
+
+    llm = StubLLM(latency_ms=50, token_ms=0)
+    batcher = LLMBatcher(llm, window_ms=50)
+    prompts = [f"story {number}\nScenes: {number + 1}" for number in range(8)]
+    params = [SamplingParams(max_tokens=64 * (number + 1)) for number in range(8)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        outputs = list(pool.map(lambda args: batcher.generate(*args)[0], zip(prompts, params)))
+    # Each caller gets its own prompt's completion, truncated by its own max_tokens
+    for prompt, sampling_params, output in zip(prompts, params, outputs):
+        expected = llm.completion(prompt)[:sampling_params.max_tokens * 4]
+        assert output.outputs[0].text == expected
+    assert llm.calls < 8
+    batcher.close()
+
+
+class FakeEngine:
+    """vLLM LLMEngine look-alike: each step() decodes one more character of every request"""
+
+    def __init__(self):
+        self.requests = {}
+        self.aborted = []
+        self.steps = 0
+
+    def add_request(self, request_id, prompt, sampling_params):
+        self.requests[request_id] = (prompt, 0)
+
+    def abort_request(self, request_id):
+        if self.requests.pop(request_id, None) is not None:
+            self.aborted.append(request_id)
+
+    def step(self):
+        time.sleep(0.001)
+        self.steps += 1
+        outputs = []
+        for request_id, (prompt, decoded) in list(self.requests.items()):
+            decoded += 1
+            finished = decoded == len(prompt)
+            if finished:
+                del self.requests[request_id]
+            else:
+                self.requests[request_id] = (prompt, decoded)
+            outputs.append(SimpleNamespace(request_id=request_id, finished=finished,
+                                           outputs=[SimpleNamespace(text=prompt[:decoded].upper())]))
+        return outputs
+
+
+def test_engine_loop_generate_returns_final_outputs_in_order():
+    loop = EngineLoop(FakeEngine())
+    outputs = loop.generate(["abc", "hello world", "x"], [None] * 3)
+    assert [output.outputs[0].text for output in outputs] == ["ABC", "HELLO WORLD", "X"]
+    loop.close()
+
+
+def test_engine_loop_streams_share_steps_with_generate():
+    engine = FakeEngine()
+    loop = EngineLoop(engine)
+    streamed = []
+
+    def read_stream():
+        for output in loop.stream("streaming prompt", None):
+            streamed.append(output.outputs[0].text)
+
+    reader = threading.Thread(target=read_stream)
+    reader.start()
+    assert loop.generate(["batched prompt text"], [None])[0].outputs[0].text == "BATCHED PROMPT TEXT"
+    reader.join(5)
+    assert streamed[-1] == "STREAMING PROMPT"
+    # Both were decoded together rather than one after the other
+    assert engine.steps < len("streaming prompt") + len("batched prompt text")
+    loop.close()
+
+
+def test_closing_a_stream_aborts_its_request():
+    engine = FakeEngine()
+    loop = EngineLoop(engine)
+    stream = loop.stream("a long prompt that will not finish", None)
+    assert next(stream).outputs[0].text == "A"
+    stream.close()
+    assert len(engine.aborted) == 1
+    loop.close()
+
+
+def test_engine_step_failure_fails_waiting_callers():
+    engine = FakeEngine()
+    engine.step = lambda: (_ for _ in ()).throw(RuntimeError("CUDA error"))
+    loop = EngineLoop(engine)
+    with pytest.raises(RuntimeError, match="CUDA error"):
+        loop.generate(["prompt"], [None])
+    loop.close()
+
+
+def test_llm_batcher_does_not_wait_for_earlier_batches():
+    engine = FakeEngine()
+    batcher = LLMBatcher(SimpleNamespace(llm_engine=engine), window_ms=5)
+    long_prompt = "x" * 2000
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        long_call = pool.submit(batcher.generate, [long_prompt])
+        while not engine.requests:
+            time.sleep(0.001)
+        # Formed and answered while the first batch is still decoding
+        assert batcher.generate(["short"])[0].outputs[0].text == "SHORT"
+        assert not long_call.done()
+        assert long_call.result(10)[0].outputs[0].text == long_prompt.upper()
+    batcher.close()
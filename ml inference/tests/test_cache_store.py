@@ -0,0 +1,59 @@
+import os
+
+from cache_store import TieredCache
+
+
+def test_memory_lru_evicts_by_bytes():
+    cache = TieredCache("test", memory_max_bytes=10)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"  # a is now the most recent
+    cache.put("c", b"cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa"
+    assert cache.get("c") == b"cccc"
+    stats = cache.stats()
+    assert stats["memory_evictions"] == 1
+    assert stats["memory_bytes"] == 8
+    assert (stats["hits"], stats["misses"]) == (3, 1)
+
+
+def test_entries_larger_than_memory_go_to_disk_only(tmp_path):
+    cache = TieredCache("test", memory_max_bytes=4, disk_dir=str(tmp_path), disk_max_bytes=100)
+    cache.put("large", b"x" * 10)
+    assert cache.stats()["memory_entries"] == 0
+    assert cache.get("large") == b"x" * 10
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_disk_tier_survives_restart_and_promotes_hits(tmp_path):
+    first = TieredCache("test", memory_max_bytes=100, disk_dir=str(tmp_path), disk_max_bytes=100)
+    first.put("key1", b"one")
+    first.put("key2", b"two")
+
+    second = TieredCache("test", memory_max_bytes=100, disk_dir=str(tmp_path), disk_max_bytes=100)
+    assert second.stats()["disk_entries"] == 2
+    assert second.get("key1") == b"one"
+    assert second.get("key1") == b"one"
+    stats = second.stats()
+    assert (stats["disk_hits"], stats["memory_hits"]) == (1, 1)
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    cache = TieredCache("test", memory_max_bytes=0, disk_dir=str(tmp_path), disk_max_bytes=8)
+    cache.put("key1", b"1111")
+    cache.put("key2", b"2222")
+    cache.put("key3", b"3333")
+    stats = cache.stats()
+    assert stats["disk_evictions"] == 1
+    assert stats["disk_bytes"] == 8
+    assert cache.get("key1") is None
+    assert not os.path.exists(os.path.join(str(tmp_path), "ke", "key1"))
+
+
+def test_file_removed_behind_the_cache_is_a_miss(tmp_path):
+    cache = TieredCache("test", memory_max_bytes=0, disk_dir=str(tmp_path), disk_max_bytes=100)
+    cache.put("key1", b"data")
+    os.remove(os.path.join(str(tmp_path), "ke", "key1"))
+    assert cache.get("key1") is None
+    assert cache.stats()["disk_entries"] == 0
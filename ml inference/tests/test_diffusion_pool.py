@@ -0,0 +1,75 @@
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+diffusion_pool = pytest.importorskip("diffusion_pool")
+from diffusion_pool import DiffusionWorkerPool
+
+
+class FakeBatcher:
+    """Holds every submitted scene until the test finishes it"""
+
+    def __init__(self, pipe, device=None):
+        self.device = device
+        self.futures = []
+        self._lock = threading.Lock()
+
+    def submit(self, prompt, seed, profile=None):
+        future = Future()
+        with self._lock:
+            self.futures.append(future)
+        return future
+
+    def close(self):
+        pass
+
+
+def test_pool_places_scenes_on_the_least_loaded_replica():
+    pool = DiffusionWorkerPool([("cuda:0", None), ("cuda:1", None)], batcher_factory=FakeBatcher)
+    futures = [pool.submit(f"scene {number}", number) for number in range(4)]
+    assert pool.stats() == {"cuda:0": {"inflight": 2, "completed": 0}, "cuda:1": {"inflight": 2, "completed": 0}}
+
+    pool.workers[0].batcher.futures[0].set_result("image")
+    assert pool.pending == 3
+    pool.submit("scene 4", 4)
+    assert [worker.inflight for worker in pool.workers] == [2, 2]
+    assert futures[0].result() == "image"
+    pool.close()
+
+
+def test_pool_needs_a_replica():
+    with pytest.raises(ValueError):
+        DiffusionWorkerPool([])
+
+
+class DoneBatcher(FakeBatcher):
+    def submit(self, prompt, seed, profile=None):
+        future = super().submit(prompt, seed, profile)
+        future.set_result((self.device, seed))
+        return future
+
+
+def test_request_placement_keeps_a_render_on_one_replica():
+    pool = DiffusionWorkerPool([("cuda:0", None), ("cuda:1", None)], placement="request",
+                               batcher_factory=DoneBatcher)
+    images = pool.render(["a", "b", "c"], [1, 2, 3])
+    assert [seed for _, seed in images] == [1, 2, 3]
+    assert len({device for device, _ in images}) == 1
+    assert pool.pending == 0
+    pool.close()
+
+
+def test_request_placement_releases_slots_when_a_submit_fails():
+    class FailingBatcher(DoneBatcher):
+        def submit(self, prompt, seed, profile=None):
+            if prompt == "bad":
+                raise RuntimeError("queue closed")
+            return super().submit(prompt, seed, profile)
+
+    pool = DiffusionWorkerPool([("cuda:0", None), ("cuda:1", None)], placement="request",
+                               batcher_factory=FailingBatcher)
+    with pytest.raises(RuntimeError):
+        pool.render(["a", "bad", "c", "d"], [1, 2, 3, 4])
+    assert pool.pending == 0
+    pool.close()
@@ -0,0 +1,156 @@
+import asyncio
+import threading
+
+import pytest
+
+jobs = pytest.importorskip("jobs")
+from admission import JobCancelled
+from jobs import DEFAULT_JOB_SECONDS, JobScheduler, QueueFullError
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+
+class Runner:
+    """Records the payloads it runs; payloads in `hold` block until released"""
+
+    def __init__(self, hold=()):
+        self.ran = []
+        self.hold = set(hold)
+        self.release = threading.Event()
+
+    def __call__(self, payload, progress, cancelled, deliver=None):
+        self.ran.append(payload)
+        progress("working", {"payload": payload})
+        if payload in self.hold:
+            while not self.release.wait(0.01):
+                if cancelled.is_set():
+                    raise RuntimeError("stopped between stages")
+        if payload == "fail":
+            raise ValueError("runner failed")
+        if deliver is not None:
+            deliver("story", {"story": payload})
+            deliver("panel", {"scene": 1})
+        return {"payload": payload}
+
+
+async def started(scheduler, count=1):
+    while scheduler.running < count:
+        await asyncio.sleep(0.01)
+
+
+def test_higher_priority_runs_first():
+    runner = Runner(hold={"blocker"})
+
+    async def scenario():
+        scheduler = JobScheduler(runner, capacity=8, workers=1)
+        await scheduler.start()
+        scheduler.submit("blocker")
+        await started(scheduler)
+        queued = [scheduler.submit(name, priority=priority)
+                  for name, priority in (("low", 0), ("high", 5), ("mid", 1), ("high2", 5))]
+        runner.release.set()
+        for job in queued:
+            await scheduler.wait(job)
+        await scheduler.stop()
+
+    run(scenario())
+    assert runner.ran == ["blocker", "high", "high2", "mid", "low"]
+
+
+def test_full_queue_raises_with_retry_after():
+    runner = Runner(hold={"a", "b"})
+
+    async def scenario():
+        scheduler = JobScheduler(runner, capacity=2, workers=2)
+        await scheduler.start()
+        scheduler.submit("a")
+        scheduler.submit("b")
+        await started(scheduler, 2)
+        scheduler.submit("c")
+        scheduler.submit("d")
+        with pytest.raises(QueueFullError) as error:
+            scheduler.submit("e")
+        runner.release.set()
+        await scheduler.stop()
+        return error.value.retry_after
+
+    # Two queued jobs over two workers: one more job's time before a slot frees
+    assert run(scenario()) == int(DEFAULT_JOB_SECONDS * 2)
+
+
+def test_cancel_queued_job_never_runs():
+    runner = Runner(hold={"blocker"})
+
+    async def scenario():
+        scheduler = JobScheduler(runner, capacity=8, workers=1)
+        await scheduler.start()
+        blocker = scheduler.submit("blocker")
+        await started(scheduler)
+        job = scheduler.submit("queued")
+        assert scheduler.cancel(job, "client went away")
+        assert job.status == "cancelled"
+        with pytest.raises(JobCancelled):
+            await scheduler.wait(job)
+        runner.release.set()
+        await scheduler.wait(blocker)
+        assert not scheduler.cancel(blocker)
+        await scheduler.stop()
+
+    run(scenario())
+    assert runner.ran == ["blocker"]
+
+
+def test_cancel_running_job():
+    runner = Runner(hold={"long"})
+
+    async def scenario():
+        scheduler = JobScheduler(runner, capacity=8, workers=1)
+        await scheduler.start()
+        job = scheduler.submit("long")
+        await started(scheduler)
+        scheduler.cancel(job, "deadline exceeded")
+        with pytest.raises(JobCancelled):
+            await scheduler.wait(job)
+        await scheduler.stop()
+        return job
+
+    job = run(scenario())
+    assert (job.status, job.error) == ("cancelled", "deadline exceeded")
+    assert job.events[-1]["stage"] == "cancelled"
+
+
+def test_failed_job_reraises():
+    async def scenario():
+        scheduler = JobScheduler(Runner(), capacity=8, workers=1)
+        await scheduler.start()
+        job = scheduler.submit("fail")
+        with pytest.raises(ValueError, match="runner failed"):
+            await scheduler.wait(job)
+        await scheduler.stop()
+        return job
+
+    assert run(scenario()).status == "failed"
+
+
+def test_results_streams_partial_outputs():
+    async def scenario():
+        scheduler = JobScheduler(Runner(), capacity=8, workers=1)
+        await scheduler.start()
+        job = scheduler.submit("comic", outputs=True)
+        outputs = [output async for output in job.results()]
+        stages = [event["stage"] async for event in job.stream()]
+        await scheduler.stop()
+        return job, outputs, stages
+
+    job, outputs, stages = run(scenario())
+    assert outputs == [{"type": "story", "story": "comic"}, {"type": "panel", "scene": 1}]
+    assert job.outputs == []
+    assert stages == ["queued", "working", "succeeded"]
+    assert job.result == {"payload": "comic"}
+
+
+def test_submit_before_start_is_an_error():
+    with pytest.raises(RuntimeError):
+        JobScheduler(Runner()).submit("early")
@@ -0,0 +1,183 @@
+import os
+import stat
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import AuthenticationError, shared_memory
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+import model_server
+from model_server import (ModelServer, ModelServerClient, RemoteLLM, RemoteRenderer, export_image,
+                          import_image, sweep_exported)
+
+
+class FakeLLM:
+    """Echoes prompts back after a short decode, counting concurrent calls"""
+
+    def __init__(self, seconds: float = 0.05):
+        self.seconds = seconds
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def generate(self, prompts, sampling_params=None):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(self.seconds)
+        with self._lock:
+            self.active -= 1
+        return [
+            SimpleNamespace(outputs=[SimpleNamespace(text=prompt.upper(), token_ids=[1, 2])], prompt_token_ids=[3])
+            for prompt in prompts
+        ]
+
+
+class FakeRenderer:
+    def submit(self, prompt, seed, profile=None):
+        future = Future()
+        future.set_result(Image.new("RGB", (8, 4), (seed % 256, 10, 20)))
+        return future
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """A model server on a fresh socket, with a generated key file"""
+    monkeypatch.setattr(model_server, "MODEL_SERVER_AUTHKEY", "")
+    # Unix socket paths are short; pytest's tmp_path can be too long
+    directory = tempfile.mkdtemp(prefix="ms", dir="/tmp")
+    address = os.path.join(directory, "models.sock")
+    state = SimpleNamespace(is_initialized=True, llm=FakeLLM(), sd_model=None, sd_renderer=FakeRenderer())
+    instance = ModelServer(state, address)
+    threading.Thread(target=instance.serve_forever, daemon=True).start()
+    for _ in range(200):
+        if os.path.exists(address):
+            break
+        time.sleep(0.01)
+    yield instance
+    # The listener unlinks its own socket at exit
+    os.remove(model_server.key_path(address))
+
+
+def test_socket_and_key_file_are_owner_only(server):
+    assert stat.S_IMODE(os.stat(server.address).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(model_server.key_path(server.address)).st_mode) == 0o600
+
+
+def test_client_reads_the_generated_key(server):
+    client = ModelServerClient(server.address)
+    assert client.call("ping") == {"initialized": True}
+    client.close()
+
+
+def test_wrong_key_is_rejected(server):
+    client = ModelServerClient(server.address, authkey=b"not-the-key")
+    with pytest.raises(AuthenticationError):
+        client.call("ping")
+    assert client.open_connections == 0
+    # The server keeps serving after a failed handshake
+    assert ModelServerClient(server.address).call("ping") == {"initialized": True}
+
+
+def test_connections_are_reused_across_threads(server):
+    client = ModelServerClient(server.address)
+    llm = RemoteLLM(client)
+    for number in range(20):
+        thread = threading.Thread(target=llm.generate, args=([f"prompt {number}"],))
+        thread.start()
+        thread.join()
+    assert client.open_connections == 1
+    client.close()
+
+
+def test_pool_bounds_connections(server):
+    client = ModelServerClient(server.address, max_connections=3)
+    llm = RemoteLLM(client)
+    results = {}
+
+    def call(number):
+        results[number] = llm.generate([f"p{number}"])[0].outputs[0].text
+
+    threads = [threading.Thread(target=call, args=(number,)) for number in range(30)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {number: f"P{number}" for number in range(30)}
+    assert client.open_connections <= 3
+    assert server.state.llm.peak <= 3
+    client.close()
+
+
+def test_remote_error_keeps_the_connection(server):
+    client = ModelServerClient(server.address)
+    with pytest.raises(model_server.RemoteError):
+        client.call("generate", None, None)
+    assert client.call("ping") == {"initialized": True}
+    assert client.open_connections == 1
+    client.close()
+
+
+def test_stream_closed_early_drops_its_connection(server):
+    stopped = threading.Event()
+
+    def stream(prompt, sampling_params):
+        try:
+            for number in range(1000):
+                time.sleep(0.001)
+                yield str(number)
+        finally:
+            stopped.set()
+
+    server._stream = stream
+    client = ModelServerClient(server.address)
+    deltas = client.stream("stream", "prompt", None)
+    assert next(deltas) == "0"
+    deltas.close()
+    assert client.open_connections == 0
+    assert stopped.wait(2)
+    assert client.call("ping") == {"initialized": True}
+    client.close()
+
+
+def test_render_round_trip_frees_shared_memory(server):
+    pytest.importorskip("stable_diffusion")
+    renderer = RemoteRenderer(ModelServerClient(server.address))
+    images = renderer.render(["a", "b"], [1, 2])
+    assert [image.getpixel((0, 0)) for image in images] == [(1, 10, 20), (2, 10, 20)]
+    assert renderer.pending == 0
+    renderer.close()
+
+
+def test_import_unlinks_the_block():
+    image = Image.new("RGB", (5, 3), (7, 8, 9))
+    handle = export_image(image)
+    copy = import_image(handle)
+    assert copy.size == (5, 3) and copy.getpixel((4, 2)) == (7, 8, 9)
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=handle["shm"])
+
+
+def test_sweep_frees_unclaimed_blocks():
+    handle = export_image(Image.new("RGB", (2, 2)))
+    sweep_exported(ttl=0)
+    assert handle["shm"] not in model_server._exported
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=handle["shm"])
+
+
+def test_withdrawn_render_is_not_counted_as_pending(server):
+    renderer = RemoteRenderer(ModelServerClient(server.address), max_workers=1)
+    release = threading.Event()
+    blocker = renderer._executor.submit(release.wait)
+    queued = renderer.submit("a", 1)
+    assert renderer.pending == 1
+    assert queued.cancel()
+    assert renderer.pending == 0
+    release.set()
+    blocker.result()
+    renderer.close()
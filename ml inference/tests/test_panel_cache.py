@@ -0,0 +1,56 @@
+import pytest
+from PIL import Image
+
+stable_diffusion = pytest.importorskip("stable_diffusion")
+from stable_diffusion import PanelCache, RENDER_PARAMS, render_batch, render_scene
+from stub_engines import StubDiffusionPipe
+
+
+@pytest.fixture
+def panel_cache(monkeypatch):
+    cache = PanelCache(disk_dir=None)
+    monkeypatch.setattr(stable_diffusion, "panel_cache", cache)
+    return cache
+
+
+def test_key_covers_seed_and_render_params():
+    key = PanelCache.key("a castle", 1, RENDER_PARAMS)
+    assert key == PanelCache.key("a castle", 1, dict(RENDER_PARAMS))
+    assert key != PanelCache.key("a castle", 2, RENDER_PARAMS)
+    assert key != PanelCache.key("a castle", 1, {**RENDER_PARAMS, "num_inference_steps": 1})
+
+
+def test_round_trip(panel_cache):
+    image = Image.new("RGB", (6, 4), (1, 2, 3))
+    panel_cache.put("a castle", 7, RENDER_PARAMS, image)
+    cached = panel_cache.get("a castle", 7, RENDER_PARAMS)
+    assert cached.size == (6, 4) and cached.getpixel((5, 3)) == (1, 2, 3)
+    assert panel_cache.get("a castle", 8, RENDER_PARAMS) is None
+
+
+def test_render_batch_only_renders_missing_panels(panel_cache):
+    pipe = StubDiffusionPipe(step_ms=0.1)
+    params = {**RENDER_PARAMS, "width": 64, "height": 64}
+    first = render_batch(pipe, ["a", "b"], [1, 2], params)
+    again = render_batch(pipe, ["a", "b", "c"], [1, 2, 3], params)
+    assert pipe.batches == [2, 1]
+    assert [image.tobytes() for image in again[:2]] == [image.tobytes() for image in first]
+
+
+def test_unbatched_render_uses_the_scene_seed(monkeypatch):
+    monkeypatch.setattr(stable_diffusion, "panel_cache", None)
+    pipe = StubDiffusionPipe(step_ms=0.01)
+    scenes = {number: {"image_prompt": "a tower", "dialogue": "Hi"} for number in (1, 2)}
+    unbatched = [render_scene(number, content, model=pipe, batched=False) for number, content in scenes.items()]
+    batched = [render_scene(number, content, model=pipe, batched=True) for number, content in scenes.items()]
+    assert [image.tobytes() for image in unbatched] == [image.tobytes() for image in batched]
+    assert unbatched[0].tobytes() != unbatched[1].tobytes()
+
+
+def test_batched_and_unbatched_renders_share_cache_entries(panel_cache):
+    pipe = StubDiffusionPipe(step_ms=0.01)
+    content = {"image_prompt": "a bridge", "dialogue": "Go"}
+    render_scene(3, content, model=pipe, batched=True)
+    render_scene(3, content, model=pipe, batched=False)
+    assert pipe.batches == [1]
+    assert panel_cache.stats()["hits"] == 1
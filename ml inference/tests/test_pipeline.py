@@ -0,0 +1,23 @@
+import pytest
+
+pipeline = pytest.importorskip("pipeline")
+from pipeline import _all_uploaded
+
+
+def test_callback_waits_for_every_upload():
+    calls = []
+    on_done = _all_uploaded(3, calls.append)
+    on_done("https://bucket/full.png")
+    on_done("https://bucket/thumb.webp")
+    assert calls == []
+    on_done("https://bucket/preview.webp")
+    assert calls == ["https://bucket/preview.webp"]
+
+
+def test_any_failed_upload_is_reported():
+    calls = []
+    on_done = _all_uploaded(3, calls.append)
+    on_done("https://bucket/full.png")
+    on_done(None)
+    on_done("https://bucket/preview.webp")
+    assert calls == [None]
@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+import pytest
+
+result_cache = pytest.importorskip("result_cache")
+from result_cache import FIELD_DEFAULTS, ResultCache, request_cache_key
+
+CONFIG = {"llm": "model-a", "temperature": 0.7}
+
+
+def request(**fields):
+    values = {field: None for field in result_cache.REQUEST_FIELDS}
+    values.update(user_theme="A Robot  in the CITY", genre="Sci-Fi", panel_count=4)
+    values.update(fields)
+    return SimpleNamespace(**values)
+
+
+def test_key_ignores_case_and_whitespace():
+    assert request_cache_key(request(), CONFIG) == request_cache_key(request(user_theme=" a robot in the city "), CONFIG)
+
+
+def test_key_changes_with_content_and_config():
+    key = request_cache_key(request(), CONFIG)
+    assert key != request_cache_key(request(genre="Fantasy"), CONFIG)
+    assert key != request_cache_key(request(panel_count=6), CONFIG)
+    assert key != request_cache_key(request(), {**CONFIG, "temperature": 0.9})
+
+
+def test_unset_field_matches_its_default():
+    default = FIELD_DEFAULTS["output_format"]
+    assert request_cache_key(request(), CONFIG) == request_cache_key(request(output_format=default), CONFIG)
+    defaults = {**FIELD_DEFAULTS, "render_profile": "standard"}
+    assert (request_cache_key(request(), CONFIG, defaults)
+            == request_cache_key(request(render_profile="standard"), CONFIG, defaults))
+
+
+def test_round_trip(tmp_path):
+    cache = ResultCache(memory_max_bytes=1024 ** 2, disk_dir=str(tmp_path), disk_max_bytes=1024 ** 2)
+    assert cache.get(request(), CONFIG) is None
+    cache.put(request(), CONFIG, {"1": {"narration": "n"}}, ["q1"], "https://bucket/page.png",
+              {"thumb": "https://bucket/thumb.webp"})
+    entry = ResultCache(disk_dir=str(tmp_path)).get(request(genre="sci-fi"), CONFIG)
+    assert entry["image_url"] == "https://bucket/page.png"
+    assert entry["renditions"] == {"thumb": "https://bucket/thumb.webp"}
+    assert entry["mcqs"] == ["q1"]
+    assert "page_bytes" not in entry
@@ -0,0 +1,89 @@
+import threading
+import time
+
+import pytest
+
+from stage_graph import GraphCancelled, StageGraph
+
+
+def test_stages_receive_dependency_results_in_order():
+    graph = StageGraph()
+    graph.add("a", lambda: 2)
+    graph.add("b", lambda: 3)
+    graph.add("sum", lambda a, b: a + b, deps=("a", "b"))
+    graph.add("double", lambda total: total * 2, deps=("sum",))
+    assert graph.run() == {"a": 2, "b": 3, "sum": 5, "double": 10}
+
+
+def test_independent_stages_overlap():
+    graph = StageGraph()
+    for name in ("a", "b", "c"):
+        graph.add(name, lambda: time.sleep(0.2))
+    start = time.perf_counter()
+    graph.run()
+    assert time.perf_counter() - start < 0.5
+    assert graph.timing_report()["overlap_saved"] > 0.2
+
+
+def test_stage_can_add_stages_while_running():
+    graph = StageGraph()
+
+    def story():
+        for number in range(3):
+            graph.add(f"image_{number}", lambda story, number=number: number * 10, deps=("story",))
+        return "story"
+
+    graph.add("story", story)
+    results = graph.run()
+    assert [results[f"image_{number}"] for number in range(3)] == [0, 10, 20]
+
+
+def test_duplicate_stage_is_rejected():
+    graph = StageGraph()
+    graph.add("a", lambda: 1)
+    with pytest.raises(ValueError):
+        graph.add("a", lambda: 2)
+
+
+def test_unmet_dependency_is_reported():
+    graph = StageGraph()
+    graph.add("a", lambda missing: missing, deps=("missing",))
+    with pytest.raises(RuntimeError, match="unmet dependencies"):
+        graph.run()
+
+
+def test_failure_propagates_and_skips_dependents():
+    ran = []
+    ends = []
+    graph = StageGraph(on_stage_end=lambda name, seconds, succeeded: ends.append((name, succeeded)))
+
+    def fail():
+        raise ValueError("boom")
+
+    graph.add("fail", fail)
+    graph.add("after", lambda _: ran.append("after"), deps=("fail",))
+    with pytest.raises(ValueError, match="boom"):
+        graph.run()
+    assert ran == []
+    assert ends == [("fail", False)]
+
+
+def test_cancel_waits_for_running_stages():
+    cancelled = threading.Event()
+    finished = threading.Event()
+    ends = []
+
+    def slow():
+        cancelled.set()
+        time.sleep(0.3)
+        finished.set()
+
+    graph = StageGraph(cancelled=cancelled, poll_interval=0.01,
+                       on_stage_end=lambda name, seconds, succeeded: ends.append((name, succeeded)))
+    graph.add("slow", slow)
+    graph.add("next", lambda _: None, deps=("slow",))
+    with pytest.raises(GraphCancelled):
+        graph.run()
+    # run() only returns once the running stage is done, and nothing after it started
+    assert finished.is_set()
+    assert ends == [("slow", False)]
@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+startup = pytest.importorskip("startup")
+from model_state import ModelState
+from startup import Startup
+from stub_engines import StubDiffusionPipe, StubLLM, stub_startup
+
+
+def slow(value, seconds=0.2):
+    def load():
+        time.sleep(seconds)
+        return value
+    return load
+
+
+def test_loads_concurrently_and_becomes_ready():
+    state = ModelState()
+    boot = Startup(state, llm_loader=slow("llm"), diffusion_loader=slow(("pipe", "renderer")),
+                   concurrent=True, warmup=False)
+    assert not boot.ready
+    boot.run()
+    assert boot.ready and state.is_initialized
+    assert (state.llm, state.sd_model, state.sd_renderer) == ("llm", "pipe", "renderer")
+    report = boot.report()
+    assert set(report["phases"]) == {"load_llm", "load_diffusion", "total"}
+    # Both loads overlapped
+    assert report["phases"]["total"]["duration_s"] < 0.35
+
+
+def test_warmup_runs_on_the_loaded_models():
+    warmed = []
+    state = ModelState()
+    Startup(state, llm_loader=lambda: "llm", diffusion_loader=lambda: ("pipe", "renderer"),
+            llm_warmup=warmed.append, diffusion_warmup=lambda pipe, renderer: warmed.append((pipe, renderer)),
+            warmup=True).run()
+    assert len(warmed) == 2
+    assert "llm" in warmed and ("pipe", "renderer") in warmed
+
+
+def test_failed_load_is_reported():
+    def fail():
+        raise OSError("out of memory")
+
+    state = ModelState()
+    boot = Startup(state, llm_loader=fail, diffusion_loader=slow(("pipe", None)), warmup=False)
+    with pytest.raises(Exception, match="out of memory"):
+        boot.run()
+    assert boot.failed and not state.is_initialized
+    assert "out of memory" in boot.report()["error"]
+    # The other load was waited for, not left running
+    assert "load_diffusion" in boot.report()["phases"]
+
+
+def test_background_start_reports_progress():
+    import asyncio
+
+    async def scenario():
+        boot = Startup(ModelState(), llm_loader=slow("llm"), diffusion_loader=slow(("pipe", None)), warmup=False)
+        await boot.start(background=True)
+        await asyncio.sleep(0.05)
+        assert boot.status == "loading"
+        assert "elapsed_s" in boot.report()
+        await boot._task
+        return boot
+
+    assert asyncio.run(scenario()).ready
+
+
+def test_stub_startup_boots_the_real_front_ends():
+    state = ModelState()
+    stub_startup(state, StubLLM(latency_ms=1), StubDiffusionPipe(step_ms=0.1)).run()
+    assert state.is_initialized
+    assert state.llm.generate(["story\nScenes: 2"])[0].outputs[0].text
+    for component in (state.llm, state.sd_renderer):
+        if hasattr(component, "close"):
+            component.close()
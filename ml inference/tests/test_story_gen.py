@@ -0,0 +1,62 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+story_gen = pytest.importorskip("story_gen")
+from story_gen import STORY_MAX_MODEL_LEN, generate_story, story_sampling_params, story_token_budget
+from vllm import SamplingParams
+
+DATA_POINT = {"User": "volcanoes", "Style": "manga", "Genre": "adventure", "DontWantToInclude": "none"}
+SCENES = [{"scene": n, "narration": f"n{n}", "image_prompt": f"p{n}", "dialogue": f"d{n}"} for n in (1, 2, 3)]
+
+
+class ScriptedLLM:
+    """Returns the given completions in turn and records each call's SamplingParams"""
+
+    def __init__(self, *texts, prompt_tokens: int = 500):
+        self.texts = list(texts)
+        self.prompt_tokens = prompt_tokens
+        self.params = []
+
+    def get_tokenizer(self):
+        return SimpleNamespace(encode=lambda prompt: [0] * self.prompt_tokens)
+
+    def generate(self, prompts, sampling_params):
+        self.params.append(sampling_params)
+        text = self.texts.pop(0)
+        return [SimpleNamespace(outputs=[SimpleNamespace(text=text, token_ids=[0])],
+                                prompt_token_ids=[0] * self.prompt_tokens, num_cached_tokens=0)]
+
+
+def test_unguided_decoding_stops_after_the_last_scene(monkeypatch):
+    monkeypatch.setattr(story_gen, "STORY_GUIDED_JSON", False)
+    params = story_sampling_params(SamplingParams(max_tokens=5000, stop=["###"]), scene_count=4)
+    assert params.stop == ["###", '"scene": 5', '"scene":5']
+    assert params.max_tokens == story_token_budget(4)
+
+
+def test_unguided_story_cut_at_the_stop_string_is_parsed(monkeypatch):
+    monkeypatch.setattr(story_gen, "STORY_GUIDED_JSON", False)
+    # vLLM leaves the stop string out; the next object's brace is left open
+    text = json.dumps(SCENES)[:-1] + ', {\n  '
+    assert generate_story(DATA_POINT, ScriptedLLM(text), SamplingParams(), scene_count=3) == SCENES
+
+
+def test_truncation_retry_stays_within_the_context_window(monkeypatch):
+    monkeypatch.setattr(story_gen, "STORY_GUIDED_JSON", True)
+    complete = json.dumps(SCENES)
+    llm = ScriptedLLM(complete[:50], complete, prompt_tokens=1500)
+    assert generate_story(DATA_POINT, llm, SamplingParams(), scene_count=10) == SCENES
+    first, retry = [params.max_tokens for params in llm.params]
+    assert first == story_token_budget(10)
+    # Twice the budget would overflow the window, so the retry gets what is left
+    assert retry == STORY_MAX_MODEL_LEN - 1500 < 2 * first
+
+
+def test_no_retry_without_room_left(monkeypatch):
+    monkeypatch.setattr(story_gen, "STORY_GUIDED_JSON", True)
+    complete = json.dumps(SCENES)
+    llm = ScriptedLLM(complete[:-10], prompt_tokens=3900)
+    assert generate_story(DATA_POINT, llm, SamplingParams(), scene_count=10) == SCENES[:2]
+    assert [params.max_tokens for params in llm.params] == [STORY_MAX_MODEL_LEN - 3900]
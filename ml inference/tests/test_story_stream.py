@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+story_stream = pytest.importorskip("story_stream")
+from story_stream import SceneStreamParser
+
+SCENES = [
+    {"scene": 1, "narration": "A {curly} start", "image_prompt": "a city at dawn", "dialogue": "\"Hi\""},
+    {"scene": 2, "narration": "The end]", "image_prompt": "a tower", "dialogue": "Bye"},
+]
+
+
+def feed_in_chunks(parser, text, size):
+    scenes = []
+    for start in range(0, len(text), size):
+        scenes.extend(parser.feed(text[start:start + size]))
+    return scenes
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1000])
+def test_scenes_arrive_as_their_objects_close(size):
+    text = "Here is the story:\n" + json.dumps(SCENES) + "\nHope you like it {not json}"
+    parser = SceneStreamParser()
+    assert feed_in_chunks(parser, text, size) == SCENES
+    assert parser.done
+
+
+def test_first_scene_is_returned_before_the_array_ends():
+    text = json.dumps(SCENES)
+    parser = SceneStreamParser()
+    first_end = text.index("}, {") + 1
+    assert parser.feed(text[:first_end]) == SCENES[:1]
+    assert parser.feed(text[first_end:]) == SCENES[1:]
+
+
+def test_objects_without_an_array():
+    text = "\n\n".join(json.dumps(scene) for scene in SCENES)
+    assert SceneStreamParser().feed(text) == SCENES
+
+
+def test_truncated_last_object_is_dropped():
+    text = json.dumps(SCENES)
+    parser = SceneStreamParser()
+    assert parser.feed(text[:-20]) == SCENES[:1]
+    assert parser.close() == []
+    assert parser.feed("more") == []
+
+
+def test_malformed_object_is_salvaged():
+    text = '[{"scene": 3, "narration": "He said "go" now", "image_prompt": "a door", "dialogue": "Go"}]'
+    assert SceneStreamParser().feed(text) == [
+        {"scene": 3, "narration": 'He said "go" now', "image_prompt": "a door", "dialogue": "Go"}
+    ]
+
+
+def test_object_without_an_image_prompt_is_skipped():
+    text = '[{"scene": 1, "narration": broken}, ' + json.dumps(SCENES[1]) + "]"
+    assert SceneStreamParser().feed(text) == SCENES[1:]